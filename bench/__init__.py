@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import timeit
+
+
+def best_of(function, repeat=3, number=1):
+    """Time a callable.
+
+    :param function: Callable without arguments.
+    :param repeat: Number of measurements.
+    :type repeat: int
+    :param number: Calls per measurement.
+    :type number: int
+    :return: Best time of a single call in seconds.
+    """
+
+    timer = timeit.Timer(function)
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def print_table(header, rows):
+    """Print rows as a plain text table.
+
+    :param header: Column names.
+    :type header: list
+    :param rows: List of rows, each a list of values.
+    :type rows: list
+    """
+
+    rows = [[str(x) for x in row] for row in rows]
+    widths = [max([len(str(h))] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+
+    print '  '.join(str(h).rjust(w) for h, w in zip(header, widths))
+    print '  '.join('-' * w for w in widths)
+
+    for row in rows:
+        print '  '.join(x.rjust(w) for x, w in zip(row, widths))
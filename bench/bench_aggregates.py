@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Aggregate kernel benchmark: MIN, MAX and SUM of a numeric and a string
+column by sorting the unified values, with linear kernels on a new result
+(parsed once for all three) and on a result already parsed by an earlier
+aggregate.
+
+Usage:
+    python -m bench.bench_aggregates [ values ]
+"""
+
+import sys
+import random
+from lib import operations
+from lib.operations import Result
+from bench import best_of, print_table
+
+VALUES = 100000
+
+
+def sorted_kernels(values):
+    """MIN, MAX and SUM as computed by sorting the unified values.
+    """
+
+    unified = operations.unify(values, sort=True)
+    return unified[0], unified[-1], reduce(lambda x, y: x + y, operations.unify(values))
+
+
+def linear_kernels(values, result=None):
+    return (operations.pyser_min(values, result), operations.pyser_max(values, result),
+            operations.pyser_sum(values, result))
+
+
+def main(values=VALUES):
+    rng = random.Random(0)
+    columns = [('numeric', [str(rng.randint(-1000, 100000)) for _ in xrange(values)]),
+               ('string', ['r%d.xyzw' % rng.randint(0, 4096) for _ in xrange(values)])]
+    rows = []
+
+    for label, column in columns:
+        assert sorted_kernels(column) == linear_kernels(column)
+
+        old = best_of(lambda: sorted_kernels(column))
+        new = best_of(lambda: linear_kernels(column, Result(found=column)))
+        result = Result(found=column)
+        cached = best_of(lambda: linear_kernels(column, result))
+        rows.append([label, '%.4f' % old, '%.4f' % new, '%.4f' % cached, '%.1fx' % (old / new)])
+
+    print '%d values, MIN + MAX + SUM' % values
+    print_table(['column', 'sort [s]', 'linear, new result [s]', 'linear, parsed [s]', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Counter-set batch benchmark: evaluating the metrics.xml counter set on a
+directory of shader files with the batch engine versus the naive loop of
+one pyser.run call per counter per file.
+
+Usage:
+    python -m bench.bench_batch [ copies ]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import pyser
+from lib import batch
+from lib.multiquery import MultiQuery
+from bench import print_table
+from bench.bench_plan_store import METRICS
+
+COPIES = 20
+
+# Test files copied under names matched by metrics.xml globs
+SOURCES = [(os.path.join('test', 'PS.asm'), 'PS_DX_%d.asm'),
+           (os.path.join('test', 'VS.asm'), 'VS_DX_%d.asm')]
+
+
+def make_corpus(directory, copies):
+    for source, name in SOURCES:
+        for i in range(copies):
+            shutil.copy(source, os.path.join(directory, name % i))
+
+
+def naive(directory):
+    """Compile and evaluate counters one by one, reading the file every time.
+    """
+
+    evaluations = 0
+
+    for counter in batch.load_counter_set(METRICS):
+        for path, _ in batch.match_files([counter], directory):
+            pyser.run(file_path=path, code=counter.query.key)
+            evaluations += 1
+
+    return evaluations
+
+
+def batched(directory):
+    evaluations = 0
+    multi_query = MultiQuery()
+
+    for _, values in batch.run(batch.load_counter_set(METRICS), root=directory, multi_query=multi_query):
+        evaluations += len(values)
+
+    print 'batch: %(subtrees)d distinct subqueries, %(scans_saved)d scans saved' % multi_query.stats()
+
+    return evaluations
+
+
+def main(copies=COPIES):
+    directory = tempfile.mkdtemp()
+    files = copies * len(SOURCES)
+    rows = []
+
+    try:
+        make_corpus(directory, copies)
+
+        for label, function in [('naive loop', naive), ('batch', batched)]:
+            start = time.time()
+            evaluations = function(directory)
+            elapsed = time.time() - start
+            rows.append([label, '%.3f' % elapsed, '%.1f' % (files / elapsed), '%.1f' % (evaluations / elapsed)])
+    finally:
+        shutil.rmtree(directory)
+
+    print '%d files, counters from %s' % (files, METRICS)
+    print_table(['engine', 'time [s]', 'files/s', 'counters/s'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
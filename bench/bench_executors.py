@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""SELECT part executor benchmark: a node with several independent parts on
+a large generated input, evaluated serially, in threads and in processes.
+
+Usage:
+    python -m bench.bench_executors [ size_mb [ jobs ] ]
+"""
+
+import sys
+from lib import compiler, interpreter
+from lib.executors import ThreadExecutor, ProcessExecutor
+from bench import best_of, print_table
+from bench.bench_limit import make_data
+
+SIZE_MB = 32
+
+QUERY = (r"SELECT COUNT 'cb0\[\d+\]' AS A, DISTINCT 'r\d+\.[xyzw]+' AS B, "
+         r"COUNT 'mad\s+r\d+' AS C, MAX '\d+' AS D")
+
+
+def main(size_mb=SIZE_MB, jobs=4):
+    data = make_data(size_mb * 1024 * 1024, size_mb * 1024 * 1024 // 2)
+    node = compiler.compile(QUERY).node
+    expected = interpreter.run(data, node).get_values()
+    rows = []
+
+    for label, executor in [('serial', None), ('threads', ThreadExecutor(jobs)), ('processes', ProcessExecutor(jobs))]:
+        assert interpreter.run(data, node, executor).get_values() == expected
+        elapsed = best_of(lambda: interpreter.run(data, node, executor), repeat=1)
+        rows.append([label, '%.3f' % elapsed])
+        if executor is not None:
+            executor.close()
+
+    print '%d MB input, %d parts, %d jobs' % (size_mb, len(node.parts), jobs)
+    print_table(['executor', 'time [s]'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Call tracing benchmark: per-call overhead of each footprint decorator
+with debug messages off, and a small query in each PYSER_FOOTPRINT mode.
+
+Usage:
+    python -m bench.bench_footprint [ calls ]
+"""
+
+import os
+import sys
+import subprocess
+from lib import decorators
+from bench import best_of, print_table
+
+CALLS = 100000
+
+QUERY = r"SELECT COUNT '\d+' FROM (SELECT 'cb0\[\d+\]')"
+
+# Times a small query in a fresh interpreter, footprint being chosen at import
+_QUERY_SCRIPT = '''
+import timeit, pyser
+print min(timeit.repeat(lambda: pyser.run('test/PS.asm', %r), repeat=3, number=%d)) / %d
+'''
+
+
+def function(a, b=1):
+    return a
+
+
+def query_time(mode, runs):
+    env = dict(os.environ)
+    env.pop(decorators.FOOTPRINT_ENV, None)
+    if mode is not None:
+        env[decorators.FOOTPRINT_ENV] = mode
+
+    output = subprocess.check_output([sys.executable, '-c', _QUERY_SCRIPT % (QUERY, runs, runs)], env=env)
+
+    return float(output.split()[-1])
+
+
+def main(calls=CALLS):
+    rows = []
+    bare = best_of(lambda: [function(x) for x in xrange(calls)]) / calls
+
+    for label, decorator in [('untraced', decorators.untraced),
+                             ('trace_debug', decorators.trace_debug),
+                             ('trace', decorators.trace)]:
+        decorated = decorator(function)
+        elapsed = best_of(lambda: [decorated(x) for x in xrange(calls)]) / calls
+        rows.append([label, '%.3f' % (elapsed * 1e6), '%.3f' % ((elapsed - bare) * 1e6)])
+
+    print '%d calls, debug messages off' % calls
+    print_table(['decorator', 'per call [us]', 'overhead [us]'], rows)
+
+    rows = [[mode or 'unset', '%.3f' % (query_time(mode, 200) * 1e3)] for mode in ['0', None, '1']]
+
+    print '\n%s on test/PS.asm' % QUERY
+    print_table([decorators.FOOTPRINT_ENV, 'per query [ms]'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Lexer benchmark: single-pass scanner versus the legacy tokenizer.
+
+Usage:
+    python -m bench.bench_lexer [ max_legacy_tokens ]
+"""
+
+import sys
+from itertools import cycle, islice
+from lib import lexer
+from bench import best_of, print_table
+
+SIZES = [10, 100, 1000, 10000]
+
+# The legacy tokenizer recurses once per regular expression literal and
+# exceeds the recursion limit on larger queries.
+MAX_LEGACY_TOKENS = 1000
+
+_WORDS = ["SELECT", "SUM EACH", "MAX(C1, 2)", "+", "C2", "*", "4", "AS", "C3", ",",
+          "COUNT EACH", "DISTINCT", r"'\[\d+\]'", "FROM", "(", "SELECT", r"'[xyzw]+\'s'", ")",
+          "**", "SUM", "-", "12"]
+
+
+def make_query(n_tokens):
+    """Generate a query of exactly n_tokens tokens.
+    """
+
+    return ' '.join(islice(cycle(_WORDS), n_tokens))
+
+
+def main(max_legacy_tokens=MAX_LEGACY_TOKENS):
+    rows = []
+
+    for size in SIZES:
+        code = make_query(size)
+        tokens = lexer.parse(code, lexer.ENGINE_SCAN)
+        assert len(tokens) == size
+
+        scan = best_of(lambda: lexer.parse(code, lexer.ENGINE_SCAN))
+
+        if size <= max_legacy_tokens:
+            legacy_tokens = lexer.parse(code, lexer.ENGINE_LEGACY)
+            assert [(t.token, t.type) for t in legacy_tokens] == [(t.token, t.type) for t in tokens]
+
+            legacy = best_of(lambda: lexer.parse(code, lexer.ENGINE_LEGACY), repeat=1)
+            rows.append([size, '%.6f' % scan, '%.6f' % legacy, '%.1fx' % (legacy / scan)])
+        else:
+            rows.append([size, '%.6f' % scan, '-', '-'])
+
+    print_table(['tokens', 'scan [s]', 'legacy [s]', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
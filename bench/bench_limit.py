@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""LIMIT pushdown benchmark: time of a LIMIT 1 query as a function of the
+position of the first match in a large input, versus a full scan.
+
+Usage:
+    python -m bench.bench_limit [ size_mb ]
+"""
+
+import sys
+from lib import compiler, streaming
+from lib.operations import Result
+from bench import best_of, print_table
+
+SIZE_MB = 1024
+
+LIMITED = (r"SELECT '\d+' FROM (SELECT '\[\d+\]' FROM (SELECT 'dcl_constantbuffer cb0\[\d+\]')) LIMIT 1")
+FULL = (r"SELECT '\d+' FROM (SELECT '\[\d+\]' FROM (SELECT 'dcl_constantbuffer cb0\[\d+\]'))")
+
+_FILLER = 'mad r0.xyzw, r1.xyzw, cb0[12].xyzw, r2.xyzw\n'
+_MATCH = 'dcl_constantbuffer cb0[18], immediateIndexed\n'
+
+
+def make_data(size, position):
+    """Generate size bytes of filler with matches at position and at the end.
+    """
+
+    lines = size // len(_FILLER)
+    first = min(position // len(_FILLER), lines - 1)
+
+    return ''.join([_FILLER * first, _MATCH, _FILLER * (lines - first - 2), _MATCH])
+
+
+def main(size_mb=SIZE_MB):
+    size = size_mb * 1024 * 1024
+    limited = compiler.compile(LIMITED).node
+    full = compiler.compile(FULL).node
+    rows = []
+
+    for fraction in [0.0, 0.01, 0.1, 0.5, 1.0]:
+        data = make_data(size, int(size * fraction))
+        result = Result(data=data)
+
+        assert streaming.run(result, limited).get_values() == ['18']
+
+        limit_time = best_of(lambda: streaming.run(result, limited), repeat=1)
+        full_time = best_of(lambda: streaming.run(result, full), repeat=1)
+
+        rows.append(['%d%%' % (fraction * 100), '%.1f' % (size * fraction / 1024 / 1024),
+                     '%.4f' % limit_time, '%.4f' % full_time])
+
+    print '%d MB input, first match at:' % size_mb
+    print_table(['position', 'offset [MB]', 'LIMIT 1 [s]', 'full scan [s]'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
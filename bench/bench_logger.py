@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Log message benchmark: cost of a debug message about the result of a
+large-input query with debug messages off, formatted eagerly at the call
+site versus deferred to the logger.
+
+Usage:
+    python -m bench.bench_logger [ size_mb ]
+"""
+
+import sys
+from lib import compiler, interpreter, logger
+from bench import best_of, print_table
+from bench.bench_limit import make_data
+
+SIZE_MB = 16
+
+QUERY = r"SELECT '\d+' FROM (SELECT 'cb0\[\d+\]')"
+
+
+def main(size_mb=SIZE_MB):
+    data = make_data(size_mb * 1024 * 1024, size_mb * 1024 * 1024 // 2)
+    node = compiler.compile(QUERY).node
+    result = interpreter.run(data, node)
+    logger.set_verbosity(logger.Verbosity.NONE)
+
+    calls = [('eager format', lambda: logger.debug('result=%s' % result)),
+             ('format arguments', lambda: logger.debug('result=%s', result)),
+             ('callable', lambda: logger.debug(lambda: 'result=%s' % result)),
+             ('enabled guard', lambda: logger.enabled(logger.Verbosity.DEBUG) and logger.debug('result=%s' % result))]
+    rows = []
+
+    for label, call in calls:
+        rows.append([label, '%.6f' % best_of(call)])
+
+    query = best_of(lambda: interpreter.run(data, node), repeat=1)
+
+    print '%d MB input, %d values, query %.3f s' % (size_mb, len(result.get_values()), query)
+    print_table(['debug message', 'time [s]'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Metrics overhead benchmark: a query with many small filter calls and
+aggregations, without a sink (hooks reduced to a flag check) and with one
+registered.
+
+Usage:
+    python -m bench.bench_metrics [ size_mb ]
+"""
+
+import os
+import sys
+import tempfile
+from lib import compiler, interpreter, metrics
+from bench import best_of, print_table
+from bench.bench_limit import make_data
+
+SIZE_MB = 4
+
+QUERY = r"SELECT SUM '\d+' FROM (SELECT '\[\d+\]' FROM (SELECT 'cb0\[\d+\]'))"
+
+
+def main(size_mb=SIZE_MB):
+    data = make_data(size_mb * 1024 * 1024, size_mb * 1024 * 1024 // 2)
+    node = compiler.compile(QUERY).node
+    interpreter.run(data, node)
+
+    off = best_of(lambda: interpreter.run(data, node))
+
+    fd, path = tempfile.mkstemp(suffix='.prom')
+    os.close(fd)
+    sink = metrics.PrometheusSink(path, interval=3600)
+    metrics.register(sink)
+
+    try:
+        on = best_of(lambda: interpreter.run(data, node))
+    finally:
+        metrics.unregister(sink)
+        os.remove(path)
+
+    calls = sum(value for (name, _), value in metrics.snapshot()['counters'].items()
+                if name == 'pyser_filter_calls_total')
+
+    print '%d MB input, %s' % (size_mb, QUERY)
+    print_table(['metrics', 'time [s]', 'overhead'],
+                [['no sink', '%.4f' % off, '-'],
+                 ['sink registered', '%.4f' % on, '%.1f%%' % (100.0 * (on - off) / off)]])
+    print '%d filter calls measured' % calls
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
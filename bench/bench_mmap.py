@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Memory-mapped input benchmark: time and peak RSS of a nested filter query
+on a large file, read into a string versus memory-mapped with spans passed
+between the nested filters.
+
+Usage:
+    python -m bench.bench_mmap [ size_mb ]
+"""
+
+import os
+import sys
+import time
+import json
+import resource
+import tempfile
+import subprocess
+from bench import print_table
+from bench.bench_limit import make_data, FULL
+
+SIZE_MB = 256
+
+MODES = [('read, interpreter', {'stream': False}),
+         ('read, streaming', {'stream': True}),
+         ('mapped', {'mapped': True})]
+
+
+def child(path, mode):
+    """Run the query in this process and print timings as JSON.
+    """
+
+    import pyser
+
+    options = dict(MODES)[mode]
+    start = time.time()
+    values = pyser.run(file_path=path, code=FULL, **options)
+
+    print json.dumps({'time': time.time() - start,
+                      'values': len(values),
+                      'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def spawn(path, mode):
+    output = subprocess.check_output([sys.executable, '-m', 'bench.bench_mmap', '--child', path, mode])
+    return json.loads(output.strip().split('\n')[-1])
+
+
+def main(size_mb=SIZE_MB):
+    size = size_mb * 1024 * 1024
+    handle, path = tempfile.mkstemp()
+    rows = []
+
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(make_data(size, size // 2))
+
+        for mode, _ in MODES:
+            run = spawn(path, mode)
+            rows.append([mode, '%.3f' % run['time'], '%.1f' % (run['rss'] / 1024.0), run['values']])
+    finally:
+        os.remove(path)
+
+    print '%d MB input' % size_mb
+    print_table(['input', 'time [s]', 'peak RSS [MB]', 'values'], rows)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:])
+    else:
+        main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Parallel batch benchmark: the metrics.xml counter set on a generated
+corpus of shader files with 1 to N worker processes.
+
+The corpus mixes many small files with a few large ones, so the size-aware
+chunking has stragglers to avoid.
+
+Usage:
+    python -m bench.bench_parallel [ max_jobs [ files ] ]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import multiprocessing
+from lib import batch, parallel
+from bench import print_table
+from bench.bench_plan_store import METRICS
+
+FILES = 400
+
+# Test files and names matched by metrics.xml globs
+SOURCES = [(os.path.join('test', 'PS.asm'), 'PS_DX_%d.asm'),
+           (os.path.join('test', 'VS.asm'), 'VS_DX_%d.asm')]
+
+
+def make_corpus(directory, files, seed=0):
+    """Generate files of 1 to 10 copies of a test file; every 50th file has 200.
+
+    :return: Total size in bytes.
+    """
+
+    generator = random.Random(seed)
+    sources = [(open(path).read(), name) for path, name in SOURCES]
+    total = 0
+
+    for i in range(files):
+        data, name = sources[i % len(sources)]
+        data *= 200 if i % 50 == 0 else generator.randint(1, 10)
+        total += len(data)
+        with open(os.path.join(directory, name % i), 'w') as f:
+            f.write(data)
+
+    return total
+
+
+def main(max_jobs=None, files=FILES):
+    max_jobs = max_jobs or multiprocessing.cpu_count()
+    directory = tempfile.mkdtemp()
+    counters = batch.load_counter_set(METRICS)
+    rows = []
+
+    try:
+        size = make_corpus(directory, files)
+        expected = None
+
+        for jobs in range(1, max_jobs + 1):
+            start = time.time()
+            results = list(parallel.run(counters, root=directory, jobs=jobs))
+            elapsed = time.time() - start
+
+            expected = expected or (results, elapsed)
+            assert results == expected[0]
+
+            evaluations = sum(len(values) for _, values in results)
+            rows.append([jobs, '%.3f' % elapsed, '%.1f' % (files / elapsed), '%.1f' % (evaluations / elapsed),
+                         '%.2f' % (expected[1] / elapsed)])
+    finally:
+        shutil.rmtree(directory)
+
+    print '%d files, %.1f MB, %d CPUs' % (files, size / 1024.0 / 1024, multiprocessing.cpu_count())
+    print_table(['jobs', 'time [s]', 'files/s', 'counters/s', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Parser throughput benchmark on synthetic queries of growing nesting depth.
+
+Usage:
+    python -m bench.bench_parser
+"""
+
+from lib import lexer, parser
+from bench import best_of, print_table
+
+DEPTHS = [1, 10, 50, 100, 250, 500]
+
+
+def make_query(depth):
+    """Generate a query with the given number of nested SELECT levels.
+    """
+
+    level = "SELECT SUM COUNT EACH DISTINCT EACH '[xyzw]+' AS C1, MAX(C1, 2) + 4 * (C1 - 1) AS C2 FROM ("
+    inner = r"SELECT 'dcl_input\s+v\d+.[xyzw]+' GROUP BY '\d+' LIMIT 10"
+
+    return level * (depth - 1) + inner + ')' * (depth - 1)
+
+
+def main():
+    rows = []
+
+    for depth in DEPTHS:
+        tokens = lexer.parse(make_query(depth))
+        elapsed = best_of(lambda: parser.build_tree(tokens))
+        rows.append([depth, len(tokens), '%.6f' % elapsed, '%.0f' % (len(tokens) / elapsed)])
+
+    print_table(['depth', 'tokens', 'time [s]', 'tokens/s'], rows)
+
+
+if __name__ == '__main__':
+    main()
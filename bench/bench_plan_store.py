@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Startup benchmark: compiling the metrics.xml counter set in a fresh
+process with no plan store, an empty (cold) store and a populated (warm) one.
+
+Usage:
+    python -m bench.bench_plan_store [ repeat ]
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+from xml.dom import minidom
+from bench import print_table
+
+METRICS = os.path.join('test', 'metrics.xml')
+
+
+def load_counters(path=METRICS):
+    """Get query code of all counters in a counter-set XML file.
+    """
+
+    return [c.getAttribute('comment') for c in minidom.parse(path).getElementsByTagName('counter')]
+
+
+def child(directory):
+    """Compile all counters in this process and print timings as JSON.
+    """
+
+    start = time.time()
+
+    from lib import compiler
+
+    imported = time.time()
+
+    compiler.set_store(directory or None)
+
+    for code in load_counters():
+        compiler.compile(code)
+
+    print json.dumps({'import': imported - start,
+                      'compile': time.time() - imported,
+                      'stats': compiler.stats()})
+
+
+def spawn(directory):
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-m', 'bench.bench_plan_store', '--child', directory])
+    timings = json.loads(output.strip().split('\n')[-1])
+    timings['process'] = time.time() - start
+    return timings
+
+
+def main(repeat=5):
+    directory = tempfile.mkdtemp()
+    rows = []
+
+    try:
+        for label, path in [('no store', ''), ('cold', directory), ('warm', directory)]:
+            runs = []
+            for _ in range(repeat if label != 'cold' else 1):
+                runs.append(spawn(path))
+            best = min(runs, key=lambda x: x['compile'])
+            rows.append([label, '%.4f' % best['compile'], '%.4f' % best['process'],
+                         best['stats'].get('store_hits', '-'), best['stats'].get('store_writes', '-')])
+    finally:
+        shutil.rmtree(directory)
+
+    print '%d counters from %s' % (len(load_counters()), METRICS)
+    print_table(['run', 'compile [s]', 'process [s]', 'store hits', 'store writes'], rows)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main(*[int(x) for x in sys.argv[1:]])
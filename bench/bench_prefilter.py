@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Required-literal prefilter benchmark: filters applied to a large input and
+to each of its lines, with the plain compiled pattern versus a Prefilter.
+
+Usage:
+    python -m bench.bench_prefilter [ size_mb ]
+"""
+
+import re
+import sys
+from lib.prefilter import Prefilter
+from lib.operations import RE_FLAGS
+from bench import best_of, print_table
+from bench.bench_limit import make_data
+
+SIZE_MB = 16
+
+FILTERS = [r'dcl_constantbuffer cb0\[\d+\]',
+           r'send.*0x.9s',
+           r'imm_atomic_alloc',
+           r'cb0\[(\d+)\]',
+           r'mad\s+r\d+',
+           r'(.*)']
+
+
+def main(size_mb=SIZE_MB):
+    data = make_data(size_mb * 1024 * 1024, size_mb * 1024 * 1024 // 2)
+    lines = data.split('\n')
+    rows = []
+
+    for pattern in FILTERS:
+        regex = re.compile(pattern, RE_FLAGS)
+        prefilter = Prefilter(regex)
+
+        for label, values in [('input', [data]), ('lines', lines)]:
+            plain = best_of(lambda: [regex.findall(x) for x in values], repeat=1)
+            filtered = best_of(lambda: [prefilter.findall(x) for x in values], repeat=1)
+            rows.append([pattern, label, '%.4f' % plain, '%.4f' % filtered, '%.2f' % (plain / filtered)])
+
+    print '%d MB input, %d lines' % (size_mb, len(lines))
+    print_table(['filter', 'on', 'regex [s]', 'prefilter [s]', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Result store benchmark: the metrics.xml counter set on a generated corpus
+without a store, with an empty store, and again after changing a tenth of
+the files.
+
+Usage:
+    python -m bench.bench_result_store [ files ]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from lib import batch
+from lib.store import ResultStore
+from bench import print_table
+from bench.bench_plan_store import METRICS
+from bench.bench_parallel import make_corpus
+
+FILES = 200
+
+
+def main(files=FILES):
+    directory = tempfile.mkdtemp()
+    counters = batch.load_counter_set(METRICS)
+    rows = []
+
+    try:
+        make_corpus(directory, files)
+        store = ResultStore(os.path.join(tempfile.mkdtemp(dir=directory), 'results.db'))
+        expected = None
+
+        for label in ['no store', 'empty store', 'unchanged files', '10% changed files']:
+            if label == '10% changed files':
+                for name in sorted(os.listdir(directory))[::10]:
+                    if name.endswith('.asm'):
+                        with open(os.path.join(directory, name), 'a') as f:
+                            f.write('// changed\n')
+
+            hits, misses = store.hits, store.misses
+            start = time.time()
+            results = list(batch.run(counters, root=directory, store=store if label != 'no store' else None))
+            elapsed = time.time() - start
+
+            expected = expected or results
+            if label != '10% changed files':
+                assert results == expected
+
+            rows.append([label, '%.3f' % elapsed, store.hits - hits, store.misses - misses])
+
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print '%d files' % files
+    print_table(['run', 'time [s]', 'hits', 'misses'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
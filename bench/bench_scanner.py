@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Multi-pattern scanner benchmark: innermost filters of the metrics.xml
+counter set on the test shader files, as separate findall scans versus a
+MultiScanner with and without the shared literal-prefix pass.
+
+Usage:
+    python -m bench.bench_scanner [ copies ]
+"""
+
+import sys
+from lib import batch
+from lib.scanner import MultiScanner
+from bench import best_of, print_table
+from bench.bench_plan_store import METRICS
+
+COPIES = 100
+
+FILES = ['test/PS.asm', 'test/VS.asm', 'test/PS2.asm']
+
+
+def innermost_patterns(counters):
+    patterns = {}
+
+    for counter in counters:
+        node = counter.query.node
+        while node.nested:
+            node = node.source
+        for part in node.parts:
+            if part.pattern is not None:
+                patterns[(part.pattern.pattern, part.pattern.flags)] = part.pattern
+
+    return patterns.values()
+
+
+def main(copies=COPIES):
+    patterns = innermost_patterns(batch.load_counter_set(METRICS))
+    files = [batch.get_file_contents(path) for path in FILES]
+    rows = []
+
+    separate = lambda data: [p.findall(data) for p in patterns]
+    scanners = [('separate findall', None),
+                ('MultiScanner', MultiScanner(patterns)),
+                ('MultiScanner, prefix scan', MultiScanner(patterns, prefix_scan=True))]
+
+    for label, scanner in scanners:
+        scan = separate if scanner is None else scanner.findall
+        for data in files:
+            assert scan(data) == separate(data)
+        elapsed = best_of(lambda: [scan(data) for _ in range(copies) for data in files])
+        rows.append([label, '%.4f' % elapsed])
+
+    print '%d patterns on %s, %d runs' % (len(patterns), ', '.join(FILES), copies)
+    print_table(['scanner', 'time [s]'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
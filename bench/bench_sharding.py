@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Intra-file sharding benchmark: shard-safe queries on one large generated
+file, serially and split into line-aligned shards for 2 to N worker
+processes.
+
+Usage:
+    python -m bench.bench_sharding [ size_mb [ max_jobs ] ]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+from lib import compiler, streaming, sharding
+from bench import print_table
+from bench.bench_limit import make_data, FULL
+
+SIZE_MB = 256
+
+QUERIES = [r"SELECT 'cb0\[\d+\]'",
+           r"SELECT COUNT 'mad'",
+           r"SELECT DISTINCT 'r\d+'",
+           r"SELECT MAX '\d+' FROM (SELECT 'cb0\[\d+\]')",
+           FULL]
+
+
+def main(size_mb=SIZE_MB, max_jobs=None):
+    max_jobs = max_jobs or max(multiprocessing.cpu_count(), 2)
+    handle, path = tempfile.mkstemp()
+    rows = []
+
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(make_data(size_mb * 1024 * 1024, size_mb * 1024 * 1024 // 2))
+
+        for code in QUERIES:
+            node = compiler.compile(code).node
+
+            start = time.time()
+            expected = streaming.execute(open(path).read(), node).get_values()
+            serial = time.time() - start
+            rows.append([code, 1, '%.3f' % serial, '1.00'])
+
+            for jobs in range(2, max_jobs + 1):
+                start = time.time()
+                result = sharding.run(path, node, jobs=jobs)
+                elapsed = time.time() - start
+                assert result.get_values() == expected
+                rows.append(['', jobs, '%.3f' % elapsed, '%.2f' % (serial / elapsed)])
+    finally:
+        os.remove(path)
+
+    print '%d MB input, %d CPUs' % (size_mb, multiprocessing.cpu_count())
+    print_table(['query', 'jobs', 'time [s]', 'speedup'], rows)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Scaling benchmark suite: lexer and parser on the metrics.xml counter set,
+interpreter queries and the whole counter set on synthetic corpora of
+growing size (see bench.corpus).
+
+Every run appends a record to a JSON-lines history file and is compared to
+the last record of the same configuration, e.g. of the previous commit.
+
+Usage:
+    python -m bench.bench_suite [ -s sizes_mb ] [ -d density ] [ -r repeat ] [ -H history_file ]
+
+    -s, --sizes    Comma-separated corpus sizes in MB (default: 1,4,16)
+    -d, --density  Fraction of instructions matched by counters (default: 0.1)
+    -r, --repeat   Measurements per benchmark, the best one is kept (default: 1)
+    -H, --history  History file (default: bench_history.jsonl)
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import getopt
+import platform
+import tempfile
+import subprocess
+from lib import __version__, compiler, lexer, parser, interpreter, batch
+from bench import best_of, print_table, corpus
+from bench.bench_plan_store import METRICS, load_counters
+
+SIZES_MB = [1, 4, 16]
+
+HISTORY = 'bench_history.jsonl'
+
+# Relative change reported as a regression
+THRESHOLD = 0.1
+
+# Interpreter queries by name, from metrics.xml
+QUERIES = [('filter', r"SELECT 'endif | endloop | endrep'"),
+           ('distinct', r"SELECT COUNT FROM (SELECT DISTINCT 'dcl_\w+.v\d+')"),
+           ('each', r"SELECT SUM COUNT EACH FROM (SELECT DISTINCT EACH '[xyzw]+' FROM "
+                    r"(SELECT 'dcl_input\s+v\d+.[xyzw]+'))"),
+           ('arithmetic', r"SELECT VISIBLE+INVISIBLE*4 FROM (SELECT COUNT '[xyzw]{1}' AS VISIBLE, "
+                          r"COUNT 'v\d+.^[xyzw]*' AS INVISIBLE FROM (SELECT 'v\d+.[xyzw]*' FROM "
+                          r"(SELECT 'dcl_input\s+v\d+.[xyzw]*')))")]
+
+
+def git_commit():
+    """Get the checked out commit, with a + if there are local changes, None
+    outside a git work tree.
+    """
+
+    try:
+        with open(os.devnull, 'w') as null:
+            commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=null).strip()
+            changed = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                              stderr=null).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ('+' if changed else '')
+
+
+def measure(sizes_mb, density, repeat):
+    """Run all benchmarks.
+
+    :return: Dictionary, key: benchmark name, value: best time in seconds.
+    """
+
+    codes = [compiler.normalize(code) for code in load_counters()]
+    tokens = [lexer.parse(code) for code in codes]
+    results = {'lexer': best_of(lambda: [lexer.parse(code) for code in codes], repeat=max(repeat, 3)),
+               'parser': best_of(lambda: [parser.build_tree(x) for x in tokens], repeat=max(repeat, 3))}
+
+    queries = [(name, parser.build_tree(lexer.parse(code))) for name, code in QUERIES]
+    counters = batch.load_counter_set(METRICS)
+
+    for size_mb in sizes_mb:
+        directory = tempfile.mkdtemp()
+
+        try:
+            paths = corpus.write_corpus(directory, size_mb * 1024 * 1024, density)
+            data = ''.join(open(path, 'rb').read() for path in paths)
+
+            for name, node in queries:
+                results['interpreter %s %dMB' % (name, size_mb)] = best_of(lambda: interpreter.run(data, node),
+                                                                           repeat=repeat)
+
+            results['counter set %dMB' % size_mb] = best_of(lambda: list(batch.run(counters, root=directory)),
+                                                            repeat=repeat)
+        finally:
+            shutil.rmtree(directory)
+
+    return results
+
+
+def load_history(path):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except IOError:
+        return []
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv, 's:d:r:H:', ['sizes=', 'density=', 'repeat=', 'history='])
+    options = dict(opts)
+
+    sizes_mb = [int(x) for x in options.get('-s', options.get('--sizes', ','.join(map(str, SIZES_MB)))).split(',')]
+    density = float(options.get('-d', options.get('--density', corpus.DENSITY)))
+    repeat = int(options.get('-r', options.get('--repeat', 1)))
+    history = options.get('-H', options.get('--history', HISTORY))
+
+    config = {'sizes_mb': sizes_mb, 'density': density, 'seed': corpus.SEED}
+    previous = [x for x in load_history(history) if x['config'] == config]
+    previous = previous[-1] if previous else None
+
+    record = {'time': time.time(),
+              'commit': git_commit(),
+              'version': __version__,
+              'python': platform.python_version(),
+              'config': config,
+              'results': measure(sizes_mb, density, repeat)}
+
+    with open(history, 'a') as f:
+        f.write('%s\n' % json.dumps(record, sort_keys=True))
+
+    rows = []
+    regressions = 0
+
+    for name in sorted(record['results']):
+        elapsed = record['results'][name]
+        row = [name, '%.4f' % elapsed]
+
+        if previous is not None and name in previous['results']:
+            change = elapsed / previous['results'][name] - 1
+            regressions += change > THRESHOLD
+            row += ['%.4f' % previous['results'][name],
+                    '%+.1f%%%s' % (change * 100, ' !' if change > THRESHOLD else '')]
+        else:
+            row += ['-', '-']
+
+        rows.append(row)
+
+    print 'commit %s, corpus sizes %s MB, density %g' % (record['commit'], sizes_mb, density)
+    if previous is not None:
+        print 'compared to commit %s' % previous['commit']
+    print_table(['benchmark', 'time [s]', 'previous [s]', 'change'], rows)
+
+    if regressions:
+        print '\n%d benchmarks slower by more than %d%%' % (regressions, THRESHOLD * 100)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""Deterministic synthetic shader-assembly corpus, modeled on test/PS.asm
+and test/VS.asm.
+
+A corpus file is a dump of many shaders, each with a compiler comment
+header, declarations and an instruction body. Density is the fraction of
+body instructions that metrics.xml counters look for (sample, discard,
+control flow, atomics, gathers); the others are arithmetic filler. The same
+kind, size, density and seed always give the same bytes.
+
+Usage:
+    python -m bench.corpus directory size_mb [ density [ seed ] ]
+"""
+
+import os
+import sys
+import random
+
+# Fraction of body instructions matched by metrics.xml filters
+DENSITY = 0.1
+
+SEED = 0
+
+# Distinct shaders per file; a file repeats them in a random order
+POOL_SIZE = 64
+
+# Kinds of shaders, their shader model and file name matched by metrics.xml
+KINDS = {'PS': ('ps_4_0', 'PS_DX_%d.asm'),
+         'VS': ('vs_5_0', 'VS_DX_%d.asm')}
+
+_MASKS = ['x', 'xy', 'xyz', 'xyzw', 'yz', 'yzw', 'zw', 'w']
+_SWIZZLES = ['xyzw', 'xxxx', 'yyyy', 'zzzz', 'wwww', 'xyzx', 'xyxx', 'yzyy']
+_FILLER = ['add', 'mul', 'mad', 'dp3', 'dp4', 'mov', 'mov_sat', 'lt', 'ne', 'and', 'movc', 'ult']
+_HEADER = '''//
+// Generated by Microsoft (R) HLSL Shader Compiler
+//
+//
+// Buffer Definitions:
+//
+// cbuffer cb0
+// {
+//
+%s
+//
+// }
+//
+//
+// Resource Bindings:
+//
+// Name                   Type  Format         Dim Slot Elements
+// ---------------- ---------- ------- ----------- ---- --------
+// cb0                 cbuffer      NA          NA    0        1
+//
+//
+//
+'''
+
+
+def _register(rng):
+    kind = rng.random()
+
+    if kind < 0.5:
+        return 'r%d.%s' % (rng.randint(0, 7), rng.choice(_SWIZZLES))
+    elif kind < 0.8:
+        return 'v%d.%s' % (rng.randint(0, 15), rng.choice(_SWIZZLES))
+
+    return 'cb%d[%d].%s' % (rng.randint(0, 3), rng.randint(0, 31), rng.choice(_SWIZZLES))
+
+
+def _filler(rng):
+    operands = 3 if rng.random() < 0.3 else 2
+    return '%s r%d.%s, %s' % (rng.choice(_FILLER), rng.randint(0, 7), rng.choice(_MASKS),
+                              ', '.join(_register(rng) for _ in range(operands)))
+
+
+def _match(rng, kind):
+    """Get instruction lines some metrics.xml counter looks for.
+    """
+
+    choice = rng.randint(0, 5 if kind == 'PS' else 3)
+
+    if choice == 0:
+        return ['if_nz r%d.x' % rng.randint(0, 7), _filler(rng), 'endif']
+    elif choice == 1:
+        return ['loop', _filler(rng), 'breakc_nz r%d.x' % rng.randint(0, 7), 'endloop']
+    elif choice == 2:
+        return ['imm_atomic_alloc r%d.x, u%d' % (rng.randint(0, 7), rng.randint(0, 3))]
+    elif choice == 3:
+        return ['imm_atomic_consume r%d.x, u%d' % (rng.randint(0, 7), rng.randint(0, 3))]
+    elif choice == 4:
+        slot = rng.randint(0, 3)
+        return ['sample r%d.xyzw, v%d.xyxx, t%d.xyzw, s%d' % (rng.randint(0, 7), rng.randint(0, 15), slot, slot)]
+
+    return ['discard r%d.x' % rng.randint(0, 7)]
+
+
+def make_shader(rng, kind, density=DENSITY):
+    """Generate one shader.
+
+    :param rng: random.Random instance.
+    :param kind: Key of KINDS.
+    :param density: Fraction of body instructions matched by metrics.xml.
+    :return: Shader assembly string.
+    """
+
+    model, _ = KINDS[kind]
+    members = ['//   float4 constant%d;%s// Offset: %4d Size:    16'
+               % (i, ' ' * (24 - len(str(i))), i * 16) for i in range(rng.randint(2, 8))]
+    lines = (_HEADER % '\n'.join(members)).splitlines() + [model]
+
+    if kind == 'PS':
+        for i in range(rng.randint(1, 8)):
+            lines.append('dcl_input_ps linear v%d.%s' % (i, rng.choice(_MASKS)))
+        lines.append('dcl_output o0.xyzw')
+    else:
+        lines.append('dcl_globalFlags refactoringAllowed')
+        for i in range(rng.randint(1, 8)):
+            lines.append('dcl_input v%d.%s' % (i, rng.choice(_MASKS)))
+        for i in range(rng.randint(1, 4)):
+            lines.append('dcl_output o%d.%s' % (i, rng.choice(_MASKS)))
+
+    for i in range(rng.randint(1, 3)):
+        lines.append('dcl_constantbuffer cb%d[%d], immediateIndexed' % (i, rng.randint(1, 256)))
+
+    if kind == 'PS':
+        for i in range(rng.randint(0, 4)):
+            lines.append('dcl_resource_texture2d (float,float,float,float) t%d' % i)
+            lines.append('dcl_sampler s%d, mode_default' % i)
+
+    lines.append('dcl_temps %d' % rng.randint(1, 8))
+    instructions = 0
+
+    for _ in range(rng.randint(10, 200)):
+        body = _match(rng, kind) if rng.random() < density else [_filler(rng)]
+        lines.extend(body)
+        instructions += len(body)
+
+    lines.append('ret ')
+    lines.append('// Approximately %d instruction slots used' % (instructions + 1))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(path, kind, size, density=DENSITY, seed=SEED):
+    """Write a corpus file of whole shaders, at least size bytes (unless
+    size is 0).
+
+    :return: Size of the file in bytes.
+    """
+
+    rng = random.Random(seed * len(KINDS) + sorted(KINDS).index(kind))
+    pool = [make_shader(rng, kind, density) for _ in range(POOL_SIZE)]
+    written = 0
+
+    with open(path, 'wb') as f:
+        while written < size:
+            shader = rng.choice(pool)
+            f.write(shader)
+            written += len(shader)
+
+    return written
+
+
+def write_corpus(directory, size, density=DENSITY, seed=SEED):
+    """Write one file of each kind, named as metrics.xml expects.
+
+    :param directory: Existing output directory.
+    :param size: Total size in bytes, split evenly between the kinds.
+    :return: List of file paths.
+    """
+
+    paths = []
+
+    for kind in sorted(KINDS):
+        path = os.path.join(directory, KINDS[kind][1] % 0)
+        write_file(path, kind, size // len(KINDS), density, seed)
+        paths.append(path)
+
+    return paths
+
+
+def main(directory, size_mb, density=DENSITY, seed=SEED):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    for path in write_corpus(directory, int(size_mb * 1024 * 1024), float(density), int(seed)):
+        print '%s: %d bytes' % (path, os.path.getsize(path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], float(sys.argv[2]), *sys.argv[3:])
@@ -1,2 +1,4 @@
 #!/usr/bin/env python
-# coding=utf-8
\ No newline at end of file
+# coding=utf-8
+
+from version import __version__
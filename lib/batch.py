@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import glob
+import mmap
+import time
+from collections import namedtuple
+from xml.dom import minidom
+import logger
+import metrics
+import streaming
+from compiler import compile
+from multiquery import MultiQuery
+from prefilter import Prefilter
+from decorators import footprint
+
+
+class Counter(namedtuple('Counter', 'uri name shader_files query')):
+    """Counter of a counter-set XML file.
+
+    uri: unique counter name, shader_files: glob of the files the counter
+    applies to, query: CompiledQuery of the counter's code.
+    """
+
+    __slots__ = ()
+
+
+@footprint
+def get_file_contents(path):
+    try:
+        return open(path).read()
+    except IOError:
+        print 'Given file does not exist: %s' % path
+        return None
+
+
+@footprint
+def map_file(path):
+    """Memory-map a file read-only.
+
+    :return: mmap instance, file contents if the file is empty (which cannot
+             be mapped), None if the file does not exist.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return f.read()
+    except IOError:
+        print 'Given file does not exist: %s' % path
+        return None
+
+
+@footprint
+def load_counter_set(path):
+    """Load a counter-set XML file and compile all its counters.
+
+    :param path: Counter-set XML file path.
+    :type path: str
+    :return: List of Counter instances in file order.
+    """
+
+    counters = []
+
+    for element in minidom.parse(path).getElementsByTagName('counter'):
+        counters.append(Counter(uri=element.getAttribute('uri'),
+                                name=element.getAttribute('name'),
+                                shader_files=element.getAttribute('shader_files'),
+                                query=compile(element.getAttribute('comment'))))
+
+    return counters
+
+
+@footprint
+def match_files(counters, root='.'):
+    """Expand shader_files globs of counters.
+
+    Each glob is expanded once, however many counters share it.
+
+    :param counters: List of Counter instances.
+    :param root: Directory the globs are relative to.
+    :type root: str
+    :return: List of (file path, counters applicable to the file) pairs
+             sorted by path, counters in the given order.
+    """
+
+    paths = {}
+    files = {}
+
+    for counter in counters:
+        if counter.shader_files not in paths:
+            paths[counter.shader_files] = glob.glob(os.path.join(root, counter.shader_files))
+        for path in paths[counter.shader_files]:
+            files.setdefault(path, []).append(counter)
+
+    return sorted(files.items())
+
+
+@footprint
+def evaluate(counters, data, timings=None):
+    """Evaluate counters on file contents.
+
+    :param counters: List of Counter instances.
+    :param data: File contents, string or memory-mapped file.
+    :param timings: List the wall time of each counter is appended to, in
+                    seconds.
+    :return: List of (uri, values) pairs.
+    """
+
+    if timings is None:
+        return [(counter.uri, streaming.execute(data, counter.query.node).get_values())
+                for counter in counters]
+
+    values = []
+    for counter in counters:
+        start = time.time()
+        values.append((counter.uri, streaming.execute(data, counter.query.node).get_values()))
+        timings.append(time.time() - start)
+
+    return values
+
+
+def evaluate_file(counters, data, multi_query=None, ids=None, store=None):
+    """Evaluate counters on file contents, reusing values stored for the
+    same data and query.
+
+    :param counters: List of Counter instances.
+    :param data: File contents, string or memory-mapped file.
+    :param multi_query: MultiQuery instance the counters were added to, None
+                        to evaluate counters one by one, see evaluate.
+    :param ids: Dictionary, key: counter uri, value: MultiQuery id.
+    :param store: ResultStore instance, None to evaluate all counters.
+    :return: List of (uri, values) pairs. While metrics are active, the wall
+             time of each evaluated counter is observed in the
+             pyser_counter_seconds histogram of its uri.
+    """
+
+    content = store.content_hash(data) if store is not None else None
+    stored = [store.load(content, counter.query) if store is not None else None for counter in counters]
+    missing = [counter for counter, values in zip(counters, stored) if values is None]
+
+    timings = [] if metrics.active else None
+
+    if not missing:
+        evaluated = []
+    elif multi_query is None:
+        evaluated = [values for _, values in evaluate(missing, data, timings)]
+    else:
+        evaluated = [result.get_values() for result in multi_query.run(data, [ids[c.uri] for c in missing], timings)]
+
+    if timings is not None:
+        for counter, elapsed in zip(missing, timings):
+            metrics.observe('pyser_counter_seconds', elapsed, uri=counter.uri)
+
+    evaluated = iter(evaluated)
+
+    for i, counter in enumerate(counters):
+        if stored[i] is None:
+            stored[i] = next(evaluated)
+            if store is not None:
+                store.save(content, counter.query, stored[i])
+
+    return [(counter.uri, values) for counter, values in zip(counters, stored)]
+
+
+def run(counters, root='.', mapped=False, multi_query=None, store=None):
+    """Evaluate a counter set on all files matching its globs.
+
+    Every file is read once and all counters applicable to it are evaluated
+    on the same data. Subqueries shared by several counters are evaluated
+    once per file, see MultiQuery. Mapped files are streamed counter by
+    counter instead.
+
+    With a result store, only counters without stored values for the
+    file's contents are evaluated.
+
+    :param counters: List of Counter instances, see load_counter_set.
+    :param root: Directory the shader_files globs are relative to.
+    :type root: str
+    :param mapped: Memory-map files instead of reading them.
+    :type mapped: bool
+    :param multi_query: Empty MultiQuery instance to collect statistics in.
+    :param store: ResultStore instance, changes are committed per file.
+    :return: Generator of (file path, list of (uri, values) pairs), one item
+             per file as soon as it is evaluated.
+    """
+
+    if multi_query is None:
+        multi_query = MultiQuery()
+
+    ids = {}
+    if not mapped:
+        for counter in counters:
+            ids[counter.uri] = multi_query.add(counter.query.node)
+
+    for path, file_counters in match_files(counters, root):
+        logger.debug('Batch: %s, %d counters', path, len(file_counters))
+
+        data = map_file(path) if mapped else get_file_contents(path)
+
+        if data is None:
+            continue
+
+        try:
+            values = evaluate_file(file_counters, data, None if mapped else multi_query, ids, store)
+            if store is not None:
+                store.commit()
+            yield path, values
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def prefilters(counters):
+    """Get the required-literal prefilters of a counter set.
+
+    Counters with equal code share their compiled query, hence prefilters.
+
+    :param counters: List of Counter instances.
+    :return: List of (uri of the first counter using it, Prefilter) pairs,
+             in counter order.
+    """
+
+    seen = set()
+    found = []
+
+    for counter in counters:
+        for pattern in counter.query.patterns:
+            if isinstance(pattern, Prefilter) and id(pattern) not in seen:
+                seen.add(id(pattern))
+                found.append((counter.uri, pattern))
+
+    return found
+
+
+def prefilter_stats(counters):
+    """Get statistics of the required-literal prefilters of a counter set.
+
+    :param counters: List of Counter instances.
+    :return: List of (uri, Prefilter.stats() dictionary) pairs, see prefilters.
+    """
+
+    return [(uri, prefilter.stats()) for uri, prefilter in prefilters(counters)]
+
+
+def format_values(values):
+    return ', '.join(str(value) for value in values)
+
+
+def report(results, out):
+    """Write a batch report and get its summary.
+
+    :param results: Iterable of (file path, list of (uri, values) pairs),
+                    see run.
+    :param out: File-like object the report is written to.
+    :return: Dictionary with number of files, number of counter evaluations
+             and elapsed time in seconds.
+    """
+
+    start = time.time()
+    files = evaluations = 0
+
+    for path, values in results:
+        out.write('%s\n' % path)
+        for uri, counter_values in values:
+            out.write('    %s = %s\n' % (uri, format_values(counter_values)))
+        out.flush()
+
+        files += 1
+        evaluations += len(values)
+
+    return {'files': files,
+            'evaluations': evaluations,
+            'time': time.time() - start}
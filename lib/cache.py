@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from collections import OrderedDict
+from utils import pyser_assert
+from exceptions import InternalError
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entry.
+    """
+
+    def __init__(self, maxsize):
+        """Initialize an empty cache.
+
+        :param maxsize: Maximum number of entries.
+        :type maxsize: int
+        """
+
+        pyser_assert(maxsize > 0, InternalError('Incorrect cache size: %s' % maxsize))
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Get a cached value and mark it as recently used.
+        """
+
+        try:
+            value = self.__entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.__entries[key] = value
+
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full.
+        """
+
+        self.__entries.pop(key, None)
+        self.__entries[key] = value
+
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop all entries and reset counters.
+        """
+
+        self.__entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Get cache counters.
+
+        :return: Dictionary with hits, misses, evictions, size and maxsize.
+        """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.__entries),
+                'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
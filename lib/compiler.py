@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import re
+from collections import namedtuple
+from HTMLParser import HTMLParser
+import logger
+import lexer
+import metrics
+import parser
+import planner
+from cache import LRUCache
+from store import PlanStore
+from rules import Type
+from utils import pyser_assert
+from decorators import footprint
+from exceptions import LexerError
+
+# Maximum number of compiled queries kept in memory
+CACHE_SIZE = 512
+
+# Environment variable naming the on-disk plan store directory
+STORE_ENV = 'PYSER_PLAN_CACHE'
+
+_RE_LITERAL = re.compile(lexer.RE_LITERAL_PATTERN)
+_WHITESPACE = re.compile(r'\s+')
+
+_plan_cache = LRUCache(CACHE_SIZE)
+_store = PlanStore(os.environ[STORE_ENV]) if os.environ.get(STORE_ENV) else None
+
+
+class CompiledQuery(namedtuple('CompiledQuery', 'key tokens node')):
+    """Immutable compiled query.
+
+    key: normalized query code, tokens: tuple of tokens, node: planned parse tree.
+    """
+
+    __slots__ = ()
+
+    @property
+    def patterns(self):
+        """Compiled filter patterns of all SELECT parts, outermost first.
+        """
+
+        patterns, node = [], self.node
+
+        while node is not None:
+            patterns.extend(part.pattern for part in node.parts if part.pattern is not None)
+            node = node.source if node.nested else None
+
+        return tuple(patterns)
+
+
+def normalize(code):
+    """Get the canonical form of query code.
+
+    HTML entities are unescaped, whitespace is collapsed and everything
+    except regular expression literals is upper-cased.
+
+    :param code: Pyser code string.
+    :type code: str
+    :return: Normalized code string.
+    """
+
+    code = HTMLParser().unescape(code)
+    parts, pos = [], 0
+
+    for m in _RE_LITERAL.finditer(code):
+        parts.append(_WHITESPACE.sub(' ', code[pos:m.start()]).upper())
+        parts.append(m.group())
+        pos = m.end()
+
+    parts.append(_WHITESPACE.sub(' ', code[pos:]).upper())
+
+    return ''.join(parts).strip()
+
+
+@footprint
+def __build(code):
+    """Lex, parse and plan normalized query code.
+    """
+
+    tokens = lexer.parse(code)
+
+    logger.debug('Lexer output:')
+    for i, t in enumerate(tokens):
+        logger.debug('\t%d: %s', i, t)
+    logger.debug('')
+
+    pyser_assert(tokens[0].type is Type.COMMAND.SELECT,
+                 LexerError('Incorrect type of first token: %s' % tokens[0]))
+
+    node = planner.plan(parser.build_tree(tokens))
+
+    logger.debug('Parser output:\n\n%s', node)
+
+    return CompiledQuery(code, tuple(tokens), node)
+
+
+@footprint
+def compile(code):
+    """Compile query code, reusing a cached plan when possible.
+
+    :param code: Pyser code string.
+    :type code: str
+    :return: CompiledQuery instance.
+    """
+
+    key = normalize(code)
+    query = _plan_cache.get(key)
+
+    if metrics.active:
+        metrics.count('pyser_plan_cache_hits_total' if query is not None else 'pyser_plan_cache_misses_total')
+
+    if query is None:
+        if _store is not None:
+            query = _store.load(key)
+
+            if query is not None:
+                planner.plan(query.node, force=True)
+
+        if query is None:
+            query = __build(key)
+            __store(query)
+
+        _plan_cache.put(key, query)
+
+    return query
+
+
+def __store(query):
+    """Write a compiled query to the on-disk store, if there is one.
+    """
+
+    if _store is None:
+        return
+
+    try:
+        _store.save(query)
+    except (IOError, OSError) as e:
+        logger.warning('Cannot store plan for %s: %s', query.key, e)
+
+
+def stats():
+    """Get plan cache counters (hits, misses, evictions, size, maxsize).
+
+    With an on-disk store the counters of the store are included as
+    store_hits, store_misses and store_writes.
+    """
+
+    counters = _plan_cache.stats()
+
+    if _store is not None:
+        for name, value in _store.stats().items():
+            counters['store_%s' % name] = value
+
+    return counters
+
+
+def clear_cache():
+    """Drop all cached plans and reset counters.
+    """
+
+    _plan_cache.clear()
+
+
+def set_cache_size(maxsize):
+    """Replace the plan cache with an empty one of a given size.
+    """
+
+    global _plan_cache
+    _plan_cache = LRUCache(maxsize)
+
+
+def set_store(directory):
+    """Use an on-disk plan store in a given directory, None to disable it.
+    """
+
+    global _store
+
+    if not directory:
+        _store = None
+    elif _store is None or _store.directory != PlanStore(directory).directory:
+        _store = PlanStore(directory)
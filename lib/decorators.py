@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 # coding=utf-8
 
+import os
 import re
 import inspect
 import logger as logging
 
+# Environment variable choosing how footprint traces calls: 0 leaves
+# functions undecorated, 1 always traces them, unset (default) traces
+# while debug messages are logged
+FOOTPRINT_ENV = 'PYSER_FOOTPRINT'
+
 # key: function, value: boolean -- has return statement?
 _has_return_statement = {}
 
+# key: function, value: argument specification
+_argspecs = {}
+
 
 def __function_has_return_statement(function):
     """ Helper function, checks if a function given as a parameter
@@ -26,7 +35,9 @@ def __get_function_parameters(function, *args, **kwargs):
         parameter names and values."""
 
     # Get names and default arguments
-    fargspec = inspect.getargspec(function)
+    fargspec = _argspecs.get(function)
+    if fargspec is None:
+        fargspec = _argspecs[function] = inspect.getargspec(function)
 
     if fargspec.defaults:
         arglist = dict([(name, default)
@@ -69,54 +80,94 @@ def __format_value(value):
 def __format_arg(name, value):
     return '%s = %s' % (name, __format_value(value))
 
-def footprint(function):
+def __trace(function, args, kwargs):
+    """Log a call, its arguments and its return value.
+    """
+
+    # Get function arguments and their values
+    farglist = __get_function_parameters(function, *args, **kwargs)
+
+    # Print the header: what function was called
+    # and what argument values were passed
+    call_str = 'CALL %s.%s (' % (function.__module__, function.__name__)
+
+    if not farglist:
+        logging.debug('%s)' % call_str)
+    elif len(farglist) == 1:
+        logging.debug('%s%s)' % (call_str, __format_arg(*farglist[0])))
+    else:
+        indent = ' ' * len(call_str)
+
+        # First parameter
+        logging.debug('%s%s' % (call_str, __format_arg(*farglist[0])))
+
+        # [1:-1] parameters
+        for name, value in farglist[1:-1]:
+            logging.debug('%s%s' % (indent, __format_arg(name, value)))
+
+        # Last parameters
+        logging.debug('%s%s)' % (indent, __format_arg(*farglist[-1])))
+
+    logging.indent()
+
+    # Invoke the functions
+    result = function(*args, **kwargs)
+
+    # Print footer and the return value (if present)
+    if __function_has_return_statement(function):
+        logging.debug('END  %s -> %s' % (function.__name__,
+                                         __format_value(result)))
+    else:
+        logging.debug('END  %s' % function.__name__)
+
+    logging.unindent()
+
+    # Return function result
+    return result
+
+
+def trace(function):
+    """Decorate a function to log every call.
+    """
 
     # Make sure that passed argument is a function
     assert inspect.isfunction(function), 'Cannot decorate: not a function!'
 
     def function_wrapper(*args, **kwargs):
-        # Get function arguments and their values
-        farglist = __get_function_parameters(function, *args, **kwargs)
+        return __trace(function, args, kwargs)
 
-        # Print the header: what function was called
-        # and what argument values were passed
-        call_str = 'CALL %s.%s (' % (function.__module__, function.__name__)
+    return function_wrapper
 
-        if not farglist:
-            logging.debug('%s)' % call_str)
-        elif len(farglist) == 1:
-            logging.debug('%s%s)' % (call_str, __format_arg(*farglist[0])))
-        else:
-            indent = ' ' * len(call_str)
 
-            # First parameter
-            logging.debug('%s%s' % (call_str, __format_arg(*farglist[0])))
+def trace_debug(function):
+    """Decorate a function to log calls made while debug messages are logged.
 
-            # [1:-1] parameters
-            for name, value in farglist[1:-1]:
-                logging.debug('%s%s' % (indent, __format_arg(name, value)))
+    Otherwise the only overhead is checking the verbosity.
+    """
 
-            # Last parameters
-            logging.debug('%s%s)' % (indent, __format_arg(*farglist[-1])))
+    # Make sure that passed argument is a function
+    assert inspect.isfunction(function), 'Cannot decorate: not a function!'
 
-        logging.indent()
+    def function_wrapper(*args, **kwargs):
+        if logging.enabled(logging.Verbosity.DEBUG):
+            return __trace(function, args, kwargs)
+        return function(*args, **kwargs)
 
-        # Invoke the functions
-        result = function(*args, **kwargs)
+    return function_wrapper
 
-        # Print footer and the return value (if present)
-        if __function_has_return_statement(function):
-            logging.debug('END  %s -> %s' % (function.__name__,
-                                             __format_value(result)))
-        else:
-            logging.debug('END  %s' % function.__name__)
 
-        logging.unindent()
+def untraced(function):
+    """Leave a function undecorated.
+    """
 
-        # Return function result
-        return result
+    # Make sure that passed argument is a function
+    assert inspect.isfunction(function), 'Cannot decorate: not a function!'
 
-    return function_wrapper
+    return function
+
+
+# Call tracing decorator, chosen once at import time (see FOOTPRINT_ENV)
+footprint = {'0': untraced, '1': trace}.get(os.environ.get(FOOTPRINT_ENV), trace_debug)
 
 
 def assert_not_none(function):
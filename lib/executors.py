@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import planner
+import interpreter
+
+# Worker process state, see _init_worker
+_result = None
+_node = None
+
+
+class ThreadExecutor(object):
+    """Evaluates the SELECT parts of a node in a pool of threads.
+
+    Threads share the source result. They run concurrently while the regex
+    engine or I/O releases the GIL; CPython's re holds it while matching.
+    """
+
+    def __init__(self, jobs=None):
+        """
+        :param jobs: Number of threads, None for the number of CPUs.
+        """
+
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self._pool = None
+
+    def evaluate_parts(self, result, node):
+        """Evaluate every part of node on result.
+
+        :return: List of Result instances in the order of node.parts.
+        """
+
+        if len(node.parts) < 2:
+            return [interpreter.evaluate_part(result, node, select_node) for select_node in node.parts]
+
+        if self._pool is None:
+            self._pool = ThreadPool(self.jobs)
+
+        return self._pool.map(lambda select_node: interpreter.evaluate_part(result, node, select_node),
+                              node.parts)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _init_worker(result, node):
+    global _result, _node
+
+    # Compiled expressions are not pickled where workers are not forked
+    planner.plan(node, force=True)
+
+    _result = result
+    _node = node
+
+
+def _evaluate_part(index):
+    return interpreter.evaluate_part(_result, _node, _node.parts[index])
+
+
+class ProcessExecutor(object):
+    """Evaluates the SELECT parts of a node in a pool of worker processes,
+    for parts too CPU-heavy to share one interpreter.
+
+    A pool is started for each node: forked workers inherit the source
+    result instead of receiving a copy. Only the results of the parts are
+    sent back. Prefilter statistics of the workers are lost.
+    """
+
+    def __init__(self, jobs=None):
+        """
+        :param jobs: Number of worker processes, None for the number of CPUs.
+        """
+
+        self.jobs = jobs or multiprocessing.cpu_count()
+
+    def evaluate_parts(self, result, node):
+        """Evaluate every part of node on result.
+
+        :return: List of Result instances in the order of node.parts.
+        """
+
+        if len(node.parts) < 2:
+            return [interpreter.evaluate_part(result, node, select_node) for select_node in node.parts]
+
+        pool = multiprocessing.Pool(min(self.jobs, len(node.parts)), _init_worker, (result, node))
+
+        try:
+            results = pool.map(_evaluate_part, range(len(node.parts)))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return results
+
+    def close(self):
+        pass
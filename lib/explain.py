@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import json
+import time
+import planner
+import regexinfo
+import streaming
+import interpreter
+from operations import Result
+from decorators import footprint
+
+
+class _ProfiledPattern(object):
+    """Compiled filter pattern that counts its calls and the bytes it searches.
+    """
+
+    def __init__(self, pattern):
+        self.wrapped = pattern
+        self.pattern = pattern.pattern
+        self.flags = pattern.flags
+        self.groups = pattern.groups
+        self.calls = 0
+        self.scanned = 0
+
+    def __count(self, data, pos, endpos):
+        self.calls += 1
+        self.scanned += (len(data) if endpos is None else endpos) - pos
+
+    def findall(self, data, pos=0, endpos=None):
+        self.__count(data, pos, endpos)
+        return self.wrapped.findall(data, pos, len(data) if endpos is None else endpos)
+
+    def finditer(self, data, pos=0, endpos=None):
+        self.__count(data, pos, endpos)
+        return self.wrapped.finditer(data, pos, len(data) if endpos is None else endpos)
+
+
+def _size(values):
+    return sum(len(str(value)) for value in values)
+
+
+class _Profiler(object):
+    """Executor (see interpreter.evaluate) measuring each SELECT part.
+    """
+
+    def __init__(self):
+        # key: id of a SelectNode, value: dictionary of measurements
+        self.parts = {}
+
+    def evaluate_parts(self, result, node):
+        results = []
+        values = len(result.get_values())
+
+        for select_node in node.parts:
+            pattern = select_node.pattern
+            if pattern is not None:
+                select_node.pattern = _ProfiledPattern(pattern)
+
+            try:
+                start = time.time()
+                part_result = interpreter.evaluate_part(result, node, select_node)
+                elapsed = time.time() - start
+            finally:
+                profiled, select_node.pattern = select_node.pattern, pattern
+
+            output = part_result.get_values()
+            self.parts[id(select_node)] = {'time': elapsed,
+                                           'input_values': values,
+                                           'output_values': len(output),
+                                           'result_bytes': _size(output),
+                                           'regex_calls': profiled.calls if pattern is not None else 0,
+                                           'bytes_scanned': profiled.scanned if pattern is not None else 0}
+            results.append(part_result)
+
+        return results
+
+
+def _describe_part(select_node):
+    description = {'filter': select_node.filter_,
+                   'identifier': select_node.identifier.token if select_node.identifier else None,
+                   'commands': [c.token for c in select_node.commands]}
+
+    if select_node.order is not None:
+        description['order'] = [c.token for c in select_node.order]
+    if select_node.rpn is not None:
+        description['rpn'] = [c.token for c in select_node.rpn]
+
+    pattern = select_node.pattern
+    if pattern is not None:
+        prefixes = regexinfo.literal_prefixes(pattern)
+        description['required_literals'] = list(regexinfo.required_literals(pattern))
+        description['literal_prefixes'] = sorted(prefixes) if prefixes is not None else None
+        description['line_local'] = regexinfo.is_line_local(pattern)
+
+    return description
+
+
+@footprint
+def describe(node):
+    """Describe the evaluation plan of a parse tree.
+
+    :param node: Parse tree root node.
+    :type node: Node
+    :return: Dictionary of the outermost node: its SELECT parts, grouping,
+             LIMIT and source (the description of the nested node, None for
+             the input data); the root also tells the engine choices.
+    """
+
+    planner.plan(node)
+
+    root = None
+    parent = None
+
+    while node is not None:
+        description = {'parts': [_describe_part(x) for x in node.parts],
+                       'group': node.group.token if node.group is not None else None,
+                       'limit': node.limit,
+                       'streamable': streaming.is_streamable(node),
+                       'source': None}
+
+        if parent is None:
+            shard_commands = planner.shard_commands(node)
+            root = description
+            root['engine'] = 'streaming' if streaming.has_limit_pushdown(node) else 'interpreter'
+            root['shard_commands'] = [x.name for x in shard_commands] if shard_commands is not None else None
+        else:
+            parent['source'] = description
+
+        parent = description
+        node = node.source if node.nested else None
+
+    return root
+
+
+@footprint
+def analyze(data, node):
+    """Evaluate a parse tree, measuring each node and SELECT part.
+
+    Nodes are evaluated one by one with the interpreter, so the streaming
+    engine's shortcuts are not measured.
+
+    :param data: Input data string or None.
+    :param node: Parse tree root node.
+    :type node: Node
+    :return: Result instance and the plan description (see describe) with
+             measurements: wall time, input and output value counts and
+             result size in bytes of each node and part, regex calls and
+             bytes searched of each part, the largest result of each node.
+    """
+
+    description = describe(node)
+    profiler = _Profiler()
+    result = Result(data=data) if data is not None else Result()
+
+    # Nodes and their descriptions from the innermost one outwards
+    chain = []
+    while True:
+        chain.append((node, description))
+        if not node.nested:
+            break
+        node, description = node.source, description['source']
+    chain.reverse()
+
+    for node, description in chain:
+        values = len(result.get_values())
+        start = time.time()
+        result = interpreter.evaluate(result, node, profiler)
+        elapsed = time.time() - start
+
+        for select_node, part in zip(node.parts, description['parts']):
+            part.update(profiler.parts[id(select_node)])
+
+        output = result.get_values()
+        description.update({'time': elapsed,
+                            'input_values': values,
+                            'output_values': len(output),
+                            'result_bytes': _size(output)})
+        description['peak_bytes'] = max([description['result_bytes']] +
+                                        [part['result_bytes'] for part in description['parts']])
+
+    return result, chain[-1][1]
+
+
+def __format_bytes(size):
+    for unit in ['B', 'kB', 'MB']:
+        if size < 1024:
+            return '%d %s' % (size, unit) if unit == 'B' else '%.1f %s' % (size, unit)
+        size /= 1024.0
+
+    return '%.1f GB' % size
+
+
+def to_text(description):
+    """Format a plan description (see describe and analyze) as indented text.
+    """
+
+    lines = []
+    depth = 0
+
+    while description is not None:
+        indent = '    ' * depth
+        header = '%sNODE' % indent
+
+        if description.get('engine'):
+            header += ' engine=%s, shardable=%s' % (description['engine'], description['shard_commands'] is not None)
+        if description['group']:
+            header += ' group by %s' % description['group']
+        if description['limit'] is not None:
+            header += ' limit %d' % description['limit']
+        if 'time' in description:
+            header += ' (%.3f ms, values %d -> %d, peak %s)' % (description['time'] * 1e3,
+                                                                  description['input_values'],
+                                                                  description['output_values'],
+                                                                  __format_bytes(description['peak_bytes']))
+        lines.append(header)
+
+        for index, part in enumerate(description['parts'], start=1):
+            line = '%s  #%d' % (indent, index)
+            if part['filter'] is not None:
+                line += " filter '%s'" % part['filter']
+            if part['commands']:
+                line += ' commands %s' % ' '.join(part['commands'])
+            if part['identifier']:
+                line += ' as %s' % part['identifier']
+            lines.append(line)
+
+            if part['filter'] is not None:
+                lines.append('%s      required literals %s, line-local %s'
+                             % (indent, part['required_literals'], part['line_local']))
+            if 'time' in part:
+                lines.append('%s      %.3f ms, values %d -> %d (%s), regex calls %d, scanned %s'
+                             % (indent, part['time'] * 1e3, part['input_values'], part['output_values'],
+                                __format_bytes(part['result_bytes']), part['regex_calls'],
+                                __format_bytes(part['bytes_scanned'])))
+
+        description = description['source']
+        depth += 1
+
+    lines.append('%sFROM input' % ('    ' * depth))
+
+    return '\n'.join(lines)
+
+
+def to_json(description):
+    """Format a plan description (see describe and analyze) as JSON.
+    """
+
+    return json.dumps(description, indent=2, sort_keys=True)
@@ -3,16 +3,22 @@
 
 import re
 import logger
+import metrics
+import planner
 from utils import pyser_assert
 from lexer import Token
 from parser import Node, SelectNode
-from rules import Identifier, Command, Bracket, Operator, Function, Numeric
+from rules import Identifier, Command, Operator, Function, Numeric
+from rules import COMMANDS, FUNCTIONS, IDENTIFIERS, NUMERICS, OPERATORS
 from operations import *
 from decorators import footprint
 from exceptions import InterpreterError, InternalError
 
 RE_FLAGS = re.S | re.MULTILINE
 
+# Token types allowed in commands without operators
+_BACKWARD_TYPES = COMMANDS | FUNCTIONS | IDENTIFIERS | NUMERICS
+
 
 @footprint
 def _distinct(data):
@@ -48,38 +54,6 @@ def _distinct_each(data):
     return result
 
 
-@footprint
-def __rpn(commands):
-
-    stack = []
-    out = []
-
-    for c in commands:
-        if c.type is Bracket.LEFT:
-            stack.append(c)
-        elif c.type is Bracket.RIGHT:
-            while stack[-1].type is not Bracket.LEFT:
-                out.append(stack.pop(-1))
-            stack.pop(-1)
-        elif c.type in Operator.members():
-            if not len(stack):
-                stack.append(c)
-            elif c.type.priority > stack[-1].type.priority:
-                stack.append(c)
-            else:
-                while stack[-1].type.priority > c.type.priority:
-                    out.append(stack.pop(-1))
-                    if not len(stack):
-                        break
-                stack.append(c)
-        else:
-            out.append(c)
-
-    out += stack[::-1]
-
-    return out
-
-
 @footprint
 def __calc_operator(a, b, operator):
     a, b = int(a), int(b)
@@ -100,31 +74,6 @@ def __calc_operator(a, b, operator):
         raise InterpreterError('Unknown operator: %s' % operator)
 
 
-@footprint
-def __get_args(fstring):
-
-    fstring = fstring.strip()
-    logger.debug(fstring)
-    fstring = fstring[:-1]
-    logger.debug(fstring)
-    fstring = fstring.split('(')[1]
-
-    fargs = []
-    for x in fstring.split(','):
-        x = x.strip()
-
-        try:
-            int(x)
-        except ValueError:
-            x = Token(x, Identifier.ID)
-        else:
-            x = Token(x, Numeric.INT)
-
-        fargs.append(x)
-
-    return fargs
-
-
 @footprint
 def __get_value(value, result=None):
     pyser_assert(isinstance(result, Result), InternalError('#1'))
@@ -142,21 +91,21 @@ def __get_value(value, result=None):
             except IndexError:
                 return result.named_groups[value.token]
         elif value.type is Function.MAX:
-            return pyser_fmax(__get_args(value.token), result)
+            return pyser_fmax(planner.get_args(value.token), result)
         elif value.type is Function.MIN:
-            return pyser_fmin(__get_args(value.token), result)
+            return pyser_fmin(planner.get_args(value.token), result)
         elif value.type is Function.REPLACE:
-            return pyser_freplace(__get_args(value.token), result)
+            return pyser_freplace(planner.get_args(value.token), result)
         elif value.type is Function.SUM:
-            return pyser_fsum(__get_args(value.token), result)
+            return pyser_fsum(planner.get_args(value.token), result)
         elif value.type is Function.COUNT:
-            return pyser_fcount(__get_args(value.token), result)
+            return pyser_fcount(planner.get_args(value.token), result)
         elif value.type is Command.SUM:
-            return pyser_sum(result.get_values())
+            return pyser_sum(result.get_values(), result)
         elif value.type is Command.MIN:
-            return pyser_min(result.get_values())
+            return pyser_min(result.get_values(), result)
         elif value.type is Command.MAX:
-            return pyser_max(result.get_values())
+            return pyser_max(result.get_values(), result)
         elif value.type is Command.COUNT:
             return pyser_count(result.get_values())
         else:
@@ -168,25 +117,25 @@ def __get_value(value, result=None):
 @footprint
 def __calc_rpn(commands, result):
     logger.debug('calc_rpn')
-    logger.debug('command=%s' % [type(x) for x in commands])
-    logger.debug('result=%s' % result)
+    logger.debug(lambda: 'command=%s' % [type(x) for x in commands])
+    logger.debug('result=%s', result)
     stack = []
 
     for c in commands:
-        if c.type in Operator.members():
+        if c.type in OPERATORS:
             pyser_assert(len(stack) >= 2, InterpreterError('Insufficient number of arguments for operator %s' % c))
 
             b, a = stack.pop(-1), stack.pop(-1)
 
-            logger.debug('type(a)=%s' % type(a))
-            logger.debug('named=%s' % result.named_groups)
+            logger.debug('type(a)=%s', type(a))
+            logger.debug('named=%s', result.named_groups)
 
             stack.append(__calc_operator(a, b, c.type))
         else:
-            logger.debug('append stack: %s is %s = %s' % (c, c.type, c.token))
+            logger.debug('append stack: %s is %s = %s', c, c.type, c.token)
             stack.append(__get_value(c, result))
 
-    logger.debug('stack=%s' % stack)
+    logger.debug('stack=%s', stack)
 
     return stack[0]
 
@@ -196,35 +145,33 @@ def __backward_mode(commands, result):
     found = result.get_values()
 
     for c in commands:
-        logger.debug('pre-found: %s' % found)
-        logger.debug('%s: %s,%s' % (c, c.type, c.token))
+        logger.debug('pre-found: %s', found)
+        logger.debug('%s: %s,%s', c, c.type, c.token)
 
-        pyser_assert(c.type in Command.members() or c.type in Function.members() or
-                    c.type in Identifier.members() or c.type in Numeric.members(),
-                    InterpreterError('Does not compute: %s' % c))
+        pyser_assert(c.type in _BACKWARD_TYPES, InterpreterError('Does not compute: %s' % c))
 
         if c.type is Command.MIN:
-            found = [pyser_min(found)]
+            found = [pyser_min(found, result)]
         elif c.type is Command.MIN_EACH:
             found = pyser_min_each(Result(found=found)).get_values()
         elif c.type is Command.MAX:
-            found = [pyser_max(found)]
+            found = [pyser_max(found, result)]
         elif c.type is Command.MAX_EACH:
             found = pyser_max_each(Result(found=found)).get_values()
         elif c.type is Command.SUM:
-            found = [pyser_sum(found)]
+            found = [pyser_sum(found, result)]
         elif c.type is Command.COUNT:
             found = [pyser_count(found)]
         elif c.type is Command.COUNT_EACH:
             found = pyser_count_each(found)
         elif c.type is Function.REPLACE:
-            found = pyser_freplace(__get_args(c.token), result)
+            found = pyser_freplace(planner.get_args(c.token), result)
         elif c.type is Function.MAX:
-            found = [pyser_fmax(__get_args(c.token), result)]
+            found = [pyser_fmax(planner.get_args(c.token), result)]
         elif c.type is Function.MIN:
-            found = [pyser_fmin(__get_args(c.token), result)]
+            found = [pyser_fmin(planner.get_args(c.token), result)]
         elif c.type is Function.SUM:
-            found = [pyser_fsum(__get_args(c.token), result)]
+            found = [pyser_fsum(planner.get_args(c.token), result)]
         elif c.type is Command.DISTINCT:
             found = pyser_distinct(found)
         elif c.type is Command.DISTINCT_EACH:
@@ -241,8 +188,9 @@ def __backward_mode(commands, result):
     return found
 
 
+@metrics.timed('pyser_interpreter_seconds')
 @footprint
-def run(result, node):
+def run(result, node, executor=None):
 
     if result is None:
         result = Result()
@@ -254,96 +202,140 @@ def run(result, node):
     pyser_assert(isinstance(result, Result),
                 InterpreterError('Expected a Result instance: %s' % result))
 
+    return __run(result, node, executor)
+
+
+def __run(result, node, executor):
+    planner.plan(node)
+
     if node.nested:
-        result = run(result, node.source)
+        result = __run(result, node.source, executor)
+
+    return evaluate(result, node, executor)
+
+
+@footprint
+def evaluate_part(result, node, select_node):
+    """Evaluate a single SELECT part of a node.
+
+    Parts are independent of each other; result is not modified.
+
+    :param result: Result of node's source (already evaluated).
+    :type result: Result
+    :param node: Planned node.
+    :type node: Node
+    :param select_node: One of node.parts.
+    :type select_node: SelectNode
+    :return: Result instance, to be merged with those of the other parts.
+    """
 
     result_grouping = node.group is not None
 
-    logger.debug('result=%s' % result)
+    logger.debug('process: %s', select_node)
+    logger.debug('filter=%s', select_node.filter_)
 
-    for select_node in node.parts:
-        # Assert: identifiers or grouping
-        if result_grouping:
-            pyser_assert(not select_node.identifier,
-                        InterpreterError('Groups and identifiers combined...'))
+    if select_node.filter_:
+        new_result = result.get_filtered(select_node.pattern)
+    else:
+        new_result = Result(result=result)
 
-        # Assert: use an identifier not present in the results
-        for command in select_node.commands:
-            pyser_assert(command.type is not Identifier.ID or command.token in result.named_groups.keys(),
-                        InterpreterError('Unknown identifier: %s (ids: %s, commands: %s)'
-                                         % (command.token, result.named_groups.keys(), select_node.commands)))
+    logger.debug('result_grouping=%s', result_grouping)
 
-    partial_results = []
+    if result_grouping:
+        groups = {}
+        for value in new_result.get_values():
+            value = str(value)
 
-    for select_node in node.parts:
-        logger.debug('process: %s' % select_node)
-        logger.debug('filter=%s' % select_node.filter_)
+            f = node.group_pattern.findall(value)
 
-        if select_node.filter_:
-            new_result = result.get_filtered(select_node.filter_)
-        else:
-            new_result = Result(result=result)
+            if not f:
+                key = ''
+            else:
+                key = f[0]
 
-        logger.debug('result_grouping=%s' % result_grouping)
+            if key not in groups:
+                groups[key] = []
 
-        if result_grouping:
-            groups = {}
-            for value in new_result.get_values():
-                value = str(value)
+            groups[key].append(value)
 
-                f = re.findall(node.group.token[1:-1], value)
+        new_result.reset()
+        new_result.anon_groups = groups
 
-                if not f:
-                    key = ''
-                else:
-                    key = f[0]
+    assert isinstance(select_node, SelectNode)
 
-                if key not in groups:
-                    groups[key] = []
+    if select_node.commands:
+        if select_node.evaluate is not None:
+            select_node_result = select_node.evaluate(new_result)
+        elif select_node.rpn is not None:
+            logger.debug('rpn=%s', select_node.rpn)
+            select_node_result = __calc_rpn(select_node.rpn, new_result)
+        else:
+            select_node_result = __backward_mode(select_node.order, new_result)
 
-                groups[key].append(value)
+        if not isinstance(select_node_result, list):
+            select_node_result = [select_node_result]
 
+        if select_node.identifier:
+            logger.debug('ID: named[%s] = %s', select_node.identifier.token, select_node_result)
             new_result.reset()
-            new_result.anon_groups = groups
+            new_result.set_named(select_node.identifier.token, select_node_result)
+        else:
+            logger.debug('Anon: found += %s', select_node_result)
+            logger.debug('pre=%s', new_result)
+            new_result.reset()
+            logger.debug('post=%s', new_result)
+            new_result.found = select_node_result
+            logger.debug('final=%s', new_result)
+    else:
+        if select_node.identifier:
+            f = new_result.found
+            new_result.reset()
+            new_result.set_named(select_node.identifier.token, f)
 
-        assert isinstance(select_node, SelectNode)
+    return new_result
 
-        if select_node.commands:
-            if select_node.operators:
-                rpn = __rpn(select_node.commands)
-                logger.debug('rpn=%s' % rpn)
-                select_node_result = __calc_rpn(rpn, new_result)
-            else:
-                rpn = sorted(select_node.commands, key=lambda x: x.type.priority)[::-1]
-                select_node_result = __backward_mode(rpn, new_result)
 
-            if not isinstance(select_node_result, list):
-                select_node_result = [select_node_result]
+@footprint
+def evaluate(result, node, executor=None):
+    """Evaluate a single node on the result of its source.
+
+    :param result: Result of node's source (already evaluated).
+    :type result: Result
+    :param node: Planned node.
+    :type node: Node
+    :param executor: Evaluates the SELECT parts of a node (see executors),
+                     None to evaluate them one after another.
+    :return: Result instance.
+    """
 
-            if select_node.identifier:
-                logger.debug('ID: named[%s] = %s' % (select_node.identifier.token, select_node_result))
-                new_result.reset()
-                new_result.named_groups[select_node.identifier.token] = select_node_result
-            else:
-                logger.debug('Anon: found += %s' % select_node_result)
-                logger.debug('pre=%s' % new_result)
-                new_result.reset()
-                logger.debug('post=%s' % new_result)
-                new_result.found.extend(select_node_result)
-                logger.debug('final=%s' % new_result)
-        else:
-            if select_node.identifier:
-                f = new_result.found
-                new_result.reset()
-                new_result.named_groups[select_node.identifier.token] = f
+    result_grouping = node.group is not None
+
+    logger.debug('result=%s', result)
+
+    for select_node in node.parts:
+        # Assert: identifiers or grouping
+        if result_grouping:
+            pyser_assert(not select_node.identifier,
+                        InterpreterError('Groups and identifiers combined...'))
+
+        # Assert: use an identifier not present in the results
+        for command in select_node.commands:
+            pyser_assert(command.type is not Identifier.ID or command.token in result.named_groups.keys(),
+                        InterpreterError('Unknown identifier: %s (ids: %s, commands: %s)'
+                                         % (command.token, result.named_groups.keys(), select_node.commands)))
 
-        partial_results.append(new_result)
+    if executor is None:
+        partial_results = [evaluate_part(result, node, select_node) for select_node in node.parts]
+    else:
+        # Parts only read result; build its cached values before sharing it
+        result.get_values()
+        partial_results = executor.evaluate_parts(result, node)
 
     new_result = Result.merge(*partial_results)
 
     # Result post-processing
     for index, processor in enumerate(node.post_processors):
-        logger.debug('processor=%s' % processor)
+        logger.debug('processor=%s', processor)
 
         if processor.type is Command.LIMIT:
             limit_arg = node.post_processors[index+1]
@@ -4,13 +4,15 @@
 import re
 import logger
 from utils import pyser_assert
-from rules import RegularExpression, TokenType, find_type
+from rules import Type, RegularExpression, Identifier, TokenType, find_type
 from decorators import footprint
 from exceptions import RulesError, LexerError
 
 
 class Token(object):
 
+    __slots__ = ('token', 'type')
+
     def __init__(self, token, token_type):
         pyser_assert(isinstance(token, basestring),
                     RulesError('Incorrect token: %s' % token))
@@ -24,6 +26,99 @@ class Token(object):
         return self.token
 
 
+# Lexer engines: single-pass master pattern scanner and the original
+# shrinking-window tokenizer (kept for reference and benchmarking).
+ENGINE_SCAN = 'scan'
+ENGINE_LEGACY = 'legacy'
+
+# Container order in the master pattern. Python's alternation is first-match
+# rather than longest-match, so a type that can extend a shorter rival goes
+# first: functions before the MAX/MIN/SUM/COUNT commands, commands before
+# identifiers. Inside a container longer patterns go first (SUM EACH before SUM).
+_SCAN_ORDER = [Type.RE, Type.FUNCTION, Type.COMMAND, Type.OPERATOR,
+               Type.BRACKET, Type.SEPARATOR, Type.IDENTIFIER, Type.NUMERIC]
+
+# Regular expression literal with backslash escapes.
+RE_LITERAL_PATTERN = r"'(?:\\.|[^'\\])*'"
+
+# Characters that continue an identifier; a keyword followed by one of them
+# is the prefix of a longer identifier.
+_WORD_GUARD = r'(?![_A-Z0-9])'
+
+_SKIP = 'SKIP'
+_MISMATCH = 'MISMATCH'
+
+
+def __build_master_pattern():
+    """Combine all token type patterns into one named-group alternation.
+
+    :return: Tuple (compiled pattern, dictionary group name -> token type).
+    """
+
+    pyser_assert(set(_SCAN_ORDER) == set(Type.members()),
+                 RulesError('Lexer scan order does not cover: %s' % Type.members()))
+
+    alternatives, types = [], {}
+
+    for container in _SCAN_ORDER:
+        members = sorted(container.members(), key=lambda x: len(x.pattern.pattern), reverse=True)
+
+        for token_type in members:
+            if token_type is RegularExpression.RE:
+                pattern = RE_LITERAL_PATTERN
+            else:
+                pattern = token_type.pattern.pattern
+                pattern = pattern[:-1] if pattern.endswith('$') else pattern
+
+                # Single-word keywords must not eat the head of an identifier
+                if re.escape(pattern) == pattern and Identifier.ID.pattern.match(pattern):
+                    pattern += _WORD_GUARD
+
+            name = 'T%d' % len(alternatives)
+            types[name] = token_type
+            alternatives.append('(?P<%s>%s)' % (name, pattern))
+
+    alternatives.append(r'(?P<%s>\s+)' % _SKIP)
+    alternatives.append(r'(?P<%s>.)' % _MISMATCH)
+
+    return re.compile('|'.join(alternatives), re.IGNORECASE | re.S), types
+
+
+_MASTER_PATTERN, _GROUP_TYPES = __build_master_pattern()
+
+
+@footprint
+def __scan(code):
+    """Convert query code to tokens in a single left-to-right pass.
+
+    Every position is matched against the master pattern, which yields the
+    same greedy longest-match tokens as the legacy tokenizer.
+
+    :param code: Pyser code string.
+    :type code: str
+    :return: List of tokens.
+    """
+
+    result, pos, end = [], 0, len(code)
+    match = _MASTER_PATTERN.match
+
+    while pos < end:
+        m = match(code, pos)
+        kind = m.lastgroup
+
+        if kind == _MISMATCH:
+            raise LexerError('Cannot tokenize value: %s' % code[pos:])
+
+        if kind != _SKIP:
+            token = Token(m.group(), _GROUP_TYPES[kind])
+            logger.debug('Token(%s, %s)', token.token, token.type)
+            result.append(token)
+
+        pos = m.end()
+
+    return result
+
+
 @footprint
 def __tokenize_non_re(code):
     """Convert query code to tokens (except regular expressions).
@@ -50,14 +145,14 @@ def __tokenize_non_re(code):
         if token_type:
             code = code[end+1:]
             end = len(code) - 1
-            logger.debug('Token(%s, %s)' % (current, token_type))
+            logger.debug('Token(%s, %s)', current, token_type)
             result.append(Token(current, token_type))
         else:
             end -= 1
 
     pyser_assert(len(result) > 0, LexerError('Failed to tokenize the code.'))
 
-    logger.debug('result=%s' % result)
+    logger.debug('result=%s', result)
 
     return result
 
@@ -97,11 +192,13 @@ def __tokenize(code):
 
 
 @footprint
-def parse(code):
+def parse(code, engine=ENGINE_SCAN):
     """Parse Pyser query code to tokens.
 
     :param code: Pyser code string.
     :type code: str
+    :param engine: Lexer engine, ENGINE_SCAN or ENGINE_LEGACY.
+    :type engine: str
     :return: List of tokens.
     """
 
@@ -109,7 +206,12 @@ def parse(code):
 
     pyser_assert(len(code) > 0, LexerError('Empty code string: %s' % code))
 
-    tokens = __tokenize(code)
+    if engine == ENGINE_SCAN:
+        tokens = __scan(code)
+    elif engine == ENGINE_LEGACY:
+        tokens = __tokenize(code)
+    else:
+        raise LexerError('Unknown lexer engine: %s' % engine)
 
     pyser_assert(len(tokens) > 0, LexerError('No tokens found: %s' % code))
 
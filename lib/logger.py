@@ -128,10 +128,33 @@ def get_indent_size():
     return len(_INDENT)
 
 
-def __log(logger_function, message, flag=0):
+def enabled(level):
+    """Check if messages of a level are logged, e.g. to skip building
+    expensive log messages.
+
+    :param level: Verbosity flag.
+    """
+
+    return bool(_Logger.verbose & level)
+
+
+def __log(level_name, message, args, flag=0):
+    """Log a message if its level is enabled.
+
+    The message is only built then: a callable is called, a format string
+    is formatted with args.
+    """
+
+    logger = _Logger.get_logger()
+
     if _Logger.verbose & flag:
-        logger_function(_INDENT + str(message))
-    return _Logger.get_logger()
+        if callable(message):
+            message = message()
+        elif args:
+            message = message % args
+        getattr(logger, level_name)(_INDENT + str(message))
+
+    return logger
 
 
 def set_verbosity(verbose):
@@ -146,24 +169,24 @@ def set_verbosity(verbose):
         _Logger.reset_logger()
 
 
-def info(message):
-    return __log(_Logger.get_logger().info, message, Verbosity.INFO)
+def info(message, *args):
+    return __log('info', message, args, Verbosity.INFO)
 
 
-def debug(message):
-    return __log(_Logger.get_logger().debug, message, Verbosity.DEBUG)
+def debug(message, *args):
+    return __log('debug', message, args, Verbosity.DEBUG)
 
 
-def warning(message):
-    return __log(_Logger.get_logger().warning, message, Verbosity.WARNING)
+def warning(message, *args):
+    return __log('warning', message, args, Verbosity.WARNING)
 
 
-def error(message):
-    return __log(_Logger.get_logger().error, message, Verbosity.ERROR)
+def error(message, *args):
+    return __log('error', message, args, Verbosity.ERROR)
 
 
 def blank():
-    return __log(_Logger.get_logger().info, '')
+    return __log('info', '', ())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+import functools
+
+# Upper bounds of latency histogram buckets in seconds, +Inf implied
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds between two writes of a sink
+FLUSH_INTERVAL = 10
+
+# True while a sink is registered; instrumented code measures nothing
+# otherwise, so hooks cost a flag check when metrics are off
+active = False
+
+_sinks = []
+_lock = threading.Lock()
+
+# key: (name, sorted label pairs), value: total
+_counters = {}
+
+# key: (name, sorted label pairs), value: [count per bucket (+Inf last), sum]
+_histograms = {}
+
+clock = time.time
+
+
+def __key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add to a counter.
+
+    :param name: Metric name, e.g. pyser_bytes_scanned_total.
+    :type name: str
+    :param value: Amount added.
+    :param labels: Label values distinguishing series of the metric.
+    """
+
+    key = __key(name, labels)
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Add an observation, e.g. a latency in seconds, to a histogram.
+
+    :param name: Metric name, e.g. pyser_counter_seconds.
+    :type name: str
+    :param value: Observed value.
+    :param labels: Label values distinguishing series of the metric.
+    """
+
+    key = __key(name, labels)
+
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+        histogram[1] += value
+
+
+def timed(name, **labels):
+    """Decorator observing the wall time of each call in a histogram while
+    metrics are active.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not active:
+                return function(*args, **kwargs)
+
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, clock() - start, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    """Get a copy of all measurements.
+
+    :return: Dictionary with counters and histograms, see merge.
+    """
+
+    with _lock:
+        return {'counters': dict(_counters),
+                'histograms': dict((key, [list(buckets), total]) for key, (buckets, total) in _histograms.items())}
+
+
+def merge(measurements):
+    """Add measurements of another process, see collect.
+    """
+
+    with _lock:
+        for key, value in measurements['counters'].items():
+            _counters[key] = _counters.get(key, 0) + value
+
+        for key, (buckets, total) in measurements['histograms'].items():
+            histogram = _histograms.get(key)
+            if histogram is None:
+                _histograms[key] = [list(buckets), total]
+            else:
+                histogram[0] = [x + y for x, y in zip(histogram[0], buckets)]
+                histogram[1] += total
+
+
+def collect():
+    """Get all measurements and start over, e.g. to send them from a worker
+    process to its parent.
+    """
+
+    measurements = snapshot()
+    reset()
+
+    return measurements
+
+
+def reset():
+    """Drop all measurements.
+    """
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def detach():
+    """Prepare a forked worker process: keep measuring, but drop the sinks and
+    measurements inherited from the parent, which gets the worker's through
+    collect and merge.
+    """
+
+    global _lock, _sinks
+
+    # The parent's lock may have been held by a flushing thread while forking
+    _lock = threading.Lock()
+    _sinks = []
+    reset()
+
+
+def register(sink):
+    """Start writing measurements to a sink, turning metrics on.
+
+    :param sink: Sink instance, e.g. PrometheusSink or JsonLinesSink.
+    """
+
+    global active
+
+    _sinks.append(sink)
+    active = True
+    sink.start()
+
+
+def unregister(sink):
+    """Stop a sink after writing the measurements a last time; metrics are
+    turned off with the last sink.
+    """
+
+    global active
+
+    _sinks.remove(sink)
+    active = bool(_sinks)
+    sink.stop()
+
+
+def hit_rates(measurements):
+    """Get hit rates of caches counted as <name>_hits_total and
+    <name>_misses_total.
+
+    :return: Dictionary, key: cache name, value: hits / lookups.
+    """
+
+    counters = measurements['counters']
+    rates = {}
+
+    for (name, labels), hits in counters.items():
+        if name.endswith('_hits_total') and not labels:
+            cache = name[:-len('_hits_total')]
+            lookups = hits + counters.get(('%s_misses_total' % cache, ()), 0)
+            rates[cache] = float(hits) / lookups if lookups else 0.0
+
+    return rates
+
+
+def __bound(index):
+    return '%g' % BUCKETS[index] if index < len(BUCKETS) else '+Inf'
+
+
+def __escape(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def __labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, __escape(value)) for name, value in labels)
+
+
+def to_prometheus(measurements):
+    """Format measurements in the Prometheus text exposition format.
+    """
+
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append('# TYPE %s %s' % (name, kind))
+
+    for (name, labels), value in sorted(measurements['counters'].items()):
+        declare(name, 'counter')
+        lines.append('%s%s %s' % (name, __labels(labels), value))
+
+    for (name, labels), (buckets, total) in sorted(measurements['histograms'].items()):
+        declare(name, 'histogram')
+        cumulative = 0
+        for index, observations in enumerate(buckets):
+            cumulative += observations
+            lines.append('%s_bucket%s %d' % (name, __labels(labels + (('le', __bound(index)),)), cumulative))
+        lines.append('%s_sum%s %r' % (name, __labels(labels), total))
+        lines.append('%s_count%s %d' % (name, __labels(labels), cumulative))
+
+    for cache, rate in sorted(hit_rates(measurements).items()):
+        declare('%s_hit_ratio' % cache, 'gauge')
+        lines.append('%s_hit_ratio %r' % (cache, rate))
+
+    return u'\n'.join(lines + [u''])
+
+
+def to_json(measurements):
+    """Format measurements as a single line of JSON. Histogram buckets are
+    [upper bound, observations in the bucket] pairs, not cumulative.
+    """
+
+    counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(measurements['counters'].items())]
+    histograms = []
+
+    for (name, labels), (buckets, total) in sorted(measurements['histograms'].items()):
+        histograms.append({'name': name,
+                           'labels': dict(labels),
+                           'buckets': [[__bound(i), x] for i, x in enumerate(buckets)],
+                           'sum': total,
+                           'count': sum(buckets)})
+
+    return json.dumps({'time': time.time(),
+                       'counters': counters,
+                       'histograms': histograms,
+                       'hit_rates': hit_rates(measurements)}, sort_keys=True)
+
+
+class Sink(object):
+    """Writes measurements to a file every interval seconds, from a
+    background thread, and when stopped.
+    """
+
+    def __init__(self, path, interval=FLUSH_INTERVAL):
+        """Initialize the sink.
+
+        :param path: Output file path.
+        :type path: str
+        :param interval: Seconds between two writes.
+        """
+
+        self.path = path
+        self.interval = interval
+        self.writes = 0
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        self.__stopped.clear()
+        self.__thread = threading.Thread(target=self.__loop, name='pyser-metrics')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+        self.flush()
+
+    def __loop(self):
+        while not self.__stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write the current measurements.
+        """
+
+        self.write(snapshot())
+        self.writes += 1
+
+    def write(self, measurements):
+        raise NotImplementedError
+
+
+class PrometheusSink(Sink):
+    """Replaces a file in the Prometheus text exposition format, e.g. for the
+    textfile collector of node_exporter.
+    """
+
+    def write(self, measurements):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(to_prometheus(measurements).encode('utf-8'))
+            os.rename(tmp_path, self.path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class JsonLinesSink(Sink):
+    """Appends a line of JSON with all measurements to a file on each write.
+    """
+
+    def write(self, measurements):
+        with open(self.path, 'ab') as f:
+            f.write('%s\n' % to_json(measurements))
+
+
+def open_sink(path, interval=FLUSH_INTERVAL):
+    """Get a sink for a file: Prometheus text format for a .prom file, JSON
+    lines otherwise.
+    """
+
+    if path.endswith('.prom'):
+        return PrometheusSink(path, interval)
+
+    return JsonLinesSink(path, interval)
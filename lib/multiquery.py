@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import time
+import logger
+import planner
+import interpreter
+from parser import Node
+from operations import Result
+from scanner import MultiScanner
+from utils import pyser_assert
+from exceptions import InterpreterError
+
+
+def __token_key(token):
+    return token.token, token.type.key
+
+
+def __tokens_key(tokens):
+    return tuple(__token_key(token) for token in tokens)
+
+
+def node_key(node):
+    """Get a hashable key of a node without its source.
+
+    Nodes with equal keys evaluate to equal results given equal sources.
+    """
+
+    parts = tuple((part.filter_,
+                   __tokens_key(part.commands),
+                   part.identifier.token if part.identifier is not None else None)
+                  for part in node.parts)
+
+    return (parts,
+            __token_key(node.group) if node.group is not None else None,
+            __tokens_key(node.post_processors))
+
+
+class MultiQuery(object):
+    """Executor of many queries on the same input.
+
+    Parse trees of all queries are merged into a DAG of distinct subtrees:
+    every subtree gets an id from its node key and the id of its source, so
+    equal subtrees of different queries (or equal queries) share one id.
+    Each distinct subtree is evaluated at most once per input and its result
+    is passed to every consumer.
+
+    Filters of the innermost nodes, which all scan the input data, are found
+    together by a MultiScanner.
+    """
+
+    __slots__ = ('_ids', '_nodes', '_sources', '_depths', '_innermost', '_scanners', 'prefix_scan',
+                 'evaluations', 'scans_saved')
+
+    def __init__(self, prefix_scan=False):
+        """
+        :param prefix_scan: See MultiScanner.
+        :type prefix_scan: bool
+        """
+
+        # key: (node key, source id), value: subtree id
+        self._ids = {}
+        # Per subtree id: representative node, id of its source (None for
+        # input data) and number of nodes in the subtree
+        self._nodes = []
+        self._sources = []
+        self._depths = []
+        self._innermost = []
+
+        # key: frozenset of innermost subtree ids, value: MultiScanner
+        self._scanners = {}
+        self.prefix_scan = prefix_scan
+
+        self.evaluations = 0
+        self.scans_saved = 0
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, node):
+        """Add a query parse tree to the DAG.
+
+        :param node: Parse tree root node.
+        :type node: Node
+        :return: Id of the query, see run.
+        """
+
+        pyser_assert(isinstance(node, Node),
+                     InterpreterError('Expected a Node instance: %s' % type(node)))
+
+        planner.plan(node)
+
+        chain = [node]
+        while chain[-1].nested:
+            chain.append(chain[-1].source)
+
+        source = None
+
+        for current in reversed(chain):
+            key = (node_key(current), source)
+            subtree = self._ids.get(key)
+
+            if subtree is None:
+                subtree = self._ids[key] = len(self._nodes)
+                self._nodes.append(current)
+                self._sources.append(source)
+                self._depths.append(1 if source is None else self._depths[source] + 1)
+                self._innermost.append(subtree if source is None else self._innermost[source])
+
+            source = subtree
+
+        return source
+
+    def run(self, data, ids, timings=None):
+        """Evaluate queries on the same input.
+
+        :param data: Input data string or None.
+        :param ids: Query ids returned by add.
+        :param timings: List the wall time of each query is appended to, in
+                        seconds; the shared scan of the input is not included
+                        and a subquery is timed with the first query using it.
+        :return: List of Result instances, one per id. Results of equal
+                 queries are the same instance and must not be modified.
+        """
+
+        data = Result() if data is None else Result(data=data)
+        memo = {}
+
+        if data.data:
+            scanner = self.__get_scanner(frozenset(self._innermost[subtree] for subtree in ids))
+            data.set_filtered(dict(((p.pattern, p.flags), found) for p, found
+                                   in zip(scanner.patterns, scanner.findall(data.data))))
+
+        if timings is None:
+            return [self.__evaluate(data, subtree, memo) for subtree in ids]
+
+        results = []
+        for subtree in ids:
+            start = time.time()
+            results.append(self.__evaluate(data, subtree, memo))
+            timings.append(time.time() - start)
+
+        return results
+
+    def __get_scanner(self, innermost):
+        scanner = self._scanners.get(innermost)
+
+        if scanner is None:
+            patterns = {}
+            for subtree in innermost:
+                for part in self._nodes[subtree].parts:
+                    if part.pattern is not None:
+                        patterns[(part.pattern.pattern, part.pattern.flags)] = part.pattern
+
+            scanner = self._scanners[innermost] = MultiScanner(patterns.values(), prefix_scan=self.prefix_scan)
+
+        return scanner
+
+    def __evaluate(self, data, subtree, memo):
+        # Unevaluated subtrees, outermost first
+        pending = []
+
+        while subtree is not None and subtree not in memo:
+            pending.append(subtree)
+            subtree = self._sources[subtree]
+
+        result = data if subtree is None else memo[subtree]
+
+        if subtree is not None:
+            self.scans_saved += self._depths[subtree]
+            logger.debug('Shared subtree #%d', subtree)
+
+        for subtree in reversed(pending):
+            result = memo[subtree] = interpreter.evaluate(result, self._nodes[subtree])
+
+        self.evaluations += len(pending)
+
+        return result
+
+    def stats(self):
+        return {'subtrees': len(self._nodes),
+                'subtree_evaluations': self.evaluations,
+                'scans_saved': self.scans_saved}
@@ -2,8 +2,8 @@
 # coding=utf-8
 
 import re
-import copy
 import logger
+import metrics
 from utils import ERROR_VALUE, pyser_assert
 from decorators import FootprintAllMethods, disable_auto_decoration, footprint
 from exceptions import InterpreterError, InternalError
@@ -12,21 +12,34 @@ RE_FLAGS = re.S | re.MULTILINE
 
 
 class Result(object):
+    """Values produced by a node: named groups, anonymous groups, plain
+    matches and the input data.
+
+    Containers are never modified in place, only replaced, so a derived
+    result shares its parent's lists. The group dictionaries are copied on
+    the first write through set_named.
+    """
 
     __metaclass__ = FootprintAllMethods
+    __slots__ = ('data', '_named_groups', '_anon_groups', '_found', '_shared', '_values', '_filtered', '_numbers')
 
     @disable_auto_decoration
     def __init__(self, result=None, named_groups=None, anon_groups=None, found=None, data=None):
         self.data = None
-        self.named_groups = {}
-        self.anon_groups = {}
-        self.found = []
+        self._named_groups = {}
+        self._anon_groups = {}
+        self._found = []
+        self._shared = False
+        self._values = None
+        self._numbers = None
+        self._filtered = None
 
         if result:
             self.data = result.data
-            self.named_groups = copy.deepcopy(result.named_groups)
-            self.anon_groups = copy.deepcopy(result.anon_groups)
-            self.found = copy.deepcopy(result.found)
+            self._named_groups = result.named_groups
+            self._anon_groups = result.anon_groups
+            self._found = result.found
+            self._shared = True
 
         if named_groups:
             self.named_groups = named_groups
@@ -37,97 +50,226 @@ class Result(object):
         if data:
             self.data = data
 
+    @property
+    def named_groups(self):
+        return self._named_groups
+
+    @named_groups.setter
+    def named_groups(self, value):
+        self._named_groups = value
+        self._values = None
+        self._numbers = None
+
+    @property
+    def anon_groups(self):
+        return self._anon_groups
+
+    @anon_groups.setter
+    def anon_groups(self, value):
+        self._anon_groups = value
+        self._values = None
+        self._numbers = None
+
+    @property
+    def found(self):
+        return self._found
+
+    @found.setter
+    def found(self, value):
+        self._found = value
+        self._values = None
+        self._numbers = None
+
     @disable_auto_decoration
     def __str__(self):
         return ('named: %s, anon: %s, found: %s'
                 % (self.named_groups, self.anon_groups, self.found))
 
     def get_values(self):
-        values = []
+        """Get all values as one list.
+
+        The list is built on first use and cached until the result changes.
+        It must not be modified.
+        """
+
+        if self._values is None:
+            parts = self._anon_groups.values() + self._named_groups.values() + [self._found]
+
+            if self.data:
+                parts.append([self.data])
+
+            parts = [x for x in parts if x]
+
+            if len(parts) == 1:
+                self._values = parts[0]
+            else:
+                self._values = [x for part in parts for x in part]
+
+        return self._values
+
+    def get_numbers(self, values=None):
+        """Get values of this result as integers, see numeric.
 
-        for val in self.anon_groups.values():
-            values += val
+        The integers of each list are kept until the result changes, so
+        further MIN, MAX and SUM of the same list do not parse it again.
 
-        for val in self.named_groups.values():
-            values += val
+        :param values: get_values() (default) or a list of values derived
+                       from this result, e.g. a group.
+        :return: List of integers, None unless all values are integers.
+        """
 
-        values += self.found
+        if values is None:
+            values = self.get_values()
 
-        if self.data:
-            values += [self.data]
+        if self._numbers is None:
+            self._numbers = {}
 
-        return values
+        # The list is kept with its integers so that its id is not reused
+        entry = self._numbers.get(id(values))
+        if entry is None or entry[0] is not values:
+            entry = self._numbers[id(values)] = (values, numeric(values))
+
+        return entry[1]
 
     def get_filtered(self, filter_):
-        result = Result()
+        values = self.get_values()
+
+        if self._filtered is not None and self._filtered[0] is values:
+            found = self._filtered[1].get((filter_.pattern, filter_.flags))
+            if found is not None:
+                return Result(found=found)
+
+        return Result(found=pyser_filter(filter_, values))
+
+    @disable_auto_decoration
+    def set_filtered(self, filtered):
+        """Provide precomputed filter matches of the current values, see
+        scanner.MultiScanner.
+
+        :param filtered: Dictionary, key: (pattern string, flags), value:
+                         pyser_filter result of the pattern on get_values().
+        """
+
+        self._filtered = (self.get_values(), filtered)
 
-        result.found = pyser_filter(filter_, self.get_values())
+    @disable_auto_decoration
+    def set_named(self, key, values):
+        """Set a named group, copying group dictionaries shared with the parent.
+        """
+
+        if self._shared:
+            self._named_groups = dict(self._named_groups)
+            self._anon_groups = dict(self._anon_groups)
+            self._shared = False
 
-        return result
+        self._named_groups[key] = values
+        self._values = None
+        self._numbers = None
 
     def reset(self):
-        self.__init__()
+        self.data = None
+        self._named_groups = {}
+        self._anon_groups = {}
+        self._found = []
+        self._shared = False
+        self._values = None
+        self._numbers = None
 
     def limit(self, n):
         self.found = self.found[:n]
-
-        for key, value in self.named_groups:
-            self.named_groups[key] = value[:n]
-
-        for key, value in self.anon_groups:
-            self.anon_groups[key] = value[:n]
+        self.named_groups = dict((key, value[:n]) for key, value in self.named_groups.items())
+        self.anon_groups = dict((key, value[:n]) for key, value in self.anon_groups.items())
+        self._shared = False
 
     @staticmethod
     @disable_auto_decoration
     def merge(*results):
-        result = Result()
+        # A single result is passed through, unless merging would drop its data
+        if len(results) == 1 and isinstance(results[0], Result) and results[0].data is None:
+            return results[0]
+
+        found, named_groups, anon_groups = [], {}, {}
 
         for r in results:
             pyser_assert(isinstance(r, Result), InterpreterError("Incorrect argument type: %s" % r))
 
-            result.found.extend(r.found)
+            found.extend(r.found)
 
             # No collisions allowed
             for k, v in r.named_groups.items():
-                pyser_assert(k not in result.named_groups)
-                result.named_groups[k] = v
+                pyser_assert(k not in named_groups)
+                named_groups[k] = v
 
             # Merge collisions
             for k, v in r.anon_groups.items():
-                if k in result.anon_groups:
-                    result.anon_groups[k].extend(v)
+                if k in anon_groups:
+                    anon_groups[k] = anon_groups[k] + v
                 else:
-                    result.anon_groups[k] = v
+                    anon_groups[k] = v
+
+        return Result(named_groups=named_groups, anon_groups=anon_groups, found=found)
 
-        return result
 
+def numeric(values):
+    """Get values as integers, as unify does.
 
+    :param values: List of values.
+    :return: List of integers, None unless all values are integers.
+    """
+
+    # A column not starting with an integer is not tried any further
+    try:
+        return map(int, values) if not values or __is_integer(values[0]) else None
+    except ValueError:
+        return None
+
+
+def __is_integer(value):
+    try:
+        int(value)
+    except ValueError:
+        return False
+
+    return True
+
+
+@metrics.timed('pyser_aggregate_seconds', kernel='max')
 @footprint
-def pyser_max(values):
+def pyser_max(values, result=None):
     if not values:
         return ERROR_VALUE
 
-    return unify(values, sort=True)[-1]
+    numbers = result.get_numbers(values) if result is not None else numeric(values)
+
+    return max(numbers) if numbers is not None else max(map(str, values))
 
 
+@metrics.timed('pyser_aggregate_seconds', kernel='min')
 @footprint
-def pyser_min(values):
+def pyser_min(values, result=None):
     if not values:
         return ERROR_VALUE
 
-    return unify(values, sort=True)[0]
+    numbers = result.get_numbers(values) if result is not None else numeric(values)
 
+    return min(numbers) if numbers is not None else min(map(str, values))
 
+
+@metrics.timed('pyser_aggregate_seconds', kernel='sum')
 @footprint
-def pyser_sum(values):
+def pyser_sum(values, result=None):
     if not values:
         return 0
 
-    return reduce(lambda x, y: x + y, unify(values))
+    numbers = result.get_numbers(values) if result is not None else numeric(values)
+
+    return sum(numbers) if numbers is not None else ''.join(map(str, values))
 
 
+@metrics.timed('pyser_aggregate_seconds', kernel='count')
 @footprint
-def pyser_count(values):
+def pyser_count(values, result=None):
+    # Same arguments as the other aggregates, see planner
     return len(values)
 
 
@@ -214,6 +356,7 @@ def pyser_freplace(args, result):
         raise NotImplementedError
 
 
+@metrics.timed('pyser_aggregate_seconds', kernel='distinct')
 @footprint
 def pyser_distinct(values):
     return list(set(values))
@@ -240,53 +383,28 @@ def pyser_distinct_each(values):
 def pyser_min_each(input_):
     assert isinstance(input_, Result)
 
-    result = Result()
+    found = [pyser_min(input_.found, input_)] if input_.found else None
+    named_groups = dict((key, [pyser_min(value, input_)]) for key, value in input_.named_groups.items() if value)
+    anon_groups = dict((key, [pyser_min(value, input_)]) for key, value in input_.anon_groups.items() if value)
 
-    if input_.found:
-        result.found = [pyser_min(input_.found)]
-
-    for key, value in input_.named_groups.items():
-        if not value:
-            continue
-        result.named_groups[key] = [pyser_min(value)]
-
-    for key, value in input_.anon_groups.items():
-        if not value:
-            continue
-        result.anon_groups[key] = [pyser_min(value)]
-
-    return result
+    return Result(named_groups=named_groups, anon_groups=anon_groups, found=found)
 
 
 @footprint
 def pyser_max_each(result):
-    new_result = Result()
-
-    if result.found:
-        new_result.found = [pyser_max(result.found)]
+    found = [pyser_max(result.found, result)] if result.found else None
+    named_groups = dict((key, [pyser_max(value, result)]) for key, value in result.named_groups.items() if value)
+    anon_groups = dict((key, [pyser_max(value, result)]) for key, value in result.anon_groups.items() if value)
 
-    for key, value in result.named_groups.items():
-        if not value:
-            continue
-        new_result.named_groups[key] = [pyser_max(value)]
-
-    for key, value in result.anon_groups.items():
-        if not value:
-            continue
-        new_result.anon_groups[key] = [pyser_max(value)]
-
-    return new_result
+    return Result(named_groups=named_groups, anon_groups=anon_groups, found=found)
 
 
 @footprint
 def unify(values, sort=False):
-    result = []
-    for x in values:
-        try:
-            result.append(int(x))
-        except ValueError:
-            result = [str(x) for x in values]
-            break
+    try:
+        result = map(int, values)
+    except ValueError:
+        result = map(str, values)
 
     if sort:
         result.sort()
@@ -294,15 +412,44 @@ def unify(values, sort=False):
     return result
 
 
+def _strings(data):
+    """Get the number and total length of the strings of (nested) lists.
+    """
+
+    if isinstance(data, basestring):
+        return 1, len(data)
+
+    strings = size = 0
+    for elem in data:
+        if isinstance(elem, basestring):
+            strings, size = strings + 1, size + len(elem)
+        elif isinstance(elem, list):
+            elem_strings, elem_size = _strings(elem)
+            strings, size = strings + elem_strings, size + elem_size
+
+    return strings, size
+
+
 @footprint
 def pyser_filter(filter_, data):
+    if metrics.active:
+        strings, size = _strings(data)
+        metrics.count('pyser_filter_calls_total', strings)
+        metrics.count('pyser_bytes_scanned_total', size)
+
+    return __filter(filter_, data)
+
+
+def __filter(filter_, data):
     if isinstance(data, list):
         found = []
         for elem in data:
-            found += pyser_filter(filter_, elem)
+            found += __filter(filter_, elem)
         return found
     elif isinstance(data, basestring):
-        logger.debug('filter=%s (%s)' % (filter_, type(filter_)))
-        return re.findall(filter_, data, RE_FLAGS)
+        logger.debug('filter=%s (%s)', filter_, type(filter_))
+        if isinstance(filter_, basestring):
+            return re.findall(filter_, data, RE_FLAGS)
+        return filter_.findall(data)
     else:
         raise InternalError('Unsupported data type: %s' % data)
\ No newline at end of file
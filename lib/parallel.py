@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import multiprocessing
+import batch
+import metrics
+import planner
+from multiquery import MultiQuery
+from store import ResultStore
+
+# Chunks per worker: enough to balance the load, few enough to keep the
+# per-task overhead low
+CHUNKS_PER_JOB = 4
+
+# Worker process state, see __init_worker
+_counters = None
+_multi_query = None
+_ids = None
+_mapped = False
+_store = None
+
+
+def prefilters(counters):
+    """Get distinct prefilters of a counter set in a deterministic order.
+    """
+
+    return [prefilter for _, prefilter in batch.prefilters(counters)]
+
+
+def make_chunks(files, jobs, chunks_per_job=CHUNKS_PER_JOB):
+    """Split files into chunks of about the same total size.
+
+    Files are taken largest first, so a huge file forms a chunk of its own
+    and starts early instead of straggling at the end, and small files are
+    grouped to save per-task overhead.
+
+    :param files: List of (file path, size in bytes, payload) tuples.
+    :param jobs: Number of worker processes.
+    :type jobs: int
+    :return: List of chunks, each a list of items of files.
+    """
+
+    total = sum(size for _, size, _ in files)
+    target = max(total // max(jobs * chunks_per_job, 1), 1)
+    chunks, chunk, chunk_size = [], [], 0
+
+    for item in sorted(files, key=lambda x: (-x[1], x[0])):
+        chunk.append(item)
+        chunk_size += item[1]
+
+        if chunk_size >= target:
+            chunks.append(chunk)
+            chunk, chunk_size = [], 0
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def __init_worker(counters, mapped, store_path):
+    global _counters, _multi_query, _ids, _mapped, _store
+
+    # Compiled expressions are not pickled, rebuild them
+    for counter in counters:
+        planner.plan(counter.query.node, force=True)
+
+    _counters = counters
+    _mapped = mapped
+    _multi_query = MultiQuery()
+    _ids = dict((counter.uri, _multi_query.add(counter.query.node)) for counter in counters) if not mapped else None
+    # Writing is left to the parent process, see ResultStore.apply
+    _store = ResultStore(store_path, deferred=True) if store_path is not None else None
+
+    # Measurements are sent to the parent with each chunk
+    if metrics.active:
+        metrics.detach()
+
+
+def __evaluate_chunk(chunk):
+    """Evaluate a chunk of files in a worker process.
+
+    :param chunk: List of (file path, size, indexes of applicable counters).
+    :return: List of (file path, list of (uri, values) pairs or None if
+             the file cannot be read) and the worker's statistics collected
+             meanwhile.
+    """
+
+    filters = prefilters(_counters)
+    before = [(p.checked, p.rejected) for p in filters]
+    evaluations, scans_saved = _multi_query.evaluations, _multi_query.scans_saved
+    store_stats = _store.stats() if _store is not None else None
+    results = []
+
+    for path, _, indexes in chunk:
+        file_counters = [_counters[i] for i in indexes]
+        data = batch.map_file(path) if _mapped else batch.get_file_contents(path)
+
+        if data is None:
+            results.append((path, None))
+            continue
+
+        try:
+            multi_query = None if _mapped else _multi_query
+            results.append((path, batch.evaluate_file(file_counters, data, multi_query, _ids, _store)))
+        finally:
+            if not isinstance(data, basestring):
+                data.close()
+
+    stats = {'prefilters': [(p.checked - c, p.rejected - r) for p, (c, r) in zip(filters, before)],
+             'evaluations': _multi_query.evaluations - evaluations,
+             'scans_saved': _multi_query.scans_saved - scans_saved}
+
+    if _store is not None:
+        stats['store'] = dict((key, value - store_stats[key]) for key, value in _store.stats().items())
+        stats['store_changes'] = _store.changes()
+
+    if metrics.active:
+        stats['metrics'] = metrics.collect()
+
+    return results, stats
+
+
+def run(counters, root='.', mapped=False, jobs=None, multi_query=None, store=None):
+    """Evaluate a counter set on all files matching its globs with a pool of
+    worker processes.
+
+    Workers receive the compiled counters once, at startup. Files are
+    distributed in size-aware chunks (see make_chunks) and results are
+    yielded in the order of batch.run, whatever order workers finish in.
+    Statistics of workers are added to the prefilters of counters, to
+    multi_query, to store and to the metrics of this process.
+
+    :param counters: List of Counter instances, see batch.load_counter_set.
+    :param root: Directory the shader_files globs are relative to.
+    :type root: str
+    :param mapped: Memory-map files instead of reading them.
+    :type mapped: bool
+    :param jobs: Number of worker processes, None for the number of CPUs.
+    :param multi_query: MultiQuery instance to collect statistics in.
+    :param store: ResultStore instance; workers open its database too, but
+                  only read it and send their changes to store.
+    :return: Generator of (file path, list of (uri, values) pairs).
+    """
+
+    jobs = jobs or multiprocessing.cpu_count()
+
+    if jobs == 1:
+        for item in batch.run(counters, root=root, mapped=mapped, multi_query=multi_query, store=store):
+            yield item
+        return
+
+    indexes = dict((counter.uri, i) for i, counter in enumerate(counters))
+    files = [(path, os.path.getsize(path), [indexes[c.uri] for c in file_counters])
+             for path, file_counters in batch.match_files(counters, root)]
+    order = [path for path, _, _ in files]
+
+    if multi_query is not None and not mapped:
+        for counter in counters:
+            multi_query.add(counter.query.node)
+
+    filters = prefilters(counters)
+    store_path = store.path if store is not None else None
+    pool = multiprocessing.Pool(jobs, __init_worker, (counters, mapped, store_path))
+
+    try:
+        # Results that arrived ahead of their turn
+        pending = {}
+        position = 0
+
+        for results, stats in pool.imap_unordered(__evaluate_chunk, make_chunks(files, jobs)):
+            for prefilter, (checked, rejected) in zip(filters, stats['prefilters']):
+                prefilter.checked += checked
+                prefilter.rejected += rejected
+            if multi_query is not None:
+                multi_query.evaluations += stats['evaluations']
+                multi_query.scans_saved += stats['scans_saved']
+            if store is not None:
+                store.hits += stats['store']['hits']
+                store.misses += stats['store']['misses']
+                store.writes += stats['store']['writes']
+                store.apply(stats['store_changes'])
+            if 'metrics' in stats:
+                metrics.merge(stats['metrics'])
+
+            pending.update(results)
+
+            while position < len(order) and order[position] in pending:
+                values = pending.pop(order[position])
+                if values is not None:
+                    yield order[position], values
+                position += 1
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -10,12 +10,19 @@ import logger
 
 class Node(object):
 
+    __slots__ = ('__source', 'group', 'parts', 'post_processors', 'group_pattern', 'limit', 'planned')
+
     def __init__(self):
         self.__source = None
         self.group = None
         self.parts = []
         self.post_processors = []
 
+        # Evaluation plan, see planner.plan
+        self.group_pattern = None
+        self.limit = None
+        self.planned = False
+
     @property
     def source(self):
         return self.__source
@@ -51,16 +58,34 @@ class Node(object):
         return string
 
     def __str__(self):
-        return '[NODE] parts: %s, from: %s, post: %s' % (self.parts, self.source, self.post_processors)
+        # Built inside out: deep trees must not hit the recursion limit
+        nodes, node = [], self
+        while isinstance(node, Node):
+            nodes.append(node)
+            node = node.source
+
+        string = str(node)
+        for node in reversed(nodes):
+            string = '[NODE] parts: %s, from: %s, post: %s' % (node.parts, string, node.post_processors)
+
+        return string
 
 
 class SelectNode(object):
 
+    __slots__ = ('filter_', 'commands', 'identifier', 'pattern', 'rpn', 'order', 'evaluate')
+
     def __init__(self):
         self.filter_ = None
         self.commands = []
         self.identifier = None
 
+        # Evaluation plan, see planner.plan_select
+        self.pattern = None
+        self.rpn = None
+        self.order = None
+        self.evaluate = None
+
     @property
     def types(self):
         """Distinct token type list.
@@ -71,7 +96,17 @@ class SelectNode(object):
     def operators(self):
         """Intersection.
         """
-        return types_in(Operator.members(), self.commands)
+        return any(c.type in OPERATORS for c in self.commands)
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        # Compiled expressions are closures; the planner rebuilds them
+        state['evaluate'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __str__(self):
         return '%s: %s, %s' % (self.identifier, self.filter_, self.commands)
@@ -83,127 +118,136 @@ class SelectNode(object):
 def build_tree(tokens):
     """Create a parse tree from token list.
 
+    Tokens are consumed in a single pass with a cursor. Each "FROM (" opens a
+    nested node on an explicit stack and the matching ")" closes it, so nesting
+    depth is bounded by neither recursion nor list copies. Error positions are
+    indexes into the given token list.
+
     :param tokens: List of tokens.
     :type tokens: list
     :return: Parse tree root node.
     """
 
-    node = Node()
-    i = 0
+    root = node = Node()
+    n = len(tokens)
 
-    while i < len(tokens):
-        token = tokens[i]
+    if not n:
+        return root
 
-        # First token on the list or a comma separator
-        if i == 0 or token.type is Separator.COMMA:
-            node.parts.append(SelectNode())
+    # Open nested nodes: (parent node, index of "(", parent bracket depth)
+    stack = []
+    # Unclosed brackets among the commands of the current node
+    depth = 0
 
-        # FROM
-        elif token.type is Command.FROM:
-            pyser_assert(node.source is None,
-                         ParserError('Multiple source at %s in %s' % (i, tokens)))
+    if tokens[0].type is not Command.SELECT:
+        raise ParserError.grammar(0, tokens)
 
-            next_token = tokens[i+1]
-            pyser_assert(next_token.type is Bracket.LEFT,
-                         ParserError.grammar(i, tokens))
+    node.parts.append(SelectNode())
+    i = 1
 
-            bracket_count = 1
-            end = i+3
+    while i < n:
+        token = tokens[i]
+        token_type = token.type
 
-            while True:
-                if 0 == bracket_count:
-                    break
+        # Comma separator: next SELECT part
+        if token_type is Separator.COMMA:
+            node.parts.append(SelectNode())
 
-                pyser_assert(end != len(tokens),
-                             ParserError.unbalanced(i+1, tokens))
+        # FROM ( SELECT ...
+        elif token_type is Command.FROM:
+            if node.source is not None:
+                raise ParserError('Multiple source at %s in %s' % (i, tokens))
+            if i + 1 >= n or tokens[i+1].type is not Bracket.LEFT:
+                raise ParserError.grammar(i, tokens)
+            if i + 2 >= n or tokens[i+2].type is not Command.SELECT:
+                raise ParserError.grammar(i + 2, tokens)
 
-                if tokens[end].type is Bracket.LEFT:
-                    bracket_count += 1
-                elif tokens[end].type is Bracket.RIGHT:
-                    bracket_count -= 1
-                end += 1
-            end -= 1
+            logger.debug('Nested node at %s', i + 1)
 
-            logger.debug('Recursion at %s-%s' % (i+1, end))
+            stack.append((node, i + 1, depth))
+            node, depth = Node(), 0
+            node.parts.append(SelectNode())
 
-            node.source = build_tree(tokens[i+2:end])
+            i += 2
 
-            i = end
+        # ) closing a nested node
+        elif token_type is Bracket.RIGHT and stack and not depth:
+            child = node
+            node, _, depth = stack.pop()
+            node.source = child
 
         # <RE>
-        elif token.type is RegularExpression.RE:
-            pyser_assert(node.parts[-1].filter_ is None,
-                         ParserError.repeated('filter', i, tokens))
+        elif token_type is RegularExpression.RE:
+            if node.parts[-1].filter_ is not None:
+                raise ParserError.repeated('filter', i, tokens)
 
             node.parts[-1].filter_ = token.token[1:-1]
 
         # AS <ID>
-        elif token.type is Command.AS:
-            pyser_assert(node.parts[-1].identifier is None,
-                         ParserError.repeated('identifier', i, tokens))
+        elif token_type is Command.AS:
+            if node.parts[-1].identifier is not None:
+                raise ParserError.repeated('identifier', i, tokens)
 
             i += 1
-            next_token = tokens[i]
 
-            pyser_assert(next_token.type is Identifier.ID,
-                         ParserError.grammar(i, tokens))
+            if i >= n or tokens[i].type is not Identifier.ID:
+                raise ParserError.grammar(i, tokens)
 
-            node.parts[-1].identifier = next_token
+            node.parts[-1].identifier = tokens[i]
 
         # ORDER ASC, ORDER DESC, ORDER <RE>
-        elif token.type in [Command.ORDER_ASC, Command.ORDER_DESC, Command.ORDER]:
-            pyser_assert(not types_in([Command.ORDER, Command.ORDER_ASC, Command.ORDER_DESC], node.post_processors),
-                         ParserError.repeated('order', i, tokens))
+        elif token_type is Command.ORDER_ASC or token_type is Command.ORDER_DESC or token_type is Command.ORDER:
+            if types_in([Command.ORDER, Command.ORDER_ASC, Command.ORDER_DESC], node.post_processors):
+                raise ParserError.repeated('order', i, tokens)
 
             node.post_processors.append(token)
 
-            if token.type is Command.ORDER:
+            if token_type is Command.ORDER:
                 i += 1
-                next_token = tokens[i]
 
-                pyser_assert(next_token.type is RegularExpression.RE,
-                             ParserError.grammar(i, tokens))
+                if i >= n or tokens[i].type is not RegularExpression.RE:
+                    raise ParserError.grammar(i, tokens)
 
-                node.post_processors.append(next_token)
+                node.post_processors.append(tokens[i])
 
         # LIMIT <INT>
-        elif token.type in [Command.LIMIT]:
-            pyser_assert(not type_in(Command.LIMIT, node.post_processors),
-                         ParserError.repeated('limit', i, tokens))
+        elif token_type is Command.LIMIT:
+            if type_in(Command.LIMIT, node.post_processors):
+                raise ParserError.repeated('limit', i, tokens)
 
             node.post_processors.append(token)
 
             i += 1
-            next_token = tokens[i]
 
-            pyser_assert(next_token.type is Numeric.INT,
-                         ParserError.grammar(i, tokens))
+            if i >= n or tokens[i].type is not Numeric.INT:
+                raise ParserError.grammar(i, tokens)
 
-            node.post_processors.append(next_token)
+            node.post_processors.append(tokens[i])
 
         # GROUP BY <RE>
-        elif token.type is Command.GROUP:
-            #pyser_assert(not type_in(Command.GROUP, node.post_processors),
-            #             ParserError.repeated('group', i, tokens))
-
-            #node.post_processors.append(token)
-
+        elif token_type is Command.GROUP:
             i += 1
-            next_token = tokens[i]
 
-            pyser_assert(next_token.type is RegularExpression.RE,
-                         ParserError.grammar(i, tokens))
+            if i >= n or tokens[i].type is not RegularExpression.RE:
+                raise ParserError.grammar(i, tokens)
 
-            #node.post_processors.append(next_token)
-            node.group = next_token
+            node.group = tokens[i]
 
-        # SUM, MIN, MAX, COUNT, FUNCTION()
+        # SUM, MIN, MAX, COUNT, FUNCTION(), expressions
         else:
-            logger.debug('append %s -> %s' % (i, token))
+            if token_type is Bracket.LEFT:
+                depth += 1
+            elif token_type is Bracket.RIGHT:
+                depth -= 1
+
+            logger.debug('append %s -> %s', i, token)
             node.parts[-1].commands.append(token)
 
         i += 1
 
-    logger.debug('parts: %s' % node.parts)
+    if stack:
+        raise ParserError.unbalanced(stack[-1][1], tokens)
+
+    logger.debug('parts: %s', root.parts)
 
-    return node
\ No newline at end of file
+    return root
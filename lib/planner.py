@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import re
+import operator
+import logger
+import regexinfo
+from lexer import Token
+from parser import Node, SelectNode
+from rules import Bracket, Command, Function, Identifier, Numeric, Operator, OPERATORS
+from prefilter import Prefilter
+from operations import (RE_FLAGS, pyser_sum, pyser_min, pyser_max, pyser_count,
+                        pyser_fmax, pyser_fmin, pyser_freplace, pyser_fsum, pyser_fcount)
+from decorators import footprint
+from utils import pyser_assert
+from exceptions import InternalError
+
+
+# Python implementation of arithmetic operators (integer operands)
+_OPERATORS = {Operator.ADD: operator.add,
+              Operator.SUB: operator.sub,
+              Operator.MUL: operator.mul,
+              Operator.DIV: operator.floordiv,
+              Operator.MOD: operator.mod,
+              Operator.POW: operator.pow}
+
+# Functions and aggregating commands allowed as expression operands
+_FUNCTIONS = {Function.MAX: pyser_fmax,
+              Function.MIN: pyser_fmin,
+              Function.REPLACE: pyser_freplace,
+              Function.SUM: pyser_fsum,
+              Function.COUNT: pyser_fcount}
+
+_AGGREGATES = {Command.SUM: pyser_sum,
+               Command.MIN: pyser_min,
+               Command.MAX: pyser_max,
+               Command.COUNT: pyser_count}
+
+# Commands of the outermost node, in evaluation order, whose result can be
+# merged from results of the same commands on parts of the input
+SHARD_COMMANDS = frozenset([(),
+                            (Command.COUNT,),
+                            (Command.SUM,),
+                            (Command.MIN,),
+                            (Command.MAX,),
+                            (Command.DISTINCT,),
+                            (Command.DISTINCT, Command.COUNT)])
+
+
+@footprint
+def get_args(fstring):
+    """Get function arguments as tokens, e.g. "MAX(C1, 2)" -> [C1, 2].
+    """
+
+    fstring = fstring.strip()
+    logger.debug(fstring)
+    fstring = fstring[:-1]
+    logger.debug(fstring)
+    fstring = fstring.split('(')[1]
+
+    fargs = []
+    for x in fstring.split(','):
+        x = x.strip()
+
+        try:
+            int(x)
+        except ValueError:
+            x = Token(x, Identifier.ID)
+        else:
+            x = Token(x, Numeric.INT)
+
+        fargs.append(x)
+
+    return fargs
+
+
+@footprint
+def rpn(commands):
+    """Convert infix commands to reverse polish notation.
+
+    :param commands: List of tokens.
+    :type commands: list
+    :return: List of tokens in RPN order.
+    """
+
+    stack = []
+    out = []
+
+    for c in commands:
+        if c.type is Bracket.LEFT:
+            stack.append(c)
+        elif c.type is Bracket.RIGHT:
+            while stack[-1].type is not Bracket.LEFT:
+                out.append(stack.pop(-1))
+            stack.pop(-1)
+        elif c.type in OPERATORS:
+            if not len(stack):
+                stack.append(c)
+            elif c.type.priority > stack[-1].type.priority:
+                stack.append(c)
+            else:
+                while stack[-1].type.priority > c.type.priority:
+                    out.append(stack.pop(-1))
+                    if not len(stack):
+                        break
+                stack.append(c)
+        else:
+            out.append(c)
+
+    out += stack[::-1]
+
+    return out
+
+
+@footprint
+def fold(expression):
+    """Evaluate constant subexpressions of an RPN expression.
+
+    An operator applied to two number literals is replaced with the number
+    it yields. Operations failing with an arithmetic error are left for run
+    time, so the error is raised where it used to be.
+
+    :param expression: List of tokens in RPN order.
+    :type expression: list
+    :return: New list of tokens in RPN order.
+    """
+
+    out = []
+
+    for c in expression:
+        if (c.type in OPERATORS and len(out) >= 2 and
+                out[-1].type is Numeric.INT and out[-2].type is Numeric.INT):
+            try:
+                value = _OPERATORS[c.type](int(out[-2].token), int(out[-1].token))
+            except ArithmeticError:
+                out.append(c)
+            else:
+                del out[-2:]
+                out.append(Token(str(value), Numeric.INT))
+        else:
+            out.append(c)
+
+    return out
+
+
+def __operand(token):
+    """Compile an RPN operand.
+
+    :return: Tuple (constant value or None, function of a Result), None if
+             the token cannot be compiled.
+    """
+
+    token_type = token.type
+
+    if token_type is Numeric.INT:
+        value = int(token.token)
+        return value, lambda result: value
+
+    elif token_type is Identifier.ID:
+        name = token.token
+
+        def identifier(result):
+            values = result.named_groups[name]
+            try:
+                return values[0]
+            except IndexError:
+                return values
+
+        return None, identifier
+
+    elif token_type in _FUNCTIONS:
+        function, args = _FUNCTIONS[token_type], get_args(token.token)
+        return None, lambda result: function(args, result)
+
+    elif token_type in _AGGREGATES:
+        aggregate = _AGGREGATES[token_type]
+        return None, lambda result: aggregate(result.get_values(), result)
+
+    return None
+
+
+def __operation(function, a, b):
+    """Compile an arithmetic operation on two compiled operands.
+    """
+
+    (const_a, get_a), (const_b, get_b) = a, b
+
+    if const_a is not None and const_b is not None:
+        return None, lambda result: function(const_a, const_b)
+    elif const_b is not None:
+        return None, lambda result: function(int(get_a(result)), const_b)
+    elif const_a is not None:
+        return None, lambda result: function(const_a, int(get_b(result)))
+
+    return None, lambda result: function(int(get_a(result)), int(get_b(result)))
+
+
+@footprint
+def compile_expression(expression):
+    """Turn an RPN expression into a single function of a Result.
+
+    Operands are read straight from the Result (named groups, aggregates,
+    function calls) and operators are plain Python callables, so evaluation
+    does no per-token dispatch.
+
+    :param expression: List of tokens in RPN order.
+    :type expression: list
+    :return: Function, None if the expression is malformed (left to the
+             interpreter, which reports the error).
+    """
+
+    stack = []
+
+    for c in expression:
+        if c.type in OPERATORS:
+            if len(stack) < 2:
+                return None
+
+            b, a = stack.pop(-1), stack.pop(-1)
+            stack.append(__operation(_OPERATORS[c.type], a, b))
+        else:
+            operand = __operand(c)
+
+            if operand is None:
+                return None
+
+            stack.append(operand)
+
+    if len(stack) != 1:
+        return None
+
+    return stack[0][1]
+
+
+@footprint
+def plan_select(select_node, prefilter=False):
+    """Precompute the evaluation plan of a single SELECT part.
+
+    Sets the compiled filter pattern and either the constant-folded RPN of an
+    arithmetic expression with its compiled function, or the priority order
+    of the remaining commands. Parts already planned are left as they are.
+
+    :param select_node: SELECT part.
+    :type select_node: SelectNode
+    :param prefilter: Wrap the pattern in a required-literal Prefilter.
+    :type prefilter: bool
+    """
+
+    pyser_assert(isinstance(select_node, SelectNode),
+                 InternalError('Expected a SelectNode instance: %s' % type(select_node)))
+
+    if select_node.filter_ is not None and select_node.pattern is None:
+        select_node.pattern = re.compile(select_node.filter_, RE_FLAGS)
+        if prefilter:
+            select_node.pattern = Prefilter(select_node.pattern)
+
+    if select_node.commands:
+        if select_node.operators:
+            if select_node.rpn is None:
+                select_node.rpn = fold(rpn(select_node.commands))
+            if select_node.evaluate is None:
+                select_node.evaluate = compile_expression(select_node.rpn)
+        elif select_node.order is None:
+            select_node.order = sorted(select_node.commands, key=lambda x: x.type.priority)[::-1]
+
+
+@footprint
+def plan(node, force=False):
+    """Annotate a parse tree with evaluation plans, nested nodes included.
+
+    Planning is done once per tree; further calls return immediately unless
+    forced, e.g. to rebuild compiled expressions of an unpickled tree.
+
+    :param node: Parse tree root node.
+    :type node: Node
+    :param force: Plan nodes already marked as planned.
+    :type force: bool
+    :return: The same node.
+    """
+
+    pyser_assert(isinstance(node, Node), InternalError('Expected a Node instance: %s' % type(node)))
+
+    root = node
+
+    while node is not None and (force or not node.planned):
+        # Only innermost filters search whole inputs, where a prefilter pays
+        # off; nested ones search short matches
+        for select_node in node.parts:
+            plan_select(select_node, prefilter=not node.nested)
+
+        if node.group is not None:
+            node.group_pattern = re.compile(node.group.token[1:-1])
+
+        for index, processor in enumerate(node.post_processors):
+            if processor.type is Command.LIMIT:
+                node.limit = int(node.post_processors[index+1].token)
+
+        node.planned = True
+        node = node.source if node.nested else None
+
+    return root
+
+
+@footprint
+def shard_commands(node):
+    """Decide if a query can be evaluated on line-aligned parts of its input
+    separately, see sharding.
+
+    Every node must be a single anonymous SELECT part without grouping or
+    post-processors; all but the outermost one pure filters. The innermost
+    filter must find no match spanning lines (see regexinfo.is_line_local),
+    so matches of the parts are the matches of the whole input. Nested filters
+    only search these matches.
+
+    :param node: Parse tree root node.
+    :type node: Node
+    :return: Tuple of the outermost node's command types in evaluation order,
+             empty for a plain match list; None if the query must be
+             evaluated on the whole input.
+    """
+
+    plan(node)
+
+    outermost = node
+
+    while True:
+        if len(node.parts) != 1 or node.group is not None or node.post_processors:
+            return None
+
+        part = node.parts[0]
+
+        if part.identifier is not None:
+            return None
+        if node is not outermost and (part.filter_ is None or part.commands):
+            return None
+        if not node.nested:
+            break
+
+        node = node.source
+
+    if part.pattern is None or not regexinfo.is_line_local(part.pattern):
+        return None
+
+    part = outermost.parts[0]
+
+    if part.commands and part.order is None:
+        # Arithmetic expression
+        return None
+
+    commands = tuple(c.type for c in part.order or ())
+
+    return commands if commands in SHARD_COMMANDS else None
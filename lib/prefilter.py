@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import regexinfo
+
+# Strings shorter than this go straight to the regex engine: looking up the
+# literals costs more than it can save
+MIN_LENGTH = 256
+
+
+class Prefilter(object):
+    """Compiled filter pattern that rejects data without running the regex
+    engine when it cannot match.
+
+    Literals every match contains (see regexinfo.required_literals) are
+    looked up with str.find: data missing any of them has no matches.
+    Shorter strings than MIN_LENGTH are not checked. When
+    every match starts with a literal prefix, the regex engine starts at the
+    first occurrence of a prefix. Searching from pos sees the characters
+    before pos, so no results change.
+
+    Stands in for the compiled pattern: findall, finditer, match, pattern,
+    flags and groups behave as those of re.compile(pattern, flags).
+    """
+
+    __slots__ = ('regex', 'required', 'prefixes', 'checked', 'rejected')
+
+    def __init__(self, regex):
+        """
+        :param regex: Compiled regular expression.
+        """
+
+        self.regex = regex
+        self.required = regexinfo.required_literals(regex)
+
+        prefixes = regexinfo.literal_prefixes(regex)
+        self.prefixes = tuple(prefixes) if prefixes is not None else None
+
+        # Number of searched strings and of those rejected by the prefilter
+        self.checked = 0
+        self.rejected = 0
+
+    def __getstate__(self):
+        return self.regex, self.required, self.prefixes
+
+    def __setstate__(self, state):
+        self.regex, self.required, self.prefixes = state
+        self.checked = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return 'Prefilter(%r, required=%s)' % (self.regex.pattern, self.required)
+
+    @property
+    def pattern(self):
+        return self.regex.pattern
+
+    @property
+    def flags(self):
+        return self.regex.flags
+
+    @property
+    def groups(self):
+        return self.regex.groups
+
+    def start(self, data, pos=0, endpos=None):
+        """Get where to start searching data.
+
+        :return: Position of the first possible match in data[pos:endpos],
+                 -1 if data cannot match.
+        """
+
+        if endpos is None:
+            endpos = len(data)
+
+        self.checked += 1
+
+        for literal in self.required:
+            if data.find(literal, pos, endpos) < 0:
+                self.rejected += 1
+                return -1
+
+        if self.prefixes is not None:
+            found = [x for x in (data.find(prefix, pos, endpos) for prefix in self.prefixes) if x >= 0]
+            if not found:
+                self.rejected += 1
+                return -1
+            pos = min(found)
+
+        return pos
+
+    def findall(self, data, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(data)
+
+        if endpos - pos < MIN_LENGTH:
+            return self.regex.findall(data, pos, endpos)
+
+        pos = self.start(data, pos, endpos)
+
+        return self.regex.findall(data, pos, endpos) if pos >= 0 else []
+
+    def finditer(self, data, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(data)
+
+        if endpos - pos < MIN_LENGTH:
+            return self.regex.finditer(data, pos, endpos)
+
+        pos = self.start(data, pos, endpos)
+
+        return self.regex.finditer(data, pos, endpos) if pos >= 0 else iter(())
+
+    def match(self, data, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(data)
+
+        return self.regex.match(data, pos, endpos)
+
+    def stats(self):
+        return {'pattern': self.regex.pattern,
+                'required': self.required,
+                'checked': self.checked,
+                'rejected': self.rejected}
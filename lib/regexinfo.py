@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import re
+import sre_parse
+import sre_constants as sre
+
+# Anchors that look at characters before the search start position
+_BEGINNING_ANCHORS = frozenset([sre.AT_BEGINNING, sre.AT_BEGINNING_LINE, sre.AT_BEGINNING_STRING,
+                                sre.AT_BOUNDARY, sre.AT_NON_BOUNDARY])
+
+
+def __subpatterns(value):
+    """Get subpatterns nested in an opcode argument.
+    """
+
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            for subpattern in __subpatterns(item):
+                yield subpattern
+
+
+def iter_opcodes(pattern):
+    """Iterate over all opcodes of a regular expression, nested ones included.
+
+    :param pattern: Compiled regular expression.
+    :return: Generator of (opcode, argument) pairs.
+    """
+
+    stack = [sre_parse.parse(pattern.pattern, pattern.flags)]
+
+    while stack:
+        for op, av in stack.pop():
+            yield op, av
+            stack.extend(__subpatterns(av))
+
+
+def is_position_sensitive(pattern):
+    """Check if matching depends on the data before the search start position.
+
+    pattern.finditer(data, pos, endpos) finds the same matches as
+    pattern.finditer(data[pos:endpos]) unless the pattern has a beginning
+    anchor, a word boundary or a lookbehind assertion: those see the
+    characters preceding pos.
+
+    :param pattern: Compiled regular expression.
+    :return: True if the pattern has to be applied to a copied substring.
+    """
+
+    for op, av in iter_opcodes(pattern):
+        if op == sre.AT and av in _BEGINNING_ANCHORS:
+            return True
+        if op in (sre.ASSERT, sre.ASSERT_NOT) and av[0] < 0:
+            return True
+
+    return False
+
+
+def __literal_prefixes(items):
+    prefix = ''
+
+    for op, av in items:
+        if op == sre.LITERAL and av < 128:
+            prefix += chr(av)
+            continue
+
+        # Anchors do not consume characters
+        if op == sre.AT:
+            continue
+
+        if prefix:
+            break
+
+        if op == sre.BRANCH:
+            prefixes = set()
+            for alternative in av[1]:
+                alternative_prefixes = __literal_prefixes(alternative)
+                if alternative_prefixes is None:
+                    return None
+                prefixes |= alternative_prefixes
+            return prefixes
+
+        if op == sre.SUBPATTERN:
+            return __literal_prefixes(av[1])
+
+        return None
+
+    return set([prefix]) if prefix else None
+
+
+def literal_prefixes(pattern):
+    """Get literal strings one of which every match of a pattern starts with.
+
+    E.g. 'send.*0x.9s' -> {'send'}, 'endif|endloop' -> {'endif', 'endloop'}.
+
+    :param pattern: Compiled regular expression.
+    :return: Set of non-empty strings, None if matches may start with any
+             character.
+    """
+
+    if pattern.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+
+    return __literal_prefixes(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+def __required_literals(items, literals):
+    run = ''
+
+    for op, av in items:
+        if op == sre.LITERAL and av < 128:
+            run += chr(av)
+            continue
+
+        if op == sre.AT:
+            continue
+
+        if run:
+            literals.add(run)
+            run = ''
+
+        # Lookarounds and optional parts do not have to be in the match
+        if op == sre.SUBPATTERN:
+            __required_literals(av[1], literals)
+        elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT) and av[0] >= 1:
+            __required_literals(av[2], literals)
+
+    if run:
+        literals.add(run)
+
+
+def required_literals(pattern):
+    """Get literal strings every match of a pattern contains.
+
+    E.g. 'send.*0x.9s' -> ('send', '0x'), 'cb0\[(\d+)\]' -> ('cb0[', ']').
+
+    :param pattern: Compiled regular expression.
+    :return: Tuple of non-empty strings, longest first.
+    """
+
+    if pattern.flags & (re.IGNORECASE | re.LOCALE):
+        return ()
+
+    literals = set()
+    __required_literals(sre_parse.parse(pattern.pattern, pattern.flags), literals)
+
+    return tuple(sorted(literals, key=lambda x: (-len(x), x)))
+
+
+def literal(pattern):
+    """Get the string a pattern matches if it is a plain literal.
+
+    :param pattern: Compiled regular expression.
+    :return: Non-empty string, None if the pattern is not a literal.
+    """
+
+    if pattern.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+
+    items = sre_parse.parse(pattern.pattern, pattern.flags)
+
+    if not len(items) or any(op != sre.LITERAL or av >= 128 for op, av in items):
+        return None
+
+    return ''.join(chr(av) for _, av in items)
+
+
+# Character classes that do not contain a newline
+_NO_NEWLINE_CATEGORIES = frozenset([sre.CATEGORY_DIGIT, sre.CATEGORY_NOT_SPACE, sre.CATEGORY_WORD,
+                                    sre.CATEGORY_NOT_LINEBREAK, sre.CATEGORY_LOC_WORD,
+                                    sre.CATEGORY_UNI_DIGIT, sre.CATEGORY_UNI_NOT_SPACE,
+                                    sre.CATEGORY_UNI_WORD, sre.CATEGORY_UNI_NOT_LINEBREAK])
+
+# Anchors that depend on where the string starts or ends
+_STRING_ANCHORS = frozenset([sre.AT_BEGINNING_STRING, sre.AT_END_STRING])
+
+_NEWLINE = ord('\n')
+
+
+def __set_has_newline(items):
+    negate = False
+    found = False
+
+    for op, av in items:
+        if op == sre.NEGATE:
+            negate = True
+        elif op == sre.LITERAL:
+            found = found or av == _NEWLINE
+        elif op == sre.RANGE:
+            found = found or av[0] <= _NEWLINE <= av[1]
+        elif op == sre.CATEGORY:
+            found = found or av not in _NO_NEWLINE_CATEGORIES
+        else:
+            found = True
+
+    return found != negate
+
+
+def is_line_local(pattern):
+    """Check if a pattern finds the same matches in every line as in the
+    whole text, i.e. findall on text split after newlines gives the matches
+    of findall on the text.
+
+    That is the case if no match can contain a newline or be empty, and the
+    pattern neither looks behind nor anchors at the string start or end.
+
+    :param pattern: Compiled regular expression.
+    """
+
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+
+    if parsed.getwidth()[0] == 0:
+        return False
+
+    for op, av in iter_opcodes(pattern):
+        if op == sre.LITERAL and av == _NEWLINE:
+            return False
+        if op == sre.NOT_LITERAL and av != _NEWLINE:
+            return False
+        if op == sre.ANY and pattern.flags & re.DOTALL:
+            return False
+        if op == sre.IN and __set_has_newline(av):
+            return False
+        if op == sre.AT and av in _STRING_ANCHORS:
+            return False
+        if op == sre.AT and av in (sre.AT_BEGINNING, sre.AT_END) and not pattern.flags & re.MULTILINE:
+            return False
+        if op in (sre.ASSERT, sre.ASSERT_NOT) and av[0] < 0:
+            return False
+        if op == sre.GROUPREF_EXISTS:
+            return False
+
+    return True
@@ -2,6 +2,9 @@
 # coding=utf-8
 
 import re
+import string
+import sre_parse
+import sre_constants
 import logger
 from utils import pyser_assert
 from exceptions import RulesError
@@ -44,10 +47,16 @@ class TokenType(object):
         self.name = name
         self.pattern = re.compile(pattern)
         self.priority = priority
+        self.category = None
+        self.key = None
 
     def __repr__(self):
         return self.name
 
+    def __reduce__(self):
+        # Token types are compared by identity: unpickle to the rule singleton
+        return get_type, (self.key,)
+
 
 class Command(_RulesContainer):
     """ Pyser commands.
@@ -142,6 +151,130 @@ class Type(_RulesContainer):
     SEPARATOR = Separator
 
 
+# Category sets for O(1) membership checks
+COMMANDS = frozenset(Command.members())
+FUNCTIONS = frozenset(Function.members())
+OPERATORS = frozenset(Operator.members())
+BRACKETS = frozenset(Bracket.members())
+IDENTIFIERS = frozenset(Identifier.members())
+NUMERICS = frozenset(Numeric.members())
+
+# All token types in rule definition order
+TOKEN_TYPES = [subtype for type_ in Type.members() for subtype in type_.members()]
+
+# Token types by their "CONTAINER.MEMBER" key
+_BY_KEY = {}
+
+for __type_name in [x for x in dir(Type) if x.isupper() and not x.startswith('_')]:
+    __type = getattr(Type, __type_name)
+    for __name in [x for x in dir(__type) if x.isupper() and not x.startswith('_')]:
+        __subtype = getattr(__type, __name)
+        __subtype.category = __type
+        __subtype.key = '%s.%s' % (__type_name, __name)
+        _BY_KEY[__subtype.key] = __subtype
+
+del __type_name, __type, __name, __subtype
+
+
+def get_type(key):
+    """Get a token type by its "CONTAINER.MEMBER" key, e.g. "COMMAND.SUM_EACH".
+    """
+
+    try:
+        return _BY_KEY[key]
+    except KeyError:
+        raise RulesError('Unknown token type: %s' % key)
+
+
+def __first_chars(parsed):
+    """Get the characters a parsed pattern can start with.
+
+    :param parsed: sre_parse output.
+    :return: Set of characters, None if any character is possible.
+    """
+
+    items = list(parsed)
+
+    if not items:
+        return None
+
+    op, av = items[0]
+
+    if op == sre_constants.LITERAL:
+        return set([chr(av)])
+    elif op == sre_constants.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op == sre_constants.LITERAL:
+                chars.add(chr(item_av))
+            elif item_op == sre_constants.RANGE:
+                chars.update(chr(x) for x in range(item_av[0], item_av[1] + 1))
+            elif item_op == sre_constants.CATEGORY and item_av == sre_constants.CATEGORY_DIGIT:
+                chars.update(string.digits)
+            else:
+                return None
+        return chars
+    elif op == sre_constants.SUBPATTERN:
+        return __first_chars(av[-1])
+    elif op == sre_constants.BRANCH:
+        chars = set()
+        for branch in av[1]:
+            branch_chars = __first_chars(branch)
+            if branch_chars is None:
+                return None
+            chars |= branch_chars
+        return chars
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] > 0:
+        return __first_chars(av[2])
+
+    return None
+
+
+def __match_in_order(token):
+    """Find the first token type matching the whole token, in rule definition order.
+    """
+
+    for subtype in TOKEN_TYPES:
+        if subtype.pattern.match(token):
+            return subtype
+
+    return None
+
+
+def __build_index():
+    """Precompute the dispatch index used by find_type.
+
+    :return: Tuple (keyword text -> token type, leading character -> candidate
+             token types, candidate token types for any other character).
+    """
+
+    keywords, leading, wildcard = {}, {}, []
+
+    for subtype in TOKEN_TYPES:
+        pattern = subtype.pattern.pattern
+        parsed = sre_parse.parse(pattern[:-1] if pattern.endswith('$') else pattern)
+
+        # Plain text patterns: the whole token can be looked up directly
+        if all(op == sre_constants.LITERAL for op, _ in parsed):
+            text = ''.join(chr(av) for _, av in parsed)
+            keywords[text] = __match_in_order(text)
+
+        chars = __first_chars(parsed)
+
+        if chars is None:
+            wildcard.append(subtype)
+            for candidates in leading.values():
+                candidates.append(subtype)
+        else:
+            for char in chars:
+                leading.setdefault(char, list(wildcard)).append(subtype)
+
+    return keywords, leading, wildcard
+
+
+_KEYWORDS, _LEADING, _WILDCARD = __build_index()
+
+
 def find_type(token):
     """Check if given piece of code matches any definition rule.
 
@@ -152,10 +285,14 @@ def find_type(token):
 
     token = token.upper()
 
-    for type_ in Type.members():
-        for subtype in type_.members():
-            if subtype.pattern.match(token):
-                logger.debug('found: %s -> %s' % (token, subtype))
-                return subtype
+    subtype = _KEYWORDS.get(token)
+
+    if subtype is not None:
+        return subtype
+
+    for subtype in _LEADING.get(token[:1], _WILDCARD):
+        if subtype.pattern.match(token):
+            logger.debug('found: %s -> %s', token, subtype)
+            return subtype
 
     return None
\ No newline at end of file
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import re
+import metrics
+import regexinfo
+from streaming import match_value
+
+
+class MultiScanner(object):
+    """Finds all matches of many patterns in the same data.
+
+    A plain literal pattern matches its string once per non-overlapping
+    occurrence, so its matches are counted with str.count instead of being
+    built by the regular expression engine.
+
+    With prefix_scan, patterns with literal prefixes are found in a single
+    pass over the data. Every match of a pattern with literal prefixes (see
+    regexinfo.literal_prefixes) starts at an occurrence of one of them. One
+    lookahead alternation over the prefixes of all such patterns locates the
+    candidate positions and each pattern is only tried, with
+    pattern.match(data, pos), at candidates of its own prefixes past the end
+    of its previous match. Every pattern keeps its own non-overlapping match
+    sequence, so the results are those of separate findall calls; matching
+    at pos sees the whole data, so anchors and lookbehinds are unaffected.
+
+    The shared pass runs Python code at every candidate position, while
+    sre searches a literal prefix in C: it only pays off on large inputs
+    where the prefixes are rare, hence it is off by default.
+
+    Other patterns fall back to separate findall scans.
+    """
+
+    __slots__ = ('patterns', '_literals', '_candidates', '_by_prefix', '_scanned', '_fallback')
+
+    def __init__(self, patterns, prefix_scan=False):
+        """
+        :param patterns: List of compiled patterns.
+        :param prefix_scan: Find patterns with literal prefixes in one pass.
+        :type prefix_scan: bool
+        """
+
+        self.patterns = list(patterns)
+        self._literals = {}
+        prefixes = {}
+
+        for index, pattern in enumerate(self.patterns):
+            string = regexinfo.literal(pattern)
+            if string is not None:
+                self._literals[index] = string
+                continue
+
+            pattern_prefixes = regexinfo.literal_prefixes(pattern) if prefix_scan else None
+            if pattern_prefixes is not None:
+                prefixes[index] = tuple(pattern_prefixes)
+
+        # A single prefixed pattern is faster on its own
+        if len(prefixes) < 2:
+            prefixes = {}
+
+        self._scanned = sorted(prefixes)
+        self._fallback = [i for i in range(len(self.patterns)) if i not in prefixes and i not in self._literals]
+
+        # Longest prefixes first: the candidate pattern captures the longest
+        # prefix at each position, the others found there are its prefixes
+        alternatives = sorted(set(prefix for index in self._scanned for prefix in prefixes[index]),
+                              key=len, reverse=True)
+
+        # key: captured prefix, value: indexes of patterns with a prefix of it
+        self._by_prefix = {}
+        for alternative in alternatives:
+            self._by_prefix[alternative] = [index for index in self._scanned
+                                            if any(alternative.startswith(x) for x in prefixes[index])]
+
+        self._candidates = None
+        if alternatives:
+            self._candidates = re.compile('(?=(%s))' % '|'.join(re.escape(x) for x in alternatives))
+
+    @property
+    def single_pass(self):
+        """Number of patterns found in the shared pass.
+        """
+
+        return len(self._scanned)
+
+    def findall(self, data):
+        """Get matches of every pattern.
+
+        :param data: Input data string.
+        :return: List of match lists, pattern.findall(data) for each pattern.
+        """
+
+        found = [None] * len(self.patterns)
+
+        if metrics.active:
+            # One pass per literal and fallback pattern, one for the rest
+            passes = len(self._literals) + len(self._fallback) + (self._candidates is not None)
+            metrics.count('pyser_filter_calls_total', passes)
+            metrics.count('pyser_bytes_scanned_total', len(data) * passes)
+
+        for index, string in self._literals.items():
+            found[index] = [string] * data.count(string)
+
+        for index in self._fallback:
+            found[index] = self.patterns[index].findall(data)
+
+        if self._candidates is None:
+            return found
+
+        # Start of the next allowed match of each pattern
+        pos = [0] * len(self.patterns)
+
+        for index in self._scanned:
+            found[index] = []
+
+        for candidate in self._candidates.finditer(data):
+            start = candidate.start()
+
+            for index in self._by_prefix[candidate.group(1)]:
+                if start < pos[index]:
+                    continue
+
+                match = self.patterns[index].match(data, start)
+
+                if match is not None:
+                    found[index].append(match_value(match))
+                    pos[index] = match.end()
+
+        return found
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import mmap
+import multiprocessing
+import planner
+import streaming
+from rules import Command
+from operations import Result, unify, numeric
+from utils import ERROR_VALUE
+from parallel import CHUNKS_PER_JOB
+
+# Files are split into shards of at least this many bytes; smaller files are
+# not worth the process pool
+MIN_SHARD_SIZE = 16 * 1024 * 1024
+
+# Worker process state, see __init_worker
+_chain = None
+_commands = None
+
+
+def split(path, shards):
+    """Split a file into about equally sized shards, each ending after a
+    newline (or at the end of the file).
+
+    :param path: File path.
+    :type path: str
+    :param shards: Number of shards wanted.
+    :type shards: int
+    :return: List of (start, end) offsets in file order.
+    """
+
+    size = os.path.getsize(path)
+
+    if not size:
+        return []
+
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        spans, start = [], 0
+
+        for i in range(1, shards):
+            newline = buffer.find('\n', max(size * i // shards, start))
+            if newline < 0:
+                break
+            if newline + 1 < size:
+                spans.append((start, newline + 1))
+                start = newline + 1
+
+        spans.append((start, size))
+    finally:
+        buffer.close()
+
+    return spans
+
+
+def _ordered_set(values):
+    seen = set()
+    return [x for x in values if not (x in seen or seen.add(x))]
+
+
+def _extremes(values):
+    """Get (integer minimum and maximum or None unless all values are
+    integers, minimum and maximum as strings) of values, None if there are
+    none; see operations.unify.
+    """
+
+    values = list(values)
+
+    if not values:
+        return None
+
+    strings = [str(x) for x in values]
+    numbers = unify(values)
+    numbers = (min(numbers), max(numbers)) if numbers and not isinstance(numbers[0], str) else None
+
+    return numbers, (min(strings), max(strings))
+
+
+def _sum(values):
+    """Get the integer sum of values, None unless all values are integers;
+    see operations.pyser_sum.
+
+    The concatenation operations.pyser_sum gives for other values grows with
+    the input, so it is not kept as a partial result.
+    """
+
+    numbers = numeric(list(values))
+
+    return sum(numbers) if numbers is not None else None
+
+
+def partial(commands, values):
+    """Evaluate commands on the values of a shard, as far as the results
+    of all shards can be merged.
+
+    :param commands: Tuple of command types, see planner.shard_commands.
+    :param values: Iterable of values of the shard.
+    :return: Partial result for merge.
+    """
+
+    if not commands:
+        return list(values)
+    elif commands == (Command.COUNT,):
+        return sum(1 for _ in values)
+    elif commands == (Command.DISTINCT,):
+        return _ordered_set(values)
+    elif commands == (Command.DISTINCT, Command.COUNT):
+        return set(values)
+    elif commands == (Command.SUM,):
+        return _sum(values)
+
+    return _extremes(values)
+
+
+def combine(commands, partials):
+    """Combine partial results of consecutive shards, in file order, into
+    the partial result of their concatenation.
+
+    :param commands: Tuple of command types, see planner.shard_commands.
+    :param partials: List of partial results, see partial.
+    :return: Partial result.
+    """
+
+    if not commands:
+        return [x for values in partials for x in values]
+    elif commands == (Command.COUNT,):
+        return sum(partials)
+    elif commands == (Command.DISTINCT,):
+        return _ordered_set(x for values in partials for x in values)
+    elif commands == (Command.DISTINCT, Command.COUNT):
+        return set().union(*partials)
+    elif commands == (Command.SUM,):
+        return sum(partials) if None not in partials else None
+
+    partials = [x for x in partials if x is not None]
+
+    if not partials:
+        return None
+
+    numbers = [x for x, _ in partials]
+    numbers = (min(x[0] for x in numbers), max(x[1] for x in numbers)) if None not in numbers else None
+
+    return numbers, (min(x[0] for _, x in partials), max(x[1] for _, x in partials))
+
+
+def mergeable(commands, partial):
+    """Check if a partial result can be merged, see merge.
+    """
+
+    return commands != (Command.SUM,) or partial is not None
+
+
+def merge(commands, partials):
+    """Merge partial results of shards, in file order, into the values the
+    commands give for the whole input.
+
+    :param commands: Tuple of command types, see planner.shard_commands.
+    :param partials: List of partial results, see partial.
+    :return: List of values, None if the partial results cannot be merged
+             (SUM of values that are not all integers).
+    """
+
+    combined = combine(commands, partials)
+
+    if not mergeable(commands, combined):
+        return None
+    elif not commands:
+        return combined
+    elif commands == (Command.COUNT,):
+        return [combined]
+    elif commands == (Command.DISTINCT,):
+        # Same first insertions in the same order as for all values at once,
+        # so the set iterates in the same order as operations.pyser_distinct
+        return list(set(combined))
+    elif commands == (Command.DISTINCT, Command.COUNT):
+        return [len(combined)]
+    elif commands == (Command.SUM,):
+        return [combined]
+
+    if combined is None:
+        return [ERROR_VALUE]
+
+    numbers, strings = combined
+    index = 0 if commands == (Command.MIN,) else 1
+
+    return [numbers[index] if numbers is not None else strings[index]]
+
+
+def get_chain(node):
+    """Get the nodes of a parse tree from the innermost one outwards.
+    """
+
+    chain = [node]
+    while chain[-1].nested:
+        chain.append(chain[-1].source)
+    chain.reverse()
+
+    return chain
+
+
+def evaluate(chain, commands, data):
+    """Evaluate a shard-safe query on a shard.
+
+    :param chain: Planned nodes of the query, see get_chain.
+    :param commands: Tuple of command types, see planner.shard_commands.
+    :param data: Contents of the shard.
+    :type data: str
+    :return: Partial result, see partial.
+    """
+
+    values = [data]
+
+    for node in chain:
+        pattern = node.parts[0].pattern
+        if pattern is not None:
+            values = streaming.filter_stream(pattern, values)
+
+    return partial(commands, values)
+
+
+def __init_worker(node, commands):
+    global _chain, _commands
+
+    # Compiled patterns are not pickled, rebuild them
+    planner.plan(node, force=True)
+
+    _chain = get_chain(node)
+    _commands = commands
+
+
+def __evaluate_shard(span):
+    """Evaluate the query on a shard in a worker process.
+
+    :param span: (file path, start, end) of the shard.
+    :return: Partial result, see partial.
+    """
+
+    path, start, end = span
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    return evaluate(_chain, _commands, data)
+
+
+def run(path, node, jobs=None, shard_size=MIN_SHARD_SIZE):
+    """Evaluate a query on a file split into line-aligned shards with a pool
+    of worker processes.
+
+    Matches of a line-local innermost filter never span shards, so shards
+    need no overlap. Shards are evaluated independently and their partial
+    results merged in file order.
+
+    :param path: File path.
+    :type path: str
+    :param node: Parse tree root node.
+    :type node: Node
+    :param jobs: Number of worker processes, None for the number of CPUs.
+    :param shard_size: Minimum shard size in bytes.
+    :type shard_size: int
+    :return: Result instance equal to that of the serial engines, None if the
+             query is not shard-safe (see planner.shard_commands), the file
+             is too small to split or the partial results cannot be merged.
+    """
+
+    jobs = jobs or multiprocessing.cpu_count()
+    commands = planner.shard_commands(node)
+
+    if jobs == 1 or commands is None:
+        return None
+
+    shards = min(jobs * CHUNKS_PER_JOB, os.path.getsize(path) // max(shard_size, 1))
+    spans = split(path, shards) if shards > 1 else []
+
+    if len(spans) < 2:
+        return None
+
+    pool = multiprocessing.Pool(min(jobs, len(spans)), __init_worker, (node, commands))
+
+    try:
+        partials = pool.map(__evaluate_shard, [(path, start, end) for start, end in spans])
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    values = merge(commands, partials)
+
+    return Result(found=values) if values is not None else None
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import cPickle as pickle
+import logger
+import metrics
+from version import __version__
+from decorators import footprint
+
+# Default bound of the values stored in a result store, in bytes
+RESULT_STORE_SIZE = 256 * 1024 * 1024
+
+
+class PlanStore(object):
+    """On-disk store of compiled queries.
+
+    Each query is pickled to its own file named after the hash of its
+    normalized code, in a subdirectory per pyser version.
+    """
+
+    def __init__(self, directory):
+        """Initialize the store.
+
+        :param directory: Cache directory, created on first write.
+        :type directory: str
+        """
+
+        self.directory = os.path.join(directory, __version__)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def path(self, key):
+        """Get the file path of a normalized query.
+        """
+
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+
+        return os.path.join(self.directory, '%s.plan' % hashlib.sha1(key).hexdigest())
+
+    @footprint
+    def load(self, key):
+        """Load a compiled query.
+
+        :param key: Normalized query code.
+        :type key: str
+        :return: CompiledQuery instance, None if not stored or unreadable.
+        """
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                query = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError) as e:
+            if not isinstance(e, IOError):
+                logger.warning('Dropping unreadable plan for %s: %s', key, e)
+            self.misses += 1
+            return None
+
+        # Hash collision or foreign file
+        if query.key != key:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return query
+
+    @footprint
+    def save(self, query):
+        """Store a compiled query, atomically replacing an older copy.
+
+        :param query: CompiledQuery instance.
+        """
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(query, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path(query.key))
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.writes += 1
+
+    def stats(self):
+        """Get store counters (hits, misses, writes).
+        """
+
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes}
+
+
+class ResultStore(object):
+    """On-disk store of query results in an SQLite database.
+
+    Values are keyed by the hash of the input data, the hash of the
+    normalized query code and the pyser version, so changed files, changed
+    queries and upgrades miss. When the stored values exceed the size
+    bound, the least recently used ones are evicted (see evict).
+
+    Several processes may use the same database; each needs its own
+    instance. Only one can write at a time, so worker processes use
+    deferred instances that only read and hand their changes to the
+    writing one, see changes and apply.
+    """
+
+    def __init__(self, path, max_size=RESULT_STORE_SIZE, deferred=False):
+        """Open the store, creating the database if needed.
+
+        :param path: Database file path.
+        :type path: str
+        :param max_size: Maximum total size of stored values in bytes.
+        :type max_size: int
+        :param deferred: Keep new values and use times in memory instead of
+                         writing them, see changes.
+        :type deferred: bool
+        """
+
+        self.path = path
+        self.max_size = max_size
+        self.deferred = deferred
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        # Changes of a deferred store: key: (content, plan), value: row to
+        # insert; (used, content, plan) of loaded values
+        self.__saved = {}
+        self.__used = []
+
+        self.__db = sqlite3.connect(path, timeout=60)
+        # Readers do not wait for the writer, nor the writer for readers
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS results ('
+                          'content TEXT, plan TEXT, version TEXT, value BLOB, size INTEGER, used REAL, '
+                          'PRIMARY KEY (content, plan, version))')
+        self.__db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.__db.commit()
+
+    @staticmethod
+    def content_hash(data):
+        """Get the key of input data.
+
+        :param data: String or memory-mapped file.
+        """
+
+        return hashlib.sha1(data).hexdigest()
+
+    @staticmethod
+    def plan_hash(query):
+        """Get the key of a compiled query.
+        """
+
+        key = query.key.encode('utf-8') if isinstance(query.key, unicode) else query.key
+
+        return hashlib.sha1(key).hexdigest()
+
+    @footprint
+    def load(self, content, query):
+        """Load the values of a query on input data and mark them as used.
+
+        :param content: Input data key, see content_hash.
+        :param query: CompiledQuery instance.
+        :return: List of values, None if not stored or unreadable.
+        """
+
+        plan = self.plan_hash(query)
+        row = self.__saved.get((content, plan))
+        if row is not None:
+            row = row[3:]
+        else:
+            row = self.__db.execute('SELECT value FROM results WHERE content = ? AND plan = ? AND version = ?',
+                                    (content, plan, __version__)).fetchone()
+
+        try:
+            values = pickle.loads(str(row[0])) if row is not None else None
+        except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError) as e:
+            logger.warning('Dropping unreadable result of %s: %s', query.key, e)
+            values = None
+
+        if values is None:
+            self.misses += 1
+            if metrics.active:
+                metrics.count('pyser_result_store_misses_total')
+            return None
+
+        if self.deferred:
+            self.__used.append((time.time(), content, plan, __version__))
+        else:
+            self.__db.execute('UPDATE results SET used = ? WHERE content = ? AND plan = ? AND version = ?',
+                              (time.time(), content, plan, __version__))
+        self.hits += 1
+        if metrics.active:
+            metrics.count('pyser_result_store_hits_total')
+
+        return values
+
+    @footprint
+    def save(self, content, query, values):
+        """Store the values of a query on input data.
+
+        :param content: Input data key, see content_hash.
+        :param query: CompiledQuery instance.
+        :param values: List of values.
+        """
+
+        value = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+        row = (content, self.plan_hash(query), __version__, value, len(value), time.time())
+
+        if self.deferred:
+            self.__saved[row[:2]] = row
+        else:
+            self.__insert([row])
+        self.writes += 1
+
+    def __insert(self, rows):
+        self.__db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                              [row[:3] + (sqlite3.Binary(row[3]),) + row[4:] for row in rows])
+
+    def commit(self):
+        self.__db.commit()
+
+    def changes(self):
+        """Take the values saved and loaded since the last call, as a
+        deferred store.
+
+        :return: Changes for apply.
+        """
+
+        changes = {'saved': self.__saved.values(), 'used': self.__used}
+        self.__saved, self.__used = {}, []
+
+        return changes
+
+    @footprint
+    def apply(self, changes):
+        """Write the changes of a deferred store (see changes) and commit.
+        """
+
+        self.__insert(changes['saved'])
+        self.__db.executemany('UPDATE results SET used = ? WHERE content = ? AND plan = ? AND version = ?',
+                              changes['used'])
+        self.__db.commit()
+
+    def size(self):
+        """Get the total size of stored values in bytes.
+        """
+
+        return self.__db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    @footprint
+    def evict(self):
+        """Delete the least recently used values until the rest fit max_size.
+
+        :return: Number of values deleted.
+        """
+
+        excess = self.size() - self.max_size
+        victims = []
+
+        if excess > 0:
+            for rowid, size in self.__db.execute('SELECT rowid, size FROM results ORDER BY used'):
+                victims.append((rowid,))
+                excess -= size
+                if excess <= 0:
+                    break
+
+        self.__db.executemany('DELETE FROM results WHERE rowid = ?', victims)
+        self.__db.commit()
+        self.evictions += len(victims)
+
+        return len(victims)
+
+    def close(self):
+        """Evict values over the size bound, commit and close the database.
+        A deferred store is closed without writing.
+        """
+
+        if not self.deferred:
+            self.evict()
+        self.__db.close()
+
+    def stats(self):
+        """Get store counters (hits, misses, writes, evictions).
+        """
+
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions}
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import mmap
+from itertools import islice
+import logger
+import metrics
+import planner
+import interpreter
+import regexinfo
+from parser import Node
+from rules import Command
+from operations import Result
+from utils import pyser_assert
+from decorators import footprint
+from exceptions import InterpreterError, InternalError
+
+
+def _count(values):
+    return [sum(1 for _ in values)]
+
+
+def _distinct(values):
+    return list(set(values))
+
+
+def _count_distinct(values):
+    return [len(set(values))]
+
+
+# Reducers that do not need the values themselves, only how many there are
+_SPAN_REDUCERS = frozenset([_count])
+
+
+# Commands (in evaluation order) that can consume a stream without keeping it
+_REDUCERS = {(Command.COUNT,): _count,
+             (Command.DISTINCT,): _distinct,
+             (Command.DISTINCT, Command.COUNT): _count_distinct}
+
+
+def _single_part(node):
+    """Get node's only SELECT part if the node is a plain value transformation.
+
+    :return: SelectNode, None for multiple parts, identifiers or grouping.
+    """
+
+    if len(node.parts) != 1 or node.group is not None:
+        return None
+
+    part = node.parts[0]
+
+    if part.identifier is not None:
+        return None
+
+    return part
+
+
+def is_streamable(node):
+    """Check if a node is a pure filter, i.e. maps each input value to its
+    matches, optionally followed by LIMIT.
+    """
+
+    part = _single_part(node)
+
+    if part is None or part.filter_ is None or part.commands:
+        return False
+
+    # LIMIT is the only post-processor that can be applied to a stream
+    return not node.post_processors or (node.limit is not None and len(node.post_processors) == 2)
+
+
+def has_limit_pushdown(node):
+    """Check if streaming a planned tree stops scanning early thanks to LIMIT.
+    """
+
+    while True:
+        if node.limit is not None and is_streamable(node):
+            return True
+        if not node.nested:
+            return False
+        node = node.source
+
+
+def get_reducer(node):
+    """Get a function that evaluates node's commands on a stream of values.
+
+    :return: Function of an iterable returning the list of values, None if
+             the node needs all values at once.
+    """
+
+    part = _single_part(node)
+
+    if part is None or part.order is None or node.post_processors:
+        return None
+
+    return _REDUCERS.get(tuple(c.type for c in part.order))
+
+
+def match_value(match):
+    """Get what re.findall would return for a match.
+    """
+
+    groups = match.re.groups
+
+    if not groups:
+        return match.group()
+    elif groups == 1:
+        return match.group(1) or ''
+
+    return match.groups('')
+
+
+def filter_stream(pattern, values):
+    """Lazily apply a filter pattern to a stream of values.
+
+    Yields the same values, in the same order, as operations.pyser_filter.
+
+    :param pattern: Compiled filter pattern.
+    :param values: Iterable of strings or (nested) lists of strings.
+    :return: Generator of matches.
+    """
+
+    # Counted locally, measured once the stream ends or is closed
+    measured = metrics.active
+    calls = scanned = 0
+
+    try:
+        for value in values:
+            if isinstance(value, list):
+                for match in filter_stream(pattern, value):
+                    yield match
+            elif isinstance(value, basestring):
+                if measured:
+                    calls, scanned = calls + 1, scanned + len(value)
+                for match in pattern.finditer(value):
+                    yield match_value(match)
+            else:
+                raise InternalError('Unsupported data type: %s' % value)
+    finally:
+        if calls:
+            metrics.count('pyser_filter_calls_total', calls)
+            metrics.count('pyser_bytes_scanned_total', scanned)
+
+
+def span_stream(pattern, buffer, spans):
+    """Lazily apply a filter pattern to spans of a buffer.
+
+    Yields spans of the values filter_stream would yield for the substrings,
+    without copying them. Patterns that look before the search start
+    position (see regexinfo.is_position_sensitive) are applied to a copy of
+    each span instead.
+
+    :param pattern: Compiled filter pattern with at most one group.
+    :param buffer: Input data, e.g. a memory-mapped file.
+    :param spans: Iterable of (start, end) offsets into buffer.
+    :return: Generator of (start, end) offsets into buffer.
+    """
+
+    pyser_assert(pattern.groups <= 1, InternalError('Cannot map groups to one span: %s' % pattern.pattern))
+
+    group = 1 if pattern.groups else 0
+    copy = regexinfo.is_position_sensitive(pattern)
+
+    # Counted locally, see filter_stream
+    measured = metrics.active
+    calls = scanned = 0
+
+    try:
+        for start, end in spans:
+            if measured:
+                calls, scanned = calls + 1, scanned + end - start
+            if copy:
+                matches, offset = pattern.finditer(buffer[start:end]), start
+            else:
+                matches, offset = pattern.finditer(buffer, start, end), 0
+
+            for match in matches:
+                match_start, match_end = match.span(group)
+                if match_start < 0:
+                    # Group did not participate, findall gives an empty string
+                    yield 0, 0
+                else:
+                    yield offset + match_start, offset + match_end
+    finally:
+        if calls:
+            metrics.count('pyser_filter_calls_total', calls)
+            metrics.count('pyser_bytes_scanned_total', scanned)
+
+
+def materialize(buffer, spans):
+    """Lazily copy spans of a buffer to strings.
+    """
+
+    for start, end in spans:
+        yield buffer[start:end]
+
+
+def _apply_filter(pattern, values, buffer):
+    """Filter a stream of values, or of spans if buffer is set.
+
+    :return: Filtered stream and the buffer its spans point into (None once
+             values had to be copied).
+    """
+
+    if buffer is not None and pattern.groups > 1:
+        # Several groups give tuples of strings
+        values, buffer = materialize(buffer, values), None
+
+    if buffer is not None:
+        return span_stream(pattern, buffer, values), buffer
+
+    return filter_stream(pattern, values), buffer
+
+
+@footprint
+def run(result, node, executor=None):
+    """Evaluate a parse tree, streaming values between nested nodes.
+
+    Chains of pure filter nodes are evaluated lazily with re.finditer, so no
+    intermediate list of matches is built. A node that needs all its input
+    values at once (identifiers, grouping, multiple parts, most commands)
+    collects the stream and is evaluated by the interpreter; COUNT and
+    DISTINCT consume the stream directly.
+
+    LIMIT of a pure filter node cuts its stream, so nested filters stop
+    calling the regex engine as soon as enough outer values exist.
+
+    Memory-mapped input is streamed as (start, end) spans into the map.
+    Substrings are only copied when a node needs the values themselves.
+
+    :param result: Input data string, memory-mapped file, Result instance or None.
+    :param node: Parse tree root node.
+    :type node: Node
+    :param executor: Evaluates the SELECT parts of nodes the interpreter
+                     evaluates, see interpreter.evaluate.
+    :return: Result instance, equal to interpreter.run(result, node).
+    """
+
+    # Input buffer, set when values is a stream of spans into it
+    buffer = None
+
+    if result is None:
+        result = Result()
+    elif isinstance(result, mmap.mmap):
+        buffer, result = result, Result()
+    elif isinstance(result, basestring):
+        result = Result(data=result)
+
+    pyser_assert(isinstance(node, Node),
+                 InterpreterError('Expected a Node instance: %s' % type(node)))
+    pyser_assert(isinstance(result, Result),
+                 InterpreterError('Expected a Result instance: %s' % result))
+
+    planner.plan(node)
+
+    # Nodes from the innermost one outwards
+    chain = [node]
+    while chain[-1].nested:
+        chain.append(chain[-1].source)
+    chain.reverse()
+
+    # Pending stream of values, supersedes result when set
+    values = None if buffer is None else iter([(0, len(buffer))])
+
+    for current in chain:
+        if is_streamable(current):
+            if values is None:
+                values = iter(result.get_values())
+            values, buffer = _apply_filter(current.parts[0].pattern, values, buffer)
+            if current.limit is not None:
+                values = islice(values, current.limit)
+            continue
+
+        reducer = get_reducer(current) if values is not None else None
+
+        if reducer is not None:
+            logger.debug('reduce stream: %s', current)
+            part = current.parts[0]
+            if buffer is not None and reducer not in _SPAN_REDUCERS:
+                values, buffer = materialize(buffer, values), None
+            if part.pattern is not None:
+                values, buffer = _apply_filter(part.pattern, values, buffer)
+            result = Result(found=reducer(values))
+        else:
+            if buffer is not None:
+                values = materialize(buffer, values)
+            if values is not None:
+                result = Result(found=list(values))
+            result = interpreter.evaluate(result, current, executor)
+
+        values, buffer = None, None
+
+    if buffer is not None:
+        values = materialize(buffer, values)
+
+    if values is not None:
+        result = Result(found=list(values))
+
+    return result
+
+
+@footprint
+def execute(data, node, stream=None, executor=None):
+    """Evaluate a parse tree with the engine that suits it.
+
+    :param data: Input data string, memory-mapped file or None.
+    :param node: Parse tree root node.
+    :type node: Node
+    :param stream: Use the streaming engine; None to use it only when LIMIT
+                   can stop the scan early. Mapped input is always streamed.
+    :param executor: Evaluates the SELECT parts of a node, see
+                     interpreter.evaluate.
+    :return: Result instance.
+    """
+
+    if isinstance(data, mmap.mmap):
+        stream = True
+    elif stream is None:
+        stream = has_limit_pushdown(node)
+
+    if stream:
+        return run(result=data, node=node, executor=executor)
+
+    return interpreter.run(result=data, node=node, executor=executor)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+import logger
+import planner
+import sharding
+import streaming
+from version import __version__
+from operations import Result
+from decorators import footprint
+
+# Bytes at the start of a file compared to recognize it after a rotation
+HEAD_SIZE = 4096
+
+
+class Checkpoint(object):
+    """Scan state of files queried in tail mode, pickled to one file.
+
+    For each (file, query) pair the state holds how far the file was
+    scanned, what the file looked like then (inode and a hash of its first
+    bytes) and the partial result of the scanned lines, see sharding.partial,
+    unless it cannot be merged any more.
+    """
+
+    def __init__(self, path):
+        """Load a checkpoint file.
+
+        :param path: Checkpoint file path, created on save.
+        :type path: str
+        """
+
+        self.path = path
+        self.states = {}
+
+        # Bytes scanned and full rescans since loading
+        self.scanned = 0
+        self.rescans = 0
+
+        try:
+            with open(path, 'rb') as f:
+                states = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError) as e:
+            if not isinstance(e, IOError):
+                logger.warning('Dropping unreadable checkpoint %s: %s', path, e)
+            return
+
+        if isinstance(states, dict) and states.get('version') == __version__:
+            self.states = states['states']
+
+    @staticmethod
+    def key(file_path, query):
+        return os.path.abspath(file_path), query.key
+
+    def get(self, file_path, query):
+        return self.states.get(self.key(file_path, query))
+
+    def set(self, file_path, query, state):
+        self.states[self.key(file_path, query)] = state
+
+    @footprint
+    def save(self):
+        """Write the checkpoint file, atomically replacing the older one.
+        """
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'version': __version__, 'states': self.states}, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def _head_hash(f, size):
+    f.seek(0)
+    return hashlib.sha1(f.read(min(size, HEAD_SIZE))).hexdigest()
+
+
+def _full_scan(f, query, checkpoint):
+    f.seek(0)
+    data = f.read()
+    checkpoint.scanned += len(data)
+    checkpoint.rescans += 1
+
+    return streaming.execute(data, query.node)
+
+
+@footprint
+def run(file_path, query, checkpoint):
+    """Evaluate a query on a growing file, scanning only bytes appended since
+    the last run.
+
+    Queries the planner can evaluate on line-aligned parts of the input
+    (see planner.shard_commands) keep the partial result of all complete
+    lines in the checkpoint. An incomplete last line is evaluated, but
+    scanned again next time. A file with another inode, a changed beginning
+    or fewer bytes than scanned before was rotated or truncated and is
+    scanned from the start. Other queries, and a SUM once a value is not an
+    integer (see sharding.merge), are evaluated on the whole file on every
+    run.
+
+    :param file_path: Input file path.
+    :type file_path: str
+    :param query: CompiledQuery instance.
+    :param checkpoint: Checkpoint instance, saved by the caller.
+    :return: Result instance, equal to that of the serial engines.
+    """
+
+    commands = planner.shard_commands(query.node)
+
+    with open(file_path, 'rb') as f:
+        if commands is None:
+            logger.debug('Tail: %s cannot be maintained incrementally, full scan', query.key)
+            return _full_scan(f, query, checkpoint)
+
+        size = os.fstat(f.fileno()).st_size
+        inode = os.fstat(f.fileno()).st_ino
+        state = checkpoint.get(file_path, query)
+
+        if state is not None and (state['inode'] != inode or state['offset'] > size
+                                  or state['head'] != _head_hash(f, state['offset'])):
+            logger.info('Tail: %s was rotated or truncated, full scan', file_path)
+            state = None
+
+        if state is None:
+            checkpoint.rescans += 1
+            state = {'offset': 0, 'partial': sharding.combine(commands, []), 'incremental': True}
+        elif not state['incremental']:
+            # Kept only to recognize a rotation, which makes a new start
+            logger.debug('Tail: %s is no longer maintained incrementally, full scan', query.key)
+            return _full_scan(f, query, checkpoint)
+
+        f.seek(state['offset'])
+        data = f.read(size - state['offset'])
+        checkpoint.scanned += len(data)
+
+        # Complete lines are done, the rest may still grow
+        end = data.rfind('\n') + 1
+        chain = sharding.get_chain(query.node)
+        partial = sharding.combine(commands, [state['partial'], sharding.evaluate(chain, commands, data[:end])])
+        offset = state['offset'] + end
+
+        incremental = sharding.mergeable(commands, partial)
+        checkpoint.set(file_path, query, {'offset': offset,
+                                          'inode': inode,
+                                          'head': _head_hash(f, offset),
+                                          'partial': partial if incremental else None,
+                                          'incremental': incremental})
+
+        values = sharding.merge(commands, [partial, sharding.evaluate(chain, commands, data[end:])])
+
+        if values is None:
+            logger.debug('Tail: partial results of %s cannot be merged, full scan', query.key)
+            return _full_scan(f, query, checkpoint)
+
+    return Result(found=values)
@@ -1,24 +1,19 @@
 #!/usr/bin/env python
 # coding=utf-8
 
-from HTMLParser import HTMLParser
-from lib import logger, lexer, parser, interpreter
-from lib.parser import Node
-from lib.exceptions import LexerError
-from lib.rules import Type
-from lib.utils import pyser_assert
+import sys
+import time
+import mmap
+import getopt
+from lib import logger, metrics, streaming, batch, parallel, sharding, tail
+from lib.multiquery import MultiQuery
+from lib.batch import get_file_contents, map_file
+from lib.compiler import compile, CompiledQuery, set_store
+from lib.store import ResultStore, RESULT_STORE_SIZE
+from lib.explain import describe, analyze, to_text, to_json
 from lib.decorators import footprint
 
 
-@footprint
-def get_file_contents(path):
-    try:
-        return open(path).read()
-    except IOError:
-        print 'Given file does not exist: %s' % path
-        return None
-
-
 @footprint
 def print_usage_and_exit(error_msg=None):
     if error_msg:
@@ -26,12 +21,42 @@ def print_usage_and_exit(error_msg=None):
 
     usage = '''
     Usage:
-        python pyser.py -d data_file -c code_file [ -D ] [ -t ]
+        python pyser.py -d data_file -c code_file [ -j jobs ] [ -k checkpoint ] [ -D ] [ -t ] [ -m ]
+                        [ --explain | --analyze ] [ --json ]
+        python pyser.py -s counter_set_file [ -r root_dir ] [ -j jobs ] [ -R result_cache ] [ -D ] [ -m ]
+                        [ --metrics metrics_file [ --metrics-interval seconds ] ]
 
-        -d, --data        Data file path
-        -c, --code        Code file path
-        -D  --debug       Turn debug mode on (debug info visible)
-        -t  --run-tests   Run unit tests'''
+        -d, --data         Data file path
+        -c, --code         Code file path
+        -s, --counter-set  Counter-set XML file path, evaluates every counter
+                           on files matching its shader_files glob
+        -r, --root         Directory shader_files globs are relative to
+                           (default: current directory)
+        -j, --jobs         Number of worker processes for a counter set or
+                           for shards of a large data file
+                           (default: 1, 0 for the number of CPUs)
+        -m, --mapped       Memory-map data files
+        -k, --checkpoint   Checkpoint file path; scans only bytes appended to
+                           the data file since the last run
+        -R, --result-cache Result cache database path; counters are only
+                           evaluated on files changed since the last run
+            --result-cache-size
+                           Result cache size bound in MB (default: %d)
+            --metrics      Metrics file path; per-counter latency histograms,
+                           cache hit rates and bytes scanned are written in
+                           the Prometheus text format to a .prom file, as JSON
+                           lines to any other file
+            --metrics-interval
+                           Seconds between two writes of the metrics file
+                           (default: %d)
+            --explain      Print the evaluation plan of the query instead of
+                           its values
+            --analyze      Evaluate the query and print the plan with wall
+                           time, value counts, regex calls and bytes scanned
+                           of each node and SELECT part
+            --json         Print the plan as JSON
+        -D  --debug        Turn debug mode on (debug info visible)
+        -t  --run-tests    Run unit tests''' % (RESULT_STORE_SIZE // (1024 * 1024), metrics.FLUSH_INTERVAL)
 
     print(usage)
 
@@ -39,38 +64,209 @@ def print_usage_and_exit(error_msg=None):
 
 
 @footprint
-def run(file_path, code, debug=False):
+def run(file_path, code, debug=False, plan_cache=None, stream=None, mapped=False, jobs=1, executor=None,
+        checkpoint=None, explain=None, explain_format='text'):
+    """Run a query on a file.
+
+    :param mapped: Memory-map the file instead of reading it; evaluates with
+                   the streaming engine, passing spans of the map between
+                   nested filters instead of copied strings.
+    :param jobs: Number of worker processes evaluating line-aligned shards
+                 of a large file, None for the number of CPUs; queries that
+                 are not shard-safe run in this process.
+    :param executor: Evaluates the SELECT parts of a node concurrently, e.g.
+                     executors.ThreadExecutor or executors.ProcessExecutor;
+                     None to evaluate them one after another.
+    :param checkpoint: Checkpoint file path or tail.Checkpoint instance;
+                       evaluates only bytes appended to the file since the
+                       last run, see tail.run.
+    :param explain: 'plan' to get the evaluation plan instead of the values
+                    (EXPLAIN), 'analyze' to evaluate the query and get the
+                    plan with measurements of each node and SELECT part
+                    (EXPLAIN ANALYZE), see explain.
+    :param explain_format: 'text' or 'json'.
+    :return: New list of values, the caller's to modify; the plan as a
+             string with explain.
+    """
 
     if debug:
         logger.set_verbosity(logger.Verbosity.ALL)
 
-    if file_path:
+    if plan_cache:
+        set_store(plan_cache)
+
+    query = code if isinstance(code, CompiledQuery) else compile(code)
+
+    if explain == 'analyze':
+        _, description = analyze(get_file_contents(file_path) if file_path else None, query.node)
+    elif explain:
+        description = describe(query.node)
+
+    if explain:
+        return to_json(description) if explain_format == 'json' else to_text(description)
+
+    if file_path and checkpoint is not None:
+        if not isinstance(checkpoint, tail.Checkpoint):
+            checkpoint = tail.Checkpoint(checkpoint)
+        result = tail.run(file_path, query, checkpoint)
+        checkpoint.save()
+        return list(result.get_values())
+
+    if file_path and jobs != 1:
+        result = sharding.run(file_path, query.node, jobs=jobs)
+        if result is not None:
+            logger.debug('Input: %s (sharded)', file_path)
+            return list(result.get_values())
+
+    if file_path and mapped:
+        data = map_file(file_path)
+        logger.debug('Input: %s (mapped)', file_path)
+    elif file_path:
         data = get_file_contents(file_path)
+        logger.debug('Input:\n%s', data)
     else:
         data = None
 
-    code = HTMLParser().unescape(code)
+    logger.debug('Code:\n\t\t\t%s\n', query.key)
+
+    try:
+        result = streaming.execute(data, query.node, stream=stream, executor=executor)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+    return list(result.get_values())
 
-    logger.debug('Input:\n%s' % data)
 
-    logger.debug('Code:\n\t\t\t%s\n' % code)
-    
-    tokens = lexer.parse(code) 
+def run_batch(counter_set, root='.', mapped=False, jobs=1, out=sys.stdout, result_cache=None,
+              result_cache_size=RESULT_STORE_SIZE, metrics_file=None, metrics_interval=metrics.FLUSH_INTERVAL):
+    """Evaluate a counter-set XML file and write the report.
+
+    :param result_cache: Result cache database path, see ResultStore.
+    :param result_cache_size: Result cache size bound in bytes.
+    :param metrics_file: File measurements are written to while evaluating,
+                         Prometheus text format for a .prom file, JSON lines
+                         otherwise, see metrics.open_sink.
+    :param metrics_interval: Seconds between two writes of metrics_file.
+    :return: Report summary, see batch.report.
+    """
+
+    sink = metrics.open_sink(metrics_file, metrics_interval) if metrics_file else None
+    if sink is not None:
+        metrics.register(sink)
+
+    try:
+        start_time = time.time()
+        counters = batch.load_counter_set(counter_set)
+        compile_time = time.time() - start_time
 
-    logger.debug('Lexer output:')
-    for i, t in enumerate(tokens):
-        logger.debug('\t%d: %s' % (i, t))
-    logger.debug('')
+        multi_query = MultiQuery()
+        store = ResultStore(result_cache, result_cache_size) if result_cache else None
 
-    pyser_assert(tokens[0].type is Type.COMMAND.SELECT,
-                LexerError('Incorrect type of first token: %s' % tokens[0]))
+        try:
+            results = parallel.run(counters, root=root, mapped=mapped, jobs=jobs, multi_query=multi_query,
+                                   store=store)
+            summary = batch.report(results, out)
+        finally:
+            if store is not None:
+                store.close()
+    finally:
+        if sink is not None:
+            metrics.unregister(sink)
 
-    node = parser.build_tree(tokens)
+    summary['compile_time'] = compile_time
+    summary['counters'] = len(counters)
+    summary.update(multi_query.stats())
 
-    assert isinstance(node, Node)
+    prefilters = [stats for _, stats in batch.prefilter_stats(counters)]
+    summary['prefilter_checked'] = sum(x['checked'] for x in prefilters)
+    summary['prefilter_rejected'] = sum(x['rejected'] for x in prefilters)
 
-    logger.debug('Parser output:\n\n%s' % node)
+    if store is not None:
+        summary.update(('result_cache_%s' % key, value) for key, value in store.stats().items())
+
+    return summary
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, 'd:c:s:r:j:R:k:mDt',
+                                   ['data=', 'code=', 'counter-set=', 'root=', 'jobs=', 'result-cache=',
+                                    'result-cache-size=', 'metrics=', 'metrics-interval=', 'checkpoint=', 'explain',
+                                    'analyze', 'json', 'mapped', 'debug', 'run-tests'])
+    except getopt.GetoptError as e:
+        print_usage_and_exit(str(e))
+
+    if args:
+        print_usage_and_exit('Unexpected arguments: %s' % ' '.join(args))
+
+    options = dict(opts)
+    data_file = options.get('-d', options.get('--data'))
+    code_file = options.get('-c', options.get('--code'))
+    counter_set = options.get('-s', options.get('--counter-set'))
+    root = options.get('-r', options.get('--root', '.'))
+    mapped = '-m' in options or '--mapped' in options
+    result_cache = options.get('-R', options.get('--result-cache'))
+    metrics_file = options.get('--metrics')
+    checkpoint = options.get('-k', options.get('--checkpoint'))
+    explain = 'analyze' if '--analyze' in options else 'plan' if '--explain' in options else None
+    explain_format = 'json' if '--json' in options else 'text'
+
+    try:
+        jobs = int(options.get('-j', options.get('--jobs', 1)))
+    except ValueError:
+        print_usage_and_exit('Number of jobs must be an integer')
+
+    if jobs < 0:
+        print_usage_and_exit('Number of jobs must be 0 or more')
+
+    try:
+        result_cache_size = int(options.get('--result-cache-size', RESULT_STORE_SIZE // (1024 * 1024))) * 1024 * 1024
+    except ValueError:
+        print_usage_and_exit('Result cache size must be an integer')
+
+    try:
+        metrics_interval = float(options.get('--metrics-interval', metrics.FLUSH_INTERVAL))
+    except ValueError:
+        print_usage_and_exit('Metrics interval must be a number')
+
+    if '-D' in options or '--debug' in options:
+        logger.set_verbosity(logger.Verbosity.ALL)
+
+    if '-t' in options or '--run-tests' in options:
+        import unittest
+        unittest.main(module='run_tests', argv=sys.argv[:1])
+    elif counter_set:
+        summary = run_batch(counter_set, root=root, mapped=mapped, jobs=jobs, result_cache=result_cache,
+                            result_cache_size=result_cache_size, metrics_file=metrics_file,
+                            metrics_interval=metrics_interval)
+        elapsed = max(summary['time'], 1e-6)
+        print ('\n%d counters compiled in %.3f s, %d files, %d evaluations in %.3f s '
+               '(%.1f files/s, %.1f counters/s)'
+               % (summary['counters'], summary['compile_time'], summary['files'], summary['evaluations'],
+                  summary['time'], summary['files'] / elapsed, summary['evaluations'] / elapsed))
+        if not mapped:
+            print ('%d distinct subqueries, %d evaluated, %d scans saved'
+                   % (summary['subtrees'], summary['subtree_evaluations'], summary['scans_saved']))
+        print ('prefilter rejected %d of %d searched inputs'
+               % (summary['prefilter_rejected'], summary['prefilter_checked']))
+        if result_cache:
+            lookups = summary['result_cache_hits'] + summary['result_cache_misses']
+            print ('result cache: %d of %d counter values reused (%.1f%%), %d stored, %d evicted'
+                   % (summary['result_cache_hits'], lookups, 100.0 * summary['result_cache_hits'] / max(lookups, 1),
+                      summary['result_cache_writes'], summary['result_cache_evictions']))
+    elif data_file and code_file:
+        code = get_file_contents(code_file)
+        if code is None:
+            exit(1)
+        if explain:
+            print run(data_file, code, explain=explain, explain_format=explain_format)
+            return
+        for value in run(data_file, code, mapped=mapped, jobs=jobs or None, checkpoint=checkpoint):
+            print value
+    else:
+        print_usage_and_exit('Data and code files or a counter-set file required')
 
-    result = interpreter.run(result=data, node=node)
 
-    return result.get_values()
\ No newline at end of file
+if __name__ == '__main__':
+    main(sys.argv[1:])
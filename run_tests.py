@@ -3,23 +3,37 @@
 
 import unittest
 import os
+import re
+import json
+import shutil
+import fnmatch
+import tempfile
 from xml.dom import minidom
 import pyser
-from lib import logger, lexer, parser
+from lib import (logger, lexer, parser, rules, compiler, planner, streaming, batch, parallel, sharding,
+                 regexinfo, executors, tail, explain, metrics, operations)
+from lib.operations import Result
+from lib.multiquery import MultiQuery
+from lib.scanner import MultiScanner
+from lib.prefilter import Prefilter
+from lib.store import ResultStore
+from lib.operations import RE_FLAGS
 from lib.exceptions import LexerError, ParserError, InterpreterError
 
 
 class Test(object):
 
-    def __init__(self, code, result=None, file_path=None):
+    def __init__(self, code, result=None, file_path=None, stream=False):
         self.code = code
         self.result = result
         self.file_path = file_path
+        self.stream = stream
 
     def run(self):
         result = pyser.run(file_path=self.file_path,
                           code=self.code,
-                          debug=False)
+                          debug=False,
+                          stream=self.stream)
         return int(result[0])
 
 
@@ -76,6 +90,38 @@ class LexerTest(TestCase):
 
         self.run_tests(tests)
 
+    def test_engines(self):
+        root = minidom.parse(os.path.join('test', 'metrics.xml'))
+        tests = [counter.getAttribute('comment') for counter in root.getElementsByTagName('counter')]
+        tests += ["SELECT SUM EACHX SUMX SUM_EACH sum each",
+                  "SELECT MAX(C1, 2) MAX (1) REPL(1,2) ** * ^",
+                  "SELECT '\\'\\\\' FROM ( SELECT 'a\\'b' ) GROUP BY 'c'"]
+
+        for test in tests:
+            scanned = [(t.token, t.type) for t in lexer.parse(test, lexer.ENGINE_SCAN)]
+            legacy = [(t.token, t.type) for t in lexer.parse(test, lexer.ENGINE_LEGACY)]
+            self.assertEqual(scanned, legacy)
+
+
+class RulesTest(TestCase):
+
+    def test_find_type(self):
+        tests = [("SUM", rules.Command.SUM),
+                 ("sum each", rules.Command.SUM_EACH),
+                 ("SUMX", rules.Identifier.ID),
+                 ("MAX(C1, 2)", rules.Function.MAX),
+                 ("^", rules.Operator.POW),
+                 ("'\\d+'", rules.RegularExpression.RE),
+                 ("@", None)]
+
+        for token, token_type in tests:
+            self.assertTrue(rules.find_type(token) is token_type)
+
+    def test_categories(self):
+        self.assertTrue(rules.Operator.MUL in rules.OPERATORS)
+        self.assertTrue(rules.Command.COUNT_EACH.category is rules.Command)
+        self.assertFalse(rules.Function.COUNT in rules.COMMANDS)
+
 
 class ParserTest(TestCase):
 
@@ -100,6 +146,94 @@ class ParserTest(TestCase):
 
         self.run_tests_negative(tests)
 
+    def test_error_position(self):
+        tokens = lexer.parse("SELECT 1 FROM (SELECT 1 AS 2)")
+
+        try:
+            parser.build_tree(tokens)
+        except ParserError as e:
+            self.assertTrue('at 7 in' in str(e))
+        else:
+            self.fail('ParserError not raised')
+
+    def test_deep_nesting(self):
+        depth = 300
+        code = "SELECT COUNT FROM (" * depth + "SELECT 'x'" + ")" * depth
+        node = parser.build_tree(lexer.parse(code))
+
+        for _ in range(depth):
+            node = node.source
+
+        self.assertEqual(node.parts[0].filter_, 'x')
+
+
+class CompilerTest(TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(compiler.normalize("select  Count&#10;'\\d+  A' from(SELECT 'x')"),
+                         "SELECT COUNT '\\d+  A' FROM(SELECT 'x')")
+
+    def test_plan_cache(self):
+        compiler.clear_cache()
+
+        first = compiler.compile("SELECT FOO + BAR * 4 FROM &#10;(SELECT 4 AS FOO, 3 AS BAR)")
+        second = compiler.compile("select foo + bar * 4 from (select 4 as foo, 3 as bar)")
+
+        self.assertTrue(first is second)
+        self.assertEqual(compiler.stats()['hits'], 1)
+        self.assertEqual(compiler.stats()['misses'], 1)
+        self.assertEqual(16, int(pyser.run(file_path=None, code=second)[0]))
+
+    def test_patterns(self):
+        query = compiler.compile("SELECT '\\d+' FROM (SELECT '\\[\\d+\\]')")
+
+        self.assertEqual([p.pattern for p in query.patterns], ['\\d+', '\\[\\d+\\]'])
+
+    def test_plan_store(self):
+        code = "SELECT SUM COUNT EACH FROM ( SELECT DISTINCT EACH '[xyzw]+' FROM ( SELECT 'cb0\\[\\d+\\].[xyzw]+' ) )"
+        directory = tempfile.mkdtemp()
+
+        try:
+            compiler.clear_cache()
+            compiler.set_store(directory)
+            expected = pyser.run(file_path='test/PS.asm', code=code)
+
+            compiler.clear_cache()
+            query = compiler.compile(code)
+
+            self.assertEqual(compiler.stats()['store_hits'], 1)
+            self.assertTrue(query.tokens[0].type is rules.Command.SELECT)
+            self.assertEqual(expected, pyser.run(file_path='test/PS.asm', code=query))
+        finally:
+            compiler.set_store(None)
+            shutil.rmtree(directory)
+
+
+class PlannerTest(TestCase):
+
+    def test_constant_folding(self):
+        tests = [("SELECT 2 * 3 + C1 FROM (SELECT 1 AS C1)", ['6', 'C1', '+']),
+                 ("SELECT C1 * (2 + 3) ^ 2 FROM (SELECT 1 AS C1)", ['C1', '25', '*']),
+                 ("SELECT 11 + 13", ['24']),
+                 ("SELECT 1 / 0", ['1', '0', '/'])]
+
+        for code, expected in tests:
+            node = planner.plan(parser.build_tree(lexer.parse(code)))
+            self.assertEqual([t.token for t in node.parts[0].rpn], expected)
+
+    def test_compiled_expression(self):
+        node = planner.plan(parser.build_tree(lexer.parse(
+            "SELECT MAX(C1, 7) * 2 - C2 FROM (SELECT 5 AS C1, 3 AS C2)")))
+        select_node = node.parts[0]
+
+        self.assertTrue(select_node.evaluate is not None)
+
+        result = Result(named_groups={'C1': ['5'], 'C2': ['3']})
+        self.assertEqual(select_node.evaluate(result), 11)
+
+        state = select_node.__getstate__()
+        self.assertTrue(state['evaluate'] is None)
+
 
 class InterpreterTest(TestCase):
 
@@ -203,6 +337,482 @@ class InterpreterTest(TestCase):
 
         self.run_tests(tests)
 
+        for test in tests:
+            test.stream = True
+
+        self.run_tests(tests)
+
+    def test_streaming(self):
+        root = minidom.parse(os.path.join('test', 'metrics.xml'))
+        tests = [counter.getAttribute('comment') for counter in root.getElementsByTagName('counter')]
+        tests += ["SELECT '\\d+' FROM (SELECT '\\w+\\s+(\\d+)' FROM (SELECT 'Input.*Output'))",
+                  "SELECT DISTINCT '[xyzw]+' FROM (SELECT 'dcl_input\\s+v\\d+.[xyzw]+')",
+                  "SELECT '\\d+' FROM (SELECT '\\[\\d+\\]' FROM (SELECT 'cb0\\[\\d+\\]')) LIMIT 2",
+                  "SELECT COUNT FROM (SELECT '[xyzw]+' FROM (SELECT 'mad.*' LIMIT 3))",
+                  "SELECT '\\d+' LIMIT 3 FROM (SELECT 'mad.*' LIMIT 1)"]
+
+        for path in ['test/PS.asm', 'test/VS.asm']:
+            for code in tests:
+                expected = pyser.run(file_path=path, code=code, stream=False)
+                self.assertEqual(expected, pyser.run(file_path=path, code=code, stream=True))
+
+    def test_limit_pushdown(self):
+        tests = [("SELECT '\\d+' FROM (SELECT 'cb0\\[\\d+\\]') LIMIT 1", True),
+                 ("SELECT COUNT FROM (SELECT 'mad' LIMIT 1)", True),
+                 ("SELECT COUNT 'mad' LIMIT 1", False),
+                 ("SELECT 'a' AS A FROM (SELECT 'mad') LIMIT 1", False)]
+
+        for code, expected in tests:
+            self.assertEqual(expected, streaming.has_limit_pushdown(compiler.compile(code).node))
+
+    def test_mapped(self):
+        root = minidom.parse(os.path.join('test', 'metrics.xml'))
+        tests = [counter.getAttribute('comment') for counter in root.getElementsByTagName('counter')]
+        tests += ["SELECT '^\\w+' FROM (SELECT 'dcl_input[^\\n]*')",
+                  "SELECT '(?<=v)\\d+' FROM (SELECT '\\bv\\d+\\.[xyzw]+')",
+                  "SELECT COUNT '(x)?[yzw]+' FROM (SELECT 'mad[^\\n]*' LIMIT 5)",
+                  "SELECT '(\\w+)\\s+(\\w+)' FROM (SELECT 'dcl_\\w+\\s+\\w+')"]
+
+        for path in ['test/PS.asm', 'test/VS.asm']:
+            for code in tests:
+                expected = pyser.run(file_path=path, code=code, stream=False)
+                self.assertEqual(expected, pyser.run(file_path=path, code=code, mapped=True))
+
+    def test_executors(self):
+        tests = ["SELECT 'dcl_\\w+' AS A, COUNT 'mov' AS B, DISTINCT 'r\\d+' AS C, 'v\\d' FROM (SELECT 'dcl.*')",
+                 "SELECT MAX(A, B) FROM (SELECT COUNT 'mov' AS A, COUNT 'mad' AS B)",
+                 "SELECT COUNT EACH GROUP BY '(\\w+)' FROM (SELECT 'dcl_\\w+')",
+                 "SELECT 'cb0\\[\\d+\\]', 'r\\d+'"]
+
+        for executor in [executors.ThreadExecutor(2), executors.ProcessExecutor(2)]:
+            for code in tests:
+                expected = pyser.run(file_path='test/PS.asm', code=code)
+                self.assertEqual(expected, pyser.run(file_path='test/PS.asm', code=code, executor=executor))
+            executor.close()
+
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        for i in range(2):
+            shutil.copy(os.path.join('test', 'PS.asm'), os.path.join(self.directory, 'PS_DX_%d.asm' % i))
+            shutil.copy(os.path.join('test', 'VS.asm'), os.path.join(self.directory, 'VS_DX_%d.asm' % i))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(BatchTest, self).tearDown()
+
+    def test_counter_set(self):
+        counters = batch.load_counter_set(os.path.join('test', 'metrics.xml'))
+        results = list(batch.run(counters, root=self.directory))
+
+        self.assertEqual(sorted(os.path.join(self.directory, x) for x in os.listdir(self.directory)),
+                         [path for path, _ in results])
+
+        for path, values in results:
+            applicable = [c for c in counters if fnmatch.fnmatch(os.path.basename(path), c.shader_files)]
+            self.assertEqual([c.uri for c in applicable], [uri for uri, _ in values])
+            for counter, (_, counter_values) in zip(applicable, values):
+                self.assertEqual(pyser.run(file_path=path, code=counter.query), counter_values)
+
+    def test_parallel(self):
+        counters = batch.load_counter_set(os.path.join('test', 'metrics.xml'))
+        expected = list(batch.run(counters, root=self.directory))
+
+        self.assertEqual(expected, list(parallel.run(counters, root=self.directory, jobs=2)))
+        self.assertEqual(expected, list(parallel.run(counters, root=self.directory, mapped=True, jobs=2)))
+
+    def test_result_store(self):
+        counters = batch.load_counter_set(os.path.join('test', 'metrics.xml'))
+        expected = list(batch.run(counters, root=self.directory))
+        evaluations = sum(len(values) for _, values in expected)
+        store = ResultStore(os.path.join(self.directory, 'results.db'))
+
+        try:
+            self.assertEqual(expected, list(batch.run(counters, root=self.directory, store=store)))
+            self.assertEqual(expected, list(parallel.run(counters, root=self.directory, jobs=2, store=store)))
+            # Both copies of a file share stored values
+            self.assertEqual({'hits': evaluations * 3 // 2, 'misses': evaluations // 2,
+                              'writes': evaluations // 2, 'evictions': 0}, store.stats())
+
+            # Changed file
+            with open(os.path.join(self.directory, 'PS_DX_0.asm'), 'a') as f:
+                f.write('// changed\n')
+            expected = list(batch.run(counters, root=self.directory))
+            changed = len(dict(expected)[os.path.join(self.directory, 'PS_DX_0.asm')])
+
+            self.assertEqual(expected, list(batch.run(counters, root=self.directory, store=store)))
+            self.assertEqual(evaluations // 2 + changed, store.misses)
+
+            store.max_size = store.size() // 2
+            self.assertGreater(store.evict(), 0)
+            self.assertLessEqual(store.size(), store.max_size)
+        finally:
+            store.close()
+
+    def test_deferred_store(self):
+        path = os.path.join(self.directory, 'results.db')
+        query = compiler.compile("SELECT COUNT 'cb0'")
+        store = ResultStore(path)
+        deferred = ResultStore(path, deferred=True)
+
+        try:
+            deferred.save('content', query, [1])
+            self.assertEqual([1], deferred.load('content', query))
+            self.assertIsNone(store.load('content', query))
+
+            store.apply(deferred.changes())
+            self.assertEqual([1], store.load('content', query))
+            self.assertEqual({'saved': [], 'used': []}, deferred.changes())
+        finally:
+            deferred.close()
+            store.close()
+
+    def test_chunks(self):
+        files = [('a', 100, None), ('b', 10, None), ('c', 10, None), ('d', 5, None), ('e', 5, None)]
+        chunks = parallel.make_chunks(files, jobs=2, chunks_per_job=4)
+
+        self.assertEqual([['a'], ['b', 'c'], ['d', 'e']], [[x[0] for x in chunk] for chunk in chunks])
+
+
+class MultiQueryTest(TestCase):
+
+    def test_shared_subtrees(self):
+        tests = ["SELECT 'send.*0x.9s'",
+                 "SELECT  'send.*0x.9s'",
+                 "SELECT '\\d+' FROM (SELECT '\\w+\\s+(\\d+)' FROM (SELECT 'Input.*Output'))",
+                 "SELECT COUNT FROM (SELECT '\\w+\\s+(\\d+)' FROM (SELECT 'Input.*Output'))",
+                 "SELECT COUNT '\\w+' AS A FROM (SELECT 'Input.*Output')"]
+
+        multi_query = MultiQuery()
+        ids = [multi_query.add(compiler.compile(code).node) for code in tests]
+
+        # send, Input.*Output, \w+\s+(\d+), \d+, COUNT, COUNT AS A
+        self.assertEqual(6, len(multi_query))
+
+        for path in ['test/PS.asm', 'test/VS.asm']:
+            results = multi_query.run(pyser.get_file_contents(path), ids)
+            for code, result in zip(tests, results):
+                self.assertEqual(pyser.run(file_path=path, code=code), result.get_values())
+
+        # Per file: second send query, two shared inner nodes, Input.*Output
+        self.assertEqual(2 * 4, multi_query.stats()['scans_saved'])
+
+
+class ScannerTest(TestCase):
+
+    def test_multi_scanner(self):
+        root = minidom.parse(os.path.join('test', 'metrics.xml'))
+        patterns = [p for c in root.getElementsByTagName('counter')
+                    for p in compiler.compile(c.getAttribute('comment')).patterns]
+        patterns += [re.compile(x, RE_FLAGS) for x in
+                     ['dcl', 'dcl_input', 'input', 'v\\d', '^dcl_\\w+', '(?<=_)input', '\\binput',
+                      '(dcl)_(\\w+)', '(x)?[yzw]+', 'mov|mad', '(?:cb|v)\\d+', 'sss', 'i*']]
+
+        for path in ['test/PS.asm', 'test/VS.asm']:
+            data = pyser.get_file_contents(path)
+            expected = [re.compile(p.pattern, p.flags).findall(data) for p in patterns]
+            for prefix_scan in [False, True]:
+                self.assertEqual(expected, MultiScanner(patterns, prefix_scan=prefix_scan).findall(data))
+
+
+class PrefilterTest(TestCase):
+
+    def test_prefilter(self):
+        patterns = ['send.*0x.9s', 'cb0\\[(\\d+)\\]', 'dcl_constantbuffer', '^\\s*mad', 'endif | endloop',
+                    '(?<=r)\\d+', '\\bmov\\b', '(?:ab)+', '(.*)', 'x|', '(mad|mov)\\s+(\\w+)']
+        data = [pyser.get_file_contents(path) for path in ['test/PS.asm', 'test/VS.asm']]
+        data += [line for text in data for line in text.split('\n')]
+
+        for pattern in patterns:
+            regex = re.compile(pattern, RE_FLAGS)
+            prefilter = Prefilter(regex)
+            for text in data:
+                self.assertEqual(regex.findall(text), prefilter.findall(text))
+                self.assertEqual(regex.findall(text, 5, 50), prefilter.findall(text, 5, 50))
+
+        prefilter = Prefilter(re.compile('dcl_constantbuffer cb0\\[(\\d+)\\]', RE_FLAGS))
+        self.assertEqual(('dcl_constantbuffer cb0[', ']'), prefilter.required)
+
+    def test_stats(self):
+        query = compiler.compile("SELECT 'imm_atomic_alloc', 'dcl_\\w+'")
+        alloc, dcl = query.patterns
+        counters = alloc.checked, alloc.rejected, dcl.checked, dcl.rejected
+
+        for path in ['test/PS.asm', 'test/VS.asm']:
+            pyser.run(file_path=path, code=query)
+
+        self.assertEqual((2, 2, 2, 0), tuple(x - y for x, y in zip((alloc.checked, alloc.rejected,
+                                                                     dcl.checked, dcl.rejected), counters)))
+
+
+class ShardingTest(TestCase):
+
+    QUERIES = ["SELECT 'dcl_\\w+'",
+               "SELECT COUNT 'mov'",
+               "SELECT DISTINCT 'r\\d+'",
+               "SELECT DISTINCT COUNT 'cb\\d+\\[\\d+\\]'",
+               "SELECT SUM '\\d+' FROM (SELECT 'cb0\\[\\d+\\]')",
+               "SELECT MIN '\\d+' FROM (SELECT 'cb0\\[\\d+\\]')",
+               "SELECT MAX FROM (SELECT 'dcl_\\w+')",
+               "SELECT MIN 'imm_atomic_alloc'"]
+
+    CONCATENATED = "SELECT SUM 'x' FROM (SELECT 'dcl_\\w+')"
+
+    def setUp(self):
+        super(ShardingTest, self).setUp()
+        data = ''.join(pyser.get_file_contents(path) for path in ['test/PS.asm', 'test/VS.asm'])
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as f:
+            f.write(data * 4)
+
+    def tearDown(self):
+        os.remove(self.path)
+        super(ShardingTest, self).tearDown()
+
+    def test_line_local(self):
+        local = ['imm_atomic_alloc', 'cb0\\[\\d+\\]', '[^\\n]+', '^dcl_\\w+$', '\\bmov\\b']
+        spanning = ['mad\\s+r\\d+', 'send.*0x', '\\Adcl', '(?<=_)input', 'x*', 'a\\nb', '[^x]']
+
+        for pattern in local:
+            self.assertTrue(regexinfo.is_line_local(re.compile(pattern, RE_FLAGS)), pattern)
+        for pattern in spanning:
+            self.assertFalse(regexinfo.is_line_local(re.compile(pattern, RE_FLAGS)), pattern)
+
+    def test_shard_commands(self):
+        self.assertEqual((rules.Command.DISTINCT, rules.Command.COUNT),
+                         planner.shard_commands(compiler.compile(self.QUERIES[3]).node))
+
+        for code in ["SELECT 'mad\\s+r\\d+'", "SELECT 'mov' LIMIT 2", "SELECT COUNT 'mov' + 1",
+                     "SELECT 'mov' AS A", "SELECT 'cb\\d+' FROM (SELECT COUNT 'mov')"]:
+            self.assertIsNone(planner.shard_commands(compiler.compile(code).node), code)
+
+    def test_sharded(self):
+        self.assertGreater(len(sharding.split(self.path, 7)), 5)
+
+        for code in self.QUERIES:
+            query = compiler.compile(code)
+            result = sharding.run(self.path, query.node, jobs=2, shard_size=4096)
+            self.assertIsNotNone(result, code)
+            self.assertEqual(pyser.run(file_path=self.path, code=query), result.get_values(), code)
+
+    def test_concatenated(self):
+        # SUM of strings is a concatenation, not merged from partial results
+        query = compiler.compile(self.CONCATENATED)
+
+        self.assertIsNone(sharding.run(self.path, query.node, jobs=2, shard_size=4096))
+        self.assertEqual(pyser.run(file_path=self.path, code=query, jobs=1),
+                         pyser.run(file_path=self.path, code=query, jobs=2))
+
+
+class TailTest(TestCase):
+
+    def setUp(self):
+        super(TailTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'PS.log')
+        self.checkpoint = tail.Checkpoint(os.path.join(self.directory, 'checkpoint'))
+        self.data = pyser.get_file_contents('test/PS.asm')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TailTest, self).tearDown()
+
+    def append(self, data, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def check(self, queries):
+        for code in queries:
+            expected = pyser.run(file_path=self.path, code=code)
+            self.assertEqual(expected, pyser.run(file_path=self.path, code=code, checkpoint=self.checkpoint), code)
+
+    def test_appended(self):
+        self.append('')
+
+        # Cuts inside lines too, an incomplete line is scanned again
+        line = max(len(x) for x in self.data.splitlines(True))
+
+        for start in range(0, len(self.data), 700):
+            self.append(self.data[start:start + 700])
+            scanned = self.checkpoint.scanned
+            self.check(ShardingTest.QUERIES)
+            self.assertLessEqual(self.checkpoint.scanned - scanned, len(ShardingTest.QUERIES) * (700 + line))
+
+        # Reloaded from disk
+        self.checkpoint = tail.Checkpoint(self.checkpoint.path)
+        self.append(self.data)
+        self.check(ShardingTest.QUERIES)
+        self.assertEqual(0, self.checkpoint.rescans)
+
+    def test_rescans(self):
+        queries = ["SELECT COUNT 'mov'", "SELECT COUNT 'send.*0x'"]
+
+        self.append(self.data * 2)
+        self.check(queries)
+        self.assertEqual(2, self.checkpoint.rescans)
+
+        # Truncated, then rotated
+        self.append(self.data, mode='w')
+        self.check(queries)
+        os.rename(self.path, self.path + '.1')
+        self.append(self.data * 3)
+        self.check(queries)
+        self.assertEqual(6, self.checkpoint.rescans)
+
+    def test_concatenated(self):
+        numeric = "SELECT SUM '\\d+' FROM (SELECT 'cb0\\[\\d+\\]')"
+
+        for _ in range(3):
+            self.append(self.data)
+            self.check([numeric, ShardingTest.CONCATENATED])
+
+        # Integer sums only, the concatenation is scanned again on every run
+        self.assertEqual(5, self.checkpoint.rescans)
+        self.assertIsInstance(self.checkpoint.get(self.path, compiler.compile(numeric))['partial'], int)
+        self.assertFalse(self.checkpoint.get(self.path, compiler.compile(ShardingTest.CONCATENATED))['incremental'])
+
+
+class ExplainTest(TestCase):
+
+    CODE = ("SELECT COUNT '\\d+' AS A, MAX '\\d+' AS B FROM (SELECT '\\[\\d+\\]' "
+            "FROM (SELECT 'dcl_constantbuffer cb0\\[\\d+\\]'))")
+
+    def test_describe(self):
+        description = explain.describe(compiler.compile(self.CODE).node)
+
+        self.assertEqual(['A', 'B'], [part['identifier'] for part in description['parts']])
+        self.assertEqual(['MAX'], description['parts'][1]['order'])
+        self.assertEqual(['dcl_constantbuffer cb0[', ']'],
+                         description['source']['source']['parts'][0]['required_literals'])
+        self.assertIsNone(description['source']['source']['source'])
+        self.assertEqual(description, json.loads(explain.to_json(description)))
+
+    def test_analyze(self):
+        data = pyser.get_file_contents('test/PS.asm')
+        result, description = explain.analyze(data, compiler.compile(self.CODE).node)
+        innermost = description['source']['source']
+
+        self.assertEqual(pyser.run(file_path='test/PS.asm', code=self.CODE), result.get_values())
+        self.assertEqual((1, 1, len(data)), (innermost['input_values'], innermost['parts'][0]['regex_calls'],
+                                             innermost['parts'][0]['bytes_scanned']))
+        self.assertEqual(innermost['output_values'], description['source']['input_values'])
+        self.assertEqual(2, description['output_values'])
+
+        text = pyser.run(file_path='test/PS.asm', code=self.CODE, explain='analyze')
+        self.assertEqual(3, text.count('NODE'))
+        self.assertIn('regex calls 1', text)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join('test', 'PS.asm'), os.path.join(self.directory, 'PS_DX_0.asm'))
+        metrics.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        metrics.reset()
+        super(MetricsTest, self).tearDown()
+
+    def test_inactive(self):
+        pyser.run(file_path='test/PS.asm', code="SELECT COUNT 'cb0\\[\\d+\\]'")
+
+        self.assertFalse(metrics.active)
+        self.assertEqual({'counters': {}, 'histograms': {}}, metrics.snapshot())
+
+    def test_sinks(self):
+        prometheus = metrics.PrometheusSink(os.path.join(self.directory, 'pyser.prom'), interval=3600)
+        json_lines = metrics.JsonLinesSink(os.path.join(self.directory, 'pyser.jsonl'), interval=3600)
+        metrics.register(prometheus)
+        metrics.register(json_lines)
+
+        try:
+            counters = batch.load_counter_set(os.path.join('test', 'metrics.xml'))
+            results = list(parallel.run(counters, root=self.directory, jobs=2))
+        finally:
+            metrics.unregister(prometheus)
+            metrics.unregister(json_lines)
+
+        self.assertFalse(metrics.active)
+        uris = [uri for _, values in results for uri, _ in values]
+        self.assertTrue(uris)
+
+        with open(prometheus.path) as f:
+            text = f.read()
+        for uri in uris:
+            self.assertIn('pyser_counter_seconds_count{uri="%s"} 1' % uri, text)
+        self.assertIn('pyser_plan_cache_hit_ratio', text)
+
+        with open(json_lines.path) as f:
+            lines = [json.loads(line) for line in f]
+        counters = dict((x['name'], x['value']) for x in lines[-1]['counters'] if not x['labels'])
+        self.assertEqual(1, len(lines))
+        self.assertGreaterEqual(counters['pyser_bytes_scanned_total'], os.path.getsize('test/PS.asm'))
+        self.assertEqual(sorted(uris), sorted(x['labels']['uri'] for x in lines[-1]['histograms']
+                                              if x['name'] == 'pyser_counter_seconds'))
+
+
+class ResultTest(TestCase):
+
+    def test_copy_on_write(self):
+        parent = Result(named_groups={'A': ['1']}, anon_groups={0: ['2']}, found=['3'])
+        child = Result(result=parent)
+
+        self.assertIs(parent.found, child.found)
+        self.assertIs(parent.named_groups['A'], child.named_groups['A'])
+
+        child.set_named('B', ['4'])
+        child.found = ['5']
+
+        self.assertEqual({'A': ['1']}, parent.named_groups)
+        self.assertEqual(['3'], parent.found)
+        self.assertEqual(['2', '1', '3'], parent.get_values())
+        self.assertEqual(sorted(['2', '1', '4', '5']), sorted(child.get_values()))
+
+    def test_merge(self):
+        a = Result(anon_groups={0: ['1']})
+        b = Result(anon_groups={0: ['2']})
+
+        self.assertEqual({0: ['1', '2']}, Result.merge(a, b).anon_groups)
+        self.assertEqual({0: ['1']}, a.anon_groups)
+        self.assertIs(a, Result.merge(a))
+
+
+class AggregateTest(TestCase):
+
+    def test_kernels(self):
+        columns = [[], ['7'], ['3', '-12', ' 5', '40'], [2, '10', 1L], ['3', 'x', '12'], ['b', 'a', 'ab'],
+                   ['1', 2, 'c'], ['0x10', '9']]
+
+        for values in columns:
+            # Semantics of the unified values, sorted for MIN and MAX
+            unified = operations.unify(values, sort=True)
+            expected = ([unified[0], unified[-1], reduce(lambda x, y: x + y, operations.unify(values))]
+                        if values else [-1, -1, 0])
+
+            self.assertEqual(expected, [operations.pyser_min(values), operations.pyser_max(values),
+                                        operations.pyser_sum(values)])
+
+    def test_column_cache(self):
+        values = [str(x) for x in range(100)]
+        result = Result(anon_groups={'a': values, 'b': ['4', '2']})
+
+        numbers = result.get_numbers(values)
+        self.assertIs(numbers, result.get_numbers(values))
+        self.assertIsNot(numbers, Result(result=result).get_numbers(values))
+        self.assertIsNot(numbers, result.get_numbers(list(values)))
+
+        self.assertEqual({'a': [0], 'b': [2]}, operations.pyser_min_each(result).anon_groups)
+        self.assertEqual({'a': [99], 'b': [4]}, operations.pyser_max_each(result).anon_groups)
+        self.assertIsNone(operations.numeric(['a'] + values))
+
+        result.found = ['1']
+        self.assertIsNot(numbers, result.get_numbers(values))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file